@@ -0,0 +1,760 @@
+# -*- coding: utf-8 -*-
+"""
+Движки ведения диалога
+Assistants API (threads и run'ы на стороне OpenAI) или Chat Completions
+(история хранится локально, один потоковый запрос на ход)
+"""
+
+import asyncio
+import time
+import logging
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from openai import AsyncOpenAI, RateLimitError
+
+from ai.governor import OpenAIGovernor, PRIORITY_BACKGROUND, PRIORITY_USER, governed
+from ai.resilience import RequestHedger
+from ai.runs import (
+    TERMINAL_RUN_STATUSES, RunRegistry, RunTracker, extract_message_text, fetch_run_output_text
+)
+from ai.thread_gc import ThreadCollector
+from ai.thread_pool import ThreadPool
+from ai.tokens import estimate_messages_tokens, estimate_tokens
+from ai.tools import ASSISTANT_TOOLS, TOOLS_INSTRUCTIONS, ToolHandler, execute_tool_calls, merge_tools
+from storage.history import HistoryStorage
+from storage.threads import ThreadStorage
+
+logger = logging.getLogger(__name__)
+
+# Получатель накопленного текста ответа по мере генерации
+TextCallback = Callable[[str], Awaitable[None]]
+
+ACTIVE_RUN_STATUSES = ['queued', 'in_progress', 'requires_action']
+RUN_STOP_STATUSES = TERMINAL_RUN_STATUSES | {'requires_action'}
+# Сколько раз модель chat может вызвать инструменты за один ход
+MAX_TOOL_ROUNDS = 5
+RUN_STREAM_FINAL_EVENTS = (
+    'thread.run.completed',
+    'thread.run.failed',
+    'thread.run.cancelled',
+    'thread.run.expired',
+    'thread.run.incomplete',
+)
+
+
+@dataclass
+class TurnResult:
+    """Результат одного хода диалога"""
+    status: str          # completed или статус ошибки (failed, timeout, ...)
+    text: str = ""       # Текст ответа (сырой, с метками source)
+    tool_calls: int = 0  # Сколько инструментов вызвано за ход
+
+
+class ConversationBackend(ABC):
+    """Интерфейс движка диалога"""
+
+    name: str = ""
+    # Готовит ли движок сам ответ до открытия gate (иначе до него - только чтение)
+    speculative_generation: bool = False
+
+    @abstractmethod
+    async def run_turn(self,
+                       user_id: str,
+                       message_text: str,
+                       on_text: Optional[TextCallback] = None,
+                       tool_handler: Optional[ToolHandler] = None,
+                       gate: Optional[asyncio.Event] = None) -> TurnResult:
+        """
+        Выполняет ход диалога: добавляет сообщение пользователя и получает ответ
+
+        При отмене задачи движок сам освобождает ресурсы на стороне OpenAI.
+        До открытия gate движок не меняет диалог пользователя, поэтому
+        отмененный спекулятивный ход не оставляет следов.
+
+        Args:
+            user_id: ID пользователя
+            message_text: Текст сообщения
+            on_text: Вызывается с накопленным текстом по мере генерации
+            tool_handler: Обработчик инструментов отправки файлов (None - без инструментов)
+            gate: Событие подтверждения спекулятивного хода (None - ход подтвержден)
+
+        Returns:
+            TurnResult: Статус и текст ответа
+        """
+
+    @abstractmethod
+    def has_context(self, user_id: str) -> bool:
+        """
+        Проверяет, есть ли у пользователя предыдущий контекст диалога
+
+        Returns:
+            bool: True если следующий ход продолжит начатый диалог
+        """
+
+    @abstractmethod
+    async def reset(self, user_id: str) -> bool:
+        """
+        Забывает контекст диалога пользователя
+
+        Returns:
+            bool: True если контекст был
+        """
+
+    @abstractmethod
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику движка"""
+
+
+class AssistantsBackend(ConversationBackend):
+    """Диалог через Assistants API: thread на пользователя, run на каждый ход"""
+
+    name = "assistants"
+
+    def __init__(self,
+                 openai_client: AsyncOpenAI,
+                 assistant_id: str,
+                 storage: ThreadStorage,
+                 registry: RunRegistry,
+                 tracker: RunTracker,
+                 governor: Optional[OpenAIGovernor] = None,
+                 thread_pool: Optional[ThreadPool] = None,
+                 hedger: Optional[RequestHedger] = None,
+                 collector: Optional[ThreadCollector] = None,
+                 run_timeout: float = 60,
+                 run_tokens_estimate: int = 2000):
+        """
+        Инициализация движка
+
+        Args:
+            openai_client: Клиент OpenAI
+            assistant_id: ID ассистента
+            storage: Хранилище threads пользователей
+            registry: Реестр активных run'ов
+            tracker: Общий опрос статусов run'ов
+            governor: Регулятор запросов к OpenAI
+            thread_pool: Пул заранее созданных threads
+            hedger: Дублирование медленных запросов messages.list
+            collector: Сборщик threads (удаляет в OpenAI threads сброшенных диалогов)
+            run_timeout: Максимальное время хода (сек)
+            run_tokens_estimate: Оценка токенов одного run'а для лимита TPM
+        """
+        self.openai_client = openai_client
+        self.assistant_id = assistant_id
+        self.storage = storage
+        self.registry = registry
+        self.tracker = tracker
+        self.governor = governor
+        self.thread_pool = thread_pool
+        self.hedger = hedger
+        self.collector = collector
+        self.run_timeout = run_timeout
+        self.run_tokens_estimate = run_tokens_estimate
+
+        # Инструменты ассистента вместе с инструментами отправки файлов
+        self._run_tools: Optional[List[Dict[str, Any]]] = None
+
+    async def _call(self, fn, *args, tokens: int = 0, **kwargs):
+        """Запрос к OpenAI через регулятор в полосе пользователя"""
+        return await governed(self.governor, fn, *args, priority=PRIORITY_USER, tokens=tokens, **kwargs)
+
+    async def get_or_create_thread(self, user_id: str) -> str:
+        """Get existing thread or create new one for user."""
+        thread_id = self.storage.get(user_id)
+        if not thread_id:
+            try:
+                thread_id = self.thread_pool.acquire() if self.thread_pool else None
+                if thread_id:
+                    self.storage.set(user_id, thread_id)
+                    self.registry.mark_idle(thread_id)
+                    logger.info(f"Assigned pooled thread for user {user_id}: {thread_id}")
+                    return thread_id
+
+                thread = await self._call(self.openai_client.beta.threads.create)
+                self.storage.set(user_id, thread.id)
+                self.registry.mark_idle(thread.id)
+                logger.info(f"Created new thread for user {user_id}: {thread.id}")
+                return thread.id
+            except Exception as e:
+                logger.error(f"Error creating thread for user {user_id}: {e}")
+                raise
+        self.storage.touch(user_id)
+        return thread_id
+
+    async def prepare_thread(self,
+                             user_id: str,
+                             message_text: str,
+                             gate: Optional[asyncio.Event] = None) -> str:
+        """Get user's thread, wait for its active run and add the user message once the gate opens."""
+        thread_id = await self.get_or_create_thread(user_id)
+
+        try:
+            # Активные run'ы известны локально; runs.list нужен только для незнакомых threads
+            if self.registry.is_known(thread_id):
+                active_run = self.registry.get_active(thread_id)
+            else:
+                runs = await self._call(
+                    self.openai_client.beta.threads.runs.list,
+                    thread_id=thread_id,
+                    limit=1
+                )
+                active_run = runs.data[0] if runs.data else None
+                if active_run and active_run.status in ACTIVE_RUN_STATUSES:
+                    self.registry.update(thread_id, active_run)
+                else:
+                    active_run = None
+                    self.registry.mark_idle(thread_id)
+
+            if active_run:
+                logger.info(f"Waiting for active run to complete for user {user_id}")
+                active_run = await self.tracker.wait(thread_id, active_run, timeout=30)
+                self.registry.update(thread_id, active_run)
+
+                if active_run.status in ACTIVE_RUN_STATUSES:
+                    logger.warning(f"Timeout waiting for active run for user {user_id}")
+                    await self.cancel_run_quietly(thread_id, active_run.id)
+        except Exception as e:
+            logger.warning(f"Error checking active runs: {e}")
+
+        # Сообщение остается в thread навсегда - добавляем его только в подтвержденный ход
+        if gate is not None:
+            await gate.wait()
+
+        # Add user message to thread with retry logic
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                await self._call(
+                    self.openai_client.beta.threads.messages.create,
+                    tokens=estimate_tokens(message_text),
+                    thread_id=thread_id,
+                    role="user",
+                    content=message_text
+                )
+                break
+            except RateLimitError:
+                # Повторы по 429 (с учетом Retry-After) уже выполнил регулятор
+                raise
+            except Exception as e:
+                logger.warning(f"Attempt {attempt + 1} failed to add message: {e}")
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(2)  # Wait before retry
+                else:
+                    raise e
+
+        return thread_id
+
+    async def _run_options(self, tool_handler: Optional[ToolHandler]) -> Dict[str, Any]:
+        """Run-level overrides that expose the file-sending tools to the assistant."""
+        if tool_handler is None:
+            return {}
+        if self._run_tools is None:
+            # Инструменты run'а заменяют инструменты ассистента - сохраняем его собственные
+            assistant = await self._call(
+                self.openai_client.beta.assistants.retrieve,
+                assistant_id=self.assistant_id
+            )
+            self._run_tools = merge_tools(assistant.tools, ASSISTANT_TOOLS)
+        return {"tools": self._run_tools, "additional_instructions": TOOLS_INSTRUCTIONS}
+
+    async def cancel_run_quietly(self, thread_id: str, run_id: str) -> None:
+        """Cancel a run that can no longer finish, ignoring errors."""
+        try:
+            await self._call(
+                self.openai_client.beta.threads.runs.cancel,
+                thread_id=thread_id,
+                run_id=run_id
+            )
+        except Exception:
+            pass
+
+    async def _release_run(self, thread_id: str, run) -> None:
+        """Cancel a run that ended the turn without an answer and free its thread."""
+        if run.status not in TERMINAL_RUN_STATUSES:
+            await self.cancel_run_quietly(thread_id, run.id)
+        # Иначе следующий ход ждал бы в prepare_thread, пока run считается активным
+        self.registry.mark_idle(thread_id)
+
+    def _abandon(self, thread_id: Optional[str], run) -> None:
+        """Release the run of a cancelled turn."""
+        if not thread_id or (run is not None and run.status in TERMINAL_RUN_STATUSES):
+            return
+        if run is None:
+            # Run мог успеть создаться - следующий ход проверит thread через API
+            self.registry.forget(thread_id)
+            return
+        asyncio.create_task(self.cancel_run_quietly(thread_id, run.id))
+
+    async def run_turn(self,
+                       user_id: str,
+                       message_text: str,
+                       on_text: Optional[TextCallback] = None,
+                       tool_handler: Optional[ToolHandler] = None,
+                       gate: Optional[asyncio.Event] = None) -> TurnResult:
+        """Run the assistant on the user's thread, streaming when on_text is given."""
+        if on_text is not None:
+            return await self._stream_turn(user_id, message_text, on_text, tool_handler, gate)
+        return await self._poll_turn(user_id, message_text, tool_handler, gate)
+
+    async def _poll_turn(self,
+                         user_id: str,
+                         message_text: str,
+                         tool_handler: Optional[ToolHandler],
+                         gate: Optional[asyncio.Event] = None) -> TurnResult:
+        """Create a run and wait for it through the shared run tracker."""
+        thread_id = None
+        run = None
+        try:
+            thread_id = await self.prepare_thread(user_id, message_text, gate)
+
+            run = await self._call(
+                self.openai_client.beta.threads.runs.create,
+                tokens=self.run_tokens_estimate,
+                thread_id=thread_id,
+                assistant_id=self.assistant_id,
+                **await self._run_options(tool_handler)
+            )
+            self.registry.update(thread_id, run)
+
+            # Wait for completion with timeout, executing tool calls along the way
+            deadline = time.monotonic() + self.run_timeout
+            tool_calls = 0
+            while True:
+                run = await self.tracker.wait(
+                    thread_id, run,
+                    timeout=max(deadline - time.monotonic(), 0),
+                    stop_statuses=RUN_STOP_STATUSES
+                )
+                self.registry.update(thread_id, run)
+                if run.status != 'requires_action' or tool_handler is None:
+                    break
+
+                tool_outputs = await execute_tool_calls(
+                    run.required_action.submit_tool_outputs.tool_calls, tool_handler
+                )
+                tool_calls += len(tool_outputs)
+                run = await self._call(
+                    self.openai_client.beta.threads.runs.submit_tool_outputs,
+                    thread_id=thread_id,
+                    run_id=run.id,
+                    tool_outputs=tool_outputs
+                )
+                self.registry.update(thread_id, run)
+
+            text = None
+            if run.status == 'completed':
+                text = await fetch_run_output_text(
+                    self.openai_client, thread_id, run.id, self.governor, self.hedger
+                )
+            elif run.status not in TERMINAL_RUN_STATUSES:
+                # Истек таймаут или без обработчика инструментов run не продвинется
+                await self._release_run(thread_id, run)
+            return TurnResult(status=run.status, text=text or "", tool_calls=tool_calls)
+
+        except asyncio.CancelledError:
+            self._abandon(thread_id, run)
+            raise
+
+    async def _consume_stream(self, stream, on_text: TextCallback, state: Dict[str, Any], thread_id: str) -> None:
+        """Read Assistants stream events, passing the accumulated text to on_text."""
+        async for event in stream:
+            if event.event == 'thread.run.created':
+                state["run"] = event.data
+                self.registry.update(thread_id, event.data)
+            elif event.event == 'thread.message.delta':
+                for part in event.data.delta.content or []:
+                    if getattr(part, 'type', None) == 'text' and part.text and part.text.value:
+                        state["text"] += part.text.value
+                await on_text(state["text"])
+            elif event.event == 'thread.message.completed':
+                state["text"] = state["prefix"] + extract_message_text(event.data)
+            elif event.event == 'thread.run.requires_action':
+                # Run ждет результатов инструментов - поток на этом заканчивается
+                state["run"] = event.data
+                state["status"] = event.data.status
+                self.registry.update(thread_id, event.data)
+                return
+            elif event.event in RUN_STREAM_FINAL_EVENTS:
+                state["run"] = event.data
+                state["status"] = event.data.status
+                self.registry.update(thread_id, event.data)
+                return
+            elif event.event == 'error':
+                state["status"] = 'error'
+                return
+
+    async def _stream_turn(self,
+                           user_id: str,
+                           message_text: str,
+                           on_text: TextCallback,
+                           tool_handler: Optional[ToolHandler],
+                           gate: Optional[asyncio.Event] = None) -> TurnResult:
+        """Create a streamed run and follow its events."""
+        state = {"run": None, "status": None, "text": "", "prefix": "", "tool_calls": 0}
+        thread_id = None
+        try:
+            thread_id = await self.prepare_thread(user_id, message_text, gate)
+
+            # Слот регулятора занимается только на открытие потока, не на все чтение
+            stream = await self._call(
+                self.openai_client.beta.threads.runs.create,
+                tokens=self.run_tokens_estimate,
+                thread_id=thread_id,
+                assistant_id=self.assistant_id,
+                stream=True,
+                **await self._run_options(tool_handler)
+            )
+            deadline = time.monotonic() + self.run_timeout
+            while True:
+                try:
+                    await asyncio.wait_for(
+                        self._consume_stream(stream, on_text, state, thread_id),
+                        timeout=max(deadline - time.monotonic(), 0)
+                    )
+                except asyncio.TimeoutError:
+                    state["status"] = 'timeout'
+                finally:
+                    await stream.close()
+                if state["status"] != 'requires_action' or tool_handler is None:
+                    break
+
+                # Выполняем инструменты и продолжаем run новым потоком
+                tool_outputs = await execute_tool_calls(
+                    state["run"].required_action.submit_tool_outputs.tool_calls, tool_handler
+                )
+                state["tool_calls"] += len(tool_outputs)
+                state["status"] = None
+                state["prefix"] = state["text"] + "\n\n" if state["text"] else ""
+                state["text"] = state["prefix"]
+                stream = await self._call(
+                    self.openai_client.beta.threads.runs.submit_tool_outputs,
+                    thread_id=thread_id,
+                    run_id=state["run"].id,
+                    tool_outputs=tool_outputs,
+                    stream=True
+                )
+
+            if state["run"] and state["status"] != 'completed':
+                # Поток оборвался, истек таймаут или run завершился ошибкой
+                await self._release_run(thread_id, state["run"])
+            return TurnResult(
+                status=state["status"] or 'incomplete',
+                text=state["text"].strip(),
+                tool_calls=state["tool_calls"]
+            )
+
+        except asyncio.CancelledError:
+            self._abandon(thread_id, state["run"])
+            raise
+
+    def has_context(self, user_id: str) -> bool:
+        """The user already has a thread with earlier turns."""
+        return self.storage.get(user_id) is not None
+
+    async def reset(self, user_id: str) -> bool:
+        """Detach the user's thread so the next turn starts a new one."""
+        thread_id = self.storage.get(user_id)
+        if not thread_id:
+            return False
+        self.storage.delete(user_id)
+        self.registry.forget(thread_id)
+        if self.collector:
+            self.collector.enqueue(thread_id)
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику движка
+
+        Returns:
+            Dict[str, Any]: Статистика
+        """
+        stats = {
+            "backend": self.name,
+            "conversations": len(self.storage)
+        }
+        if self.collector:
+            stats["threads_gc"] = self.collector.get_stats()
+        return stats
+
+
+class ChatCompletionsBackend(ConversationBackend):
+    """Диалог через Chat Completions: история хранится локально, один потоковый запрос на ход"""
+
+    name = "chat"
+    speculative_generation = True
+
+    def __init__(self,
+                 openai_client: AsyncOpenAI,
+                 history: HistoryStorage,
+                 model: Optional[str] = None,
+                 instructions: Optional[str] = None,
+                 assistant_id: Optional[str] = None,
+                 governor: Optional[OpenAIGovernor] = None,
+                 max_tokens: int = 1000,
+                 timeout: float = 60,
+                 summarize: bool = False,
+                 summary_max_tokens: int = 300,
+                 summary_batch_tokens: int = 500):
+        """
+        Инициализация движка
+
+        Args:
+            openai_client: Клиент OpenAI
+            history: Хранилище истории диалогов
+            model: Модель (по умолчанию - модель ассистента или gpt-4o-mini)
+            instructions: Системный промпт (по умолчанию - инструкции ассистента)
+            assistant_id: Ассистент, из которого берутся модель и инструкции
+            governor: Регулятор запросов к OpenAI
+            max_tokens: Максимальная длина ответа (токенов)
+            timeout: Максимальное время хода (сек)
+            summarize: Сжимать вытесненные из окна сообщения в краткое резюме
+            summary_max_tokens: Максимальная длина резюме (токенов)
+            summary_batch_tokens: Сколько токенов вытесненных сообщений копить до обновления резюме
+        """
+        self.openai_client = openai_client
+        self.history = history
+        self.model = model
+        self.instructions = instructions
+        self.assistant_id = assistant_id
+        self.governor = governor
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        self.summarize = summarize
+        self.summary_max_tokens = summary_max_tokens
+        self.summary_batch_tokens = summary_batch_tokens
+        # Пользователи, для которых сейчас обновляется резюме
+        self._summarizing: Dict[str, asyncio.Task] = {}
+
+        # Статистика
+        self.requests_count = 0
+        self.prompt_tokens_estimate = 0
+        self.summaries_count = 0
+
+    async def _ensure_config(self) -> None:
+        """Берет модель и инструкции у ассистента, если они не заданы явно"""
+        if self.model and self.instructions is not None:
+            return
+        model, instructions = "gpt-4o-mini", ""
+        if self.assistant_id:
+            assistant = await governed(
+                self.governor,
+                self.openai_client.beta.assistants.retrieve,
+                priority=PRIORITY_USER,
+                assistant_id=self.assistant_id
+            )
+            model, instructions = assistant.model, assistant.instructions or ""
+        self.model = self.model or model
+        if self.instructions is None:
+            self.instructions = instructions
+        logger.info(f"Chat backend uses model {self.model}")
+
+    async def run_turn(self,
+                       user_id: str,
+                       message_text: str,
+                       on_text: Optional[TextCallback] = None,
+                       tool_handler: Optional[ToolHandler] = None,
+                       gate: Optional[asyncio.Event] = None) -> TurnResult:
+        """Send the budgeted local history as a streaming chat completion, feeding tool results back."""
+        await self._ensure_config()
+
+        # Окно истории уже укладывается в бюджет - хранилище сдвигает его при добавлении
+        context = self.history.get_context(user_id) + [{"role": "user", "content": message_text}]
+        instructions = self.instructions
+        options: Dict[str, Any] = {}
+        if tool_handler is not None:
+            instructions = f"{instructions}\n\n{TOOLS_INSTRUCTIONS}".strip()
+            options["tools"] = ASSISTANT_TOOLS
+        messages = ([{"role": "system", "content": instructions}] if instructions else []) + context
+
+        deadline = time.monotonic() + self.timeout
+        tool_calls_count = 0
+        tool_names: List[str] = []
+        confirmed = gate is None
+        prefix = ""
+        for _ in range(MAX_TOOL_ROUNDS):
+            state = await self._complete(messages, options, on_text, prefix, deadline)
+            finish_reason = state["finish_reason"]
+            if state["timeout"]:
+                return TurnResult(status='timeout', text=state["text"], tool_calls=tool_calls_count)
+            if finish_reason is None:
+                return TurnResult(status='incomplete', text=state["text"], tool_calls=tool_calls_count)
+            if finish_reason == 'content_filter':
+                return TurnResult(status='failed', text=state["text"], tool_calls=tool_calls_count)
+
+            tool_calls = [
+                SimpleNamespace(id=call["id"], function=SimpleNamespace(name=call["name"], arguments=call["arguments"]))
+                for _, call in sorted(state["tool_calls"].items())
+            ]
+            tool_names.extend(call.function.name for call in tool_calls)
+            # Запрос ничего не меняет - ответ готовится заранее, а инструменты и история ждут подтверждения
+            if not confirmed:
+                await gate.wait()
+                confirmed = True
+            if not tool_calls or tool_handler is None:
+                break
+
+            # Результаты инструментов возвращаются модели, и она продолжает ответ
+            tool_outputs = await execute_tool_calls(tool_calls, tool_handler)
+            tool_calls_count += len(tool_outputs)
+            messages.append({
+                "role": "assistant",
+                "content": state["text"][len(prefix):] or None,
+                "tool_calls": [
+                    {"id": call.id, "type": "function",
+                     "function": {"name": call.function.name, "arguments": call.function.arguments}}
+                    for call in tool_calls
+                ]
+            })
+            messages.extend(
+                {"role": "tool", "tool_call_id": output["tool_call_id"], "content": output["output"]}
+                for output in tool_outputs
+            )
+            prefix = state["text"] + "\n\n" if state["text"] else ""
+        else:
+            logger.warning(f"Chat turn for user {user_id} stopped after {MAX_TOOL_ROUNDS} tool rounds")
+            return TurnResult(status='incomplete', text=state["text"].strip(), tool_calls=tool_calls_count)
+
+        # В историю попадает только завершенный и подтвержденный ход
+        text = state["text"].strip()
+        self.history.append(user_id, "user", message_text)
+        self.history.append(user_id, "assistant", text or ", ".join(f"[{name}]" for name in tool_names))
+        self._schedule_summary(user_id)
+        return TurnResult(status='completed', text=text, tool_calls=tool_calls_count)
+
+    async def _complete(self,
+                        messages: List[Dict[str, Any]],
+                        options: Dict[str, Any],
+                        on_text: Optional[TextCallback],
+                        prefix: str,
+                        deadline: float) -> Dict[str, Any]:
+        """Run one streaming completion; the text accumulates after prefix."""
+        prompt_tokens = estimate_messages_tokens(messages)
+        self.requests_count += 1
+        self.prompt_tokens_estimate += prompt_tokens
+        stream = await governed(
+            self.governor,
+            self.openai_client.chat.completions.create,
+            priority=PRIORITY_USER,
+            tokens=prompt_tokens + self.max_tokens,
+            model=self.model,
+            messages=messages,
+            max_tokens=self.max_tokens,
+            stream=True,
+            **options
+        )
+
+        state = {"text": prefix, "tool_calls": {}, "finish_reason": None, "timeout": False}
+        try:
+            await asyncio.wait_for(
+                self._consume_stream(stream, on_text, state),
+                timeout=max(deadline - time.monotonic(), 0)
+            )
+        except asyncio.TimeoutError:
+            state["timeout"] = True
+        finally:
+            await stream.close()
+        return state
+
+    async def _consume_stream(self, stream, on_text: Optional[TextCallback], state: Dict[str, Any]) -> None:
+        """Accumulate streamed content and tool call fragments."""
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            delta = choice.delta
+            if delta.content:
+                state["text"] += delta.content
+                if on_text is not None:
+                    await on_text(state["text"])
+            for call in delta.tool_calls or []:
+                entry = state["tool_calls"].setdefault(call.index, {"id": "", "name": "", "arguments": ""})
+                if call.id:
+                    entry["id"] = call.id
+                if call.function and call.function.name:
+                    entry["name"] += call.function.name
+                if call.function and call.function.arguments:
+                    entry["arguments"] += call.function.arguments
+            if choice.finish_reason:
+                state["finish_reason"] = choice.finish_reason
+
+    def _schedule_summary(self, user_id: str) -> None:
+        """Start a background summary update once enough messages left the window."""
+        if not self.summarize or user_id in self._summarizing:
+            return
+        # Хранилище не держит больше pending_budget_tokens - не ждем больше этого
+        threshold = min(self.summary_batch_tokens, self.history.pending_budget_tokens)
+        if self.history.pending_tokens(user_id) < max(threshold, 1):
+            return
+        task = asyncio.create_task(self._update_summary(user_id))
+        self._summarizing[user_id] = task
+        task.add_done_callback(lambda done: self._forget_summary_task(user_id, done))
+
+    def _forget_summary_task(self, user_id: str, task: asyncio.Task) -> None:
+        """Drop a finished summary task unless a newer one replaced it."""
+        if self._summarizing.get(user_id) is task:
+            del self._summarizing[user_id]
+
+    async def _update_summary(self, user_id: str) -> None:
+        """Fold the messages evicted from the window into the rolling summary."""
+        pending, covers = self.history.get_pending(user_id)
+        summary = self.history.get_summary(user_id)
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in pending)
+        messages = [
+            {
+                "role": "system",
+                "content": (
+                    "Обнови краткое содержание диалога поддержки с клиентом. "
+                    "Сохрани факты, договоренности и вопросы клиента, без приветствий и повторов. "
+                    "Ответь только новым кратким содержанием."
+                )
+            },
+            {"role": "user", "content": f"Текущее краткое содержание:\n{summary or '(нет)'}\n\nНовые сообщения:\n{transcript}"}
+        ]
+        try:
+            response = await governed(
+                self.governor,
+                self.openai_client.chat.completions.create,
+                priority=PRIORITY_BACKGROUND,
+                tokens=estimate_messages_tokens(messages) + self.summary_max_tokens,
+                model=self.model,
+                messages=messages,
+                max_tokens=self.summary_max_tokens
+            )
+        except Exception as e:
+            logger.warning(f"Error updating summary for user {user_id}: {e}")
+            return
+
+        text = (response.choices[0].message.content or "").strip() if response.choices else ""
+        if not text:
+            return
+        self.history.set_summary(user_id, text, covers)
+        self.summaries_count += 1
+        logger.debug(f"Updated summary for user {user_id} ({len(pending)} messages folded)")
+
+    def has_context(self, user_id: str) -> bool:
+        """The user already has local history."""
+        return self.history.has_history(user_id)
+
+    async def reset(self, user_id: str) -> bool:
+        """Forget the user's local history."""
+        task = self._summarizing.pop(user_id, None)
+        if task:
+            task.cancel()
+        return self.history.clear(user_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику движка
+
+        Returns:
+            Dict[str, Any]: Статистика
+        """
+        return {
+            "backend": self.name,
+            "conversations": len(self.history),
+            "requests": self.requests_count,
+            "summaries": self.summaries_count,
+            "avg_prompt_tokens": self.prompt_tokens_estimate / self.requests_count if self.requests_count else 0.0
+        }
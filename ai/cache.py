@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""
+Кэши ответов ИИ
+LRU-кэш с TTL и ограничением памяти, кэш ответов ассистента на частые вопросы
+и кэш результатов определения типа запроса
+"""
+
+import asyncio
+import json
+import os
+import re
+import time
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from bot.filters import normalize_text
+
+logger = logging.getLogger(__name__)
+
+
+def _estimate_size(key: Hashable, value: Any) -> int:
+    """Грубая оценка занимаемой записью памяти (байт)"""
+    return len(str(key).encode('utf-8')) + len(str(value).encode('utf-8'))
+
+
+class TTLCache:
+    """LRU-кэш с временем жизни записей и ограничением по памяти"""
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600, max_bytes: Optional[int] = None):
+        """
+        Инициализация кэша
+
+        Args:
+            max_entries: Максимальное количество записей
+            ttl: Время жизни записи (сек)
+            max_bytes: Ограничение суммарного размера записей (байт), None - без ограничения
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        # key -> (expires_at, value, size), порядок - от давно использованных к недавним
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any, int]]" = OrderedDict()
+        self._bytes = 0
+
+        # Статистика
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Получает значение по ключу
+
+        Args:
+            key: Ключ записи
+
+        Returns:
+            Значение или None, если записи нет или она устарела
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value, _ = entry
+        if expires_at < time.time():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Сохраняет значение
+
+        Args:
+            key: Ключ записи
+            value: Значение
+            ttl: Время жизни записи (сек), по умолчанию - общее для кэша
+        """
+        size = _estimate_size(key, value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (expires_at, value, size)
+        self._bytes += size
+
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key: Hashable) -> None:
+        """Удаляет запись и учитывает освобожденную память"""
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self) -> None:
+        """Очищает кэш"""
+        self._entries.clear()
+        self._bytes = 0
+
+    def dump(self) -> List[Tuple[Hashable, Any, float]]:
+        """
+        Возвращает неустаревшие записи от давно использованных к недавним
+
+        Returns:
+            Список (ключ, значение, время истечения)
+        """
+        now = time.time()
+        return [(key, value, expires_at) for key, (expires_at, value, _) in self._entries.items() if expires_at > now]
+
+    def __len__(self) -> int:
+        """Возвращает количество записей"""
+        return len(self._entries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику кэша
+
+        Returns:
+            Dict[str, Any]: Статистика
+        """
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / total if total else 0.0
+        }
+
+
+# Слова, по которым видно, что вопрос зависит от предыдущего контекста диалога
+_CONTEXT_WORDS = {
+    "это", "этот", "эта", "эти", "того", "тогда", "там", "тут", "он", "она", "они",
+    "его", "ее", "их", "мой", "моя", "мое", "мои", "моего", "моей", "мне", "меня",
+    "еще", "ещё", "выше", "ранее", "предыдущий"
+}
+
+_DIGITS_PATTERN = re.compile(r'\d')
+
+
+def is_cacheable_question(question: str, max_words: int = 12) -> bool:
+    """
+    Проверяет, можно ли отвечать на вопрос общим ответом
+
+    Короткие вопросы без чисел (количеств, номеров заказов) и без отсылок
+    к контексту диалога одинаковы для всех пользователей. Отсылки угадываются
+    по словам неполно, поэтому это лишь дополнительный фильтр: общий ответ
+    используется только для первого вопроса диалога.
+
+    Args:
+        question: Текст вопроса
+        max_words: Вопросы длиннее этого числа слов не кэшируются
+
+    Returns:
+        bool: True если ответ на вопрос можно переиспользовать
+    """
+    normalized = normalize_text(question)
+    if not normalized or _DIGITS_PATTERN.search(normalized):
+        return False
+    words = normalized.split()
+    if len(words) > max_words:
+        return False
+    return not any(word in _CONTEXT_WORDS for word in words)
+
+
+class ResponseCache:
+    """Кэш ответов ассистента на частые вопросы, не зависящие от пользователя"""
+
+    def __init__(self,
+                 version: str,
+                 max_entries: int = 1000,
+                 ttl: float = 3600,
+                 max_bytes: Optional[int] = 2 * 1024 * 1024,
+                 max_words: int = 12):
+        """
+        Инициализация кэша
+
+        Args:
+            version: Версия ассистента - при ее смене старые ответы не используются
+            max_entries: Максимальное количество ответов
+            ttl: Время жизни ответа (сек)
+            max_bytes: Ограничение памяти (байт)
+            max_words: Вопросы длиннее этого числа слов не кэшируются
+        """
+        self.version = version
+        self.max_words = max_words
+        self._cache = TTLCache(max_entries=max_entries, ttl=ttl, max_bytes=max_bytes)
+
+    def is_cacheable(self, question: str) -> bool:
+        """Проверяет, можно ли отвечать на вопрос общим ответом"""
+        return is_cacheable_question(question, self.max_words)
+
+    def _key(self, question: str) -> Tuple[str, str]:
+        """Ключ кэша: версия ассистента и нормализованный текст"""
+        return (self.version, normalize_text(question))
+
+    def get(self, question: str) -> Optional[str]:
+        """
+        Получает закэшированный ответ
+
+        Args:
+            question: Текст вопроса
+
+        Returns:
+            Ответ или None
+        """
+        if not self.is_cacheable(question):
+            return None
+        answer = self._cache.get(self._key(question))
+        if answer is not None:
+            logger.info(f"Response cache hit: {question[:50]}...")
+        return answer
+
+    def set(self, question: str, answer: str) -> None:
+        """
+        Сохраняет ответ, если вопрос кэшируемый
+
+        Args:
+            question: Текст вопроса
+            answer: Ответ ассистента
+        """
+        if answer and self.is_cacheable(question):
+            self._cache.set(self._key(question), answer)
+
+    def clear(self) -> None:
+        """Очищает кэш"""
+        self._cache.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику кэша
+
+        Returns:
+            Dict[str, Any]: Статистика
+        """
+        return self._cache.get_stats()
+
+
+class DetectionCache:
+    """Кэш результатов определения типа запроса по нормализованному тексту
+
+    Одновременные запросы с одинаковым текстом ждут один общий вызов детектора.
+    """
+
+    def __init__(self,
+                 max_entries: int = 5000,
+                 ttl: float = 86400,
+                 max_chars: int = 200,
+                 should_cache: Optional[Callable[[Dict[str, Any]], bool]] = None):
+        """
+        Инициализация кэша
+
+        Args:
+            max_entries: Максимальное количество записей
+            ttl: Время жизни записи (сек)
+            max_chars: Более длинные тексты не кэшируются (они почти не повторяются)
+            should_cache: Проверка, можно ли сохранить результат (например, не запасной)
+        """
+        self.max_chars = max_chars
+        self.should_cache = should_cache
+        self._cache = TTLCache(max_entries=max_entries, ttl=ttl)
+        self._inflight: Dict[str, "asyncio.Future"] = {}
+
+        # Статистика
+        self.shared = 0
+
+    def _key(self, text: str) -> Optional[str]:
+        """Ключ кэша или None, если текст не кэшируется"""
+        key = normalize_text(text)
+        if not key or len(key) > self.max_chars:
+            return None
+        return key
+
+    async def get_or_compute(self,
+                             text: str,
+                             compute: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        Возвращает результат из кэша или вычисляет его один раз для всех ожидающих
+
+        Args:
+            text: Текст сообщения
+            compute: Вызов детектора
+
+        Returns:
+            Результат определения типа запроса
+        """
+        key = self._key(text)
+        if key is None:
+            return await compute()
+
+        cached = self._cache.get(key)
+        if cached is not None:
+            return dict(cached)
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.shared += 1
+        else:
+            future = asyncio.ensure_future(compute())
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._finish(key, done))
+        # Отмена одного ожидающего не прерывает общий вызов
+        return dict(await asyncio.shield(future))
+
+    def _finish(self, key: str, future: "asyncio.Future") -> None:
+        """Сохраняет результат завершившегося вызова"""
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if future.cancelled() or future.exception() is not None:
+            return
+        result = future.result()
+        if result and (self.should_cache is None or self.should_cache(result)):
+            self._cache.set(key, dict(result))
+
+    def persist(self, path: str) -> int:
+        """
+        Сохраняет кэш в файл
+
+        Args:
+            path: Путь к файлу JSON
+
+        Returns:
+            Количество сохраненных записей
+        """
+        entries = self._cache.dump()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"entries": entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        logger.info(f"Detection cache saved: {len(entries)} entries")
+        return len(entries)
+
+    def warm(self, path: str) -> int:
+        """
+        Загружает неустаревшие записи из файла
+
+        Args:
+            path: Путь к файлу JSON
+
+        Returns:
+            Количество загруженных записей
+        """
+        if not Path(path).exists():
+            return 0
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entries = json.load(f).get("entries", [])
+        except Exception as e:
+            logger.error(f"Ошибка загрузки кэша определения запросов {path}: {e}")
+            return 0
+
+        now = time.time()
+        loaded = 0
+        # Записи сохранены от давно использованных к недавним - порядок LRU сохраняется
+        for key, value, expires_at in entries:
+            if expires_at > now:
+                self._cache.set(key, value, ttl=expires_at - now)
+                loaded += 1
+        logger.info(f"Detection cache warmed: {loaded} entries from {path}")
+        return loaded
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику кэша
+
+        Returns:
+            Dict[str, Any]: Статистика
+        """
+        stats = self._cache.get_stats()
+        stats["shared"] = self.shared
+        # Вызовов детектора, обслуженных без нового запроса (общий запрос тоже попадание)
+        stats["saved_calls"] = stats["hits"] + self.shared
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["saved_calls"] / lookups if lookups else 0.0
+        stats["inflight"] = len(self._inflight)
+        return stats
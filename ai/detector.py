@@ -3,21 +3,177 @@
 Умный детектор запросов на файлы с использованием OpenAI API
 """
 
+import asyncio
 import json
+import time
 import logging
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from openai import AsyncOpenAI
 
+from ai.cache import DetectionCache
+from ai.governor import OpenAIGovernor, PRIORITY_USER, governed
+from ai.intent_matcher import IntentMatcher
+from ai.intent_model import IntentModel
+from ai.tokens import estimate_tokens
+
 logger = logging.getLogger(__name__)
 
+REQUEST_TYPES = ("TZ_FILE", "WAREHOUSE_IMAGES", "GENERAL_CHAT")
+
+# Ограничение длины ответа: объект с типом и уверенностью занимает ~15 токенов
+RESULT_MAX_TOKENS = 24
+REASONING_MAX_TOKENS = 100
+BATCH_ITEM_MAX_TOKENS = 24
+
+# Формат пачки сообщений (структуру ответа задает схема)
+BATCH_FORMAT_PROMPT = """
+Тебе приходит JSON-массив сообщений разных пользователей: [{"id": 1, "text": "..."}, ...].
+Определи тип КАЖДОГО сообщения независимо от остальных и верни по одному
+результату на сообщение с тем же id.
+"""
+
+
+def detection_schema(reasoning: bool = False) -> Dict[str, Any]:
+    """
+    Схема строгого структурированного ответа для одного сообщения
+
+    Args:
+        reasoning: Добавить поле с кратким объяснением (больше токенов ответа)
+    """
+    properties = {
+        "type": {"type": "string", "enum": list(REQUEST_TYPES)},
+        "confidence": {"type": "number"}
+    }
+    if reasoning:
+        properties["reasoning"] = {"type": "string"}
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False
+    }
+
+
+def batch_schema() -> Dict[str, Any]:
+    """Схема строгого структурированного ответа для пачки сообщений"""
+    item = detection_schema()
+    item["properties"] = {"id": {"type": "integer"}, **item["properties"]}
+    item["required"] = list(item["properties"])
+    return {
+        "type": "object",
+        "properties": {"results": {"type": "array", "items": item}},
+        "required": ["results"],
+        "additionalProperties": False
+    }
+
+
+def _response_format(name: str, schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Параметр response_format для строгой JSON-схемы"""
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+
+
+def parse_result(item: Any) -> Dict[str, any]:
+    """
+    Проверяет и приводит результат определения к формату детектора
+
+    Args:
+        item: Разобранный JSON одного результата
+
+    Returns:
+        {"type", "confidence", "reasoning", "source"}
+
+    Raises:
+        ValueError: Результат не соответствует схеме
+    """
+    if not isinstance(item, dict):
+        raise ValueError(f"Detector result is not an object: {item!r}")
+    request_type = item.get("type")
+    confidence = item.get("confidence")
+    if request_type not in REQUEST_TYPES:
+        raise ValueError(f"Unknown request type: {request_type!r}")
+    if isinstance(confidence, bool) or not isinstance(confidence, (int, float)):
+        raise ValueError(f"Invalid confidence: {confidence!r}")
+    return {
+        "type": request_type,
+        "confidence": min(max(float(confidence), 0.0), 1.0),
+        "reasoning": item.get("reasoning") or "",
+        "source": "llm"
+    }
+
+
+def _message_json(response) -> Any:
+    """Разбирает JSON из ответа модели; отказ или обрезанный ответ - ValueError"""
+    message = response.choices[0].message
+    if getattr(message, "refusal", None):
+        raise ValueError(f"Detector refused: {message.refusal}")
+    if response.choices[0].finish_reason == "length" or not message.content:
+        raise ValueError("Detector response truncated or empty")
+    return json.loads(message.content)
+
+
 class SmartFileDetector:
     """Умный детектор запросов на файлы с использованием OpenAI"""
     
-    def __init__(self, openai_client: AsyncOpenAI):
+    def __init__(self,
+                 openai_client: AsyncOpenAI,
+                 governor: Optional[OpenAIGovernor] = None,
+                 matcher: Optional[IntentMatcher] = None,
+                 model: Optional[IntentModel] = None,
+                 model_threshold: float = 0.9,
+                 log_path: Optional[str] = None,
+                 cache: Optional[DetectionCache] = None,
+                 batch_size: int = 1,
+                 batch_wait: float = 0.02,
+                 llm_model: str = "gpt-4o-mini",
+                 reasoning: bool = False):
+        """
+        Args:
+            openai_client: Клиент OpenAI
+            governor: Регулятор запросов к OpenAI
+            matcher: Локальное определение по ключевым словам (к LLM - только неопределенные)
+            model: Локальная модель для сообщений, неопределенных по ключевым словам
+            model_threshold: Минимальная вероятность модели, при которой LLM не нужен
+            log_path: Журнал решений LLM (JSONL) для обучения модели
+            cache: Кэш решений LLM по нормализованному тексту
+            batch_size: Сколько сообщений классифицировать одним запросом (1 - без пачек)
+            batch_wait: Сколько ждать пополнения пачки (сек)
+            llm_model: Модель с поддержкой строгих JSON-схем (structured outputs)
+            reasoning: Просить у модели краткое объяснение решения
+        """
         self.openai_client = openai_client
+        self.governor = governor
+        self.matcher = matcher
+        self.model = model
+        self.model_threshold = model_threshold
+        self.log_path = log_path
+        self.cache = cache
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+        self.llm_model = llm_model
+        self.reasoning = reasoning
+        self.max_tokens = REASONING_MAX_TOKENS if reasoning else RESULT_MAX_TOKENS
+        self._response_format = _response_format("request_type", detection_schema(reasoning))
+        self._batch_response_format = _response_format("request_types", batch_schema())
+        
+        # Сообщения, ожидающие отправки пачкой: (текст, future результата)
+        self._batch: List[Tuple[str, asyncio.Future]] = []
+        self._batch_timer: Optional[asyncio.Task] = None
+        
+        # Строки журнала решений, ожидающие записи в фоновом потоке
+        self._log_buffer: List[str] = []
+        self._log_task: Optional[asyncio.Task] = None
         
-        # Системный промпт для определения типа запроса
-        self.system_prompt = """
+        # Статистика
+        self.local_count = 0
+        self.model_count = 0
+        self.escalated_count = 0
+        self.tokens_avoided = 0
+        self.batches_count = 0
+        self.batched_items = 0
+        self.batch_item_retries = 0
+        
+        # Правила определения типа запроса (общие для одиночных запросов и пачек)
+        self.rules_prompt = """
 Ты - помощник для определения типа запроса пользователя в службе поддержки фулфилмента.
 
 Типы запросов:
@@ -38,48 +194,235 @@ WAREHOUSE_IMAGES - если есть слова о складе:
 
 GENERAL_CHAT - все остальное:
 - Приветствия, общие вопросы, расчеты, помощь
-
-Отвечай ТОЛЬКО в формате JSON:
-{
-    "type": "TZ_FILE|WAREHOUSE_IMAGES|GENERAL_CHAT",
-    "confidence": 0.95,
-    "reasoning": "краткое объяснение"
-}
+"""
+        # Системный промпт для определения типа одного сообщения (формат ответа задает схема)
+        self.system_prompt = self.rules_prompt + """
+confidence - уверенность от 0 до 1.
 """
     
-    async def detect_request_type(self, message_text: str) -> Dict[str, any]:
-        """Определяет тип запроса пользователя"""
-        try:
-            response = await self.openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": message_text}
-                ],
-                temperature=0.1,
-                max_tokens=200
+    def _request_tokens(self, message_text: str) -> int:
+        """Оценка токенов одного запроса к LLM"""
+        return estimate_tokens(self.system_prompt) + estimate_tokens(message_text) + self.max_tokens
+    
+    def detect_locally(self, message_text: str) -> Tuple[Optional[Dict[str, any]], Optional[Dict[str, any]]]:
+        """
+        Локальные уровни: ключевые слова, затем модель (без учета в статистике)
+        
+        Returns:
+            (уверенный результат или None, лучшая локальная догадка на случай ошибки LLM)
+        """
+        guess = None
+        if self.matcher is not None:
+            match = self.matcher.match(message_text)
+            if not match.ambiguous:
+                return match.to_result(), None
+            guess = match.to_result()
+        
+        if self.model is not None:
+            label, probability = self.model.predict(message_text)
+            result = {
+                "type": label,
+                "confidence": round(probability, 2),
+                "reasoning": "локальная модель",
+                "source": "model"
+            }
+            if probability >= self.model_threshold:
+                return result, None
+            guess = guess or result
+        return None, guess
+    
+    async def detect_request_type(self,
+                                  message_text: str,
+                                  local: Optional[Tuple[Optional[Dict[str, any]], Optional[Dict[str, any]]]] = None
+                                  ) -> Dict[str, any]:
+        """
+        Определяет тип запроса: локально, а для неопределенных сообщений - через LLM
+        
+        Args:
+            message_text: Текст сообщения
+            local: Уже посчитанный результат detect_locally (чтобы не считать его дважды)
+        """
+        result, guess = local if local is not None else self.detect_locally(message_text)
+        if result is not None:
+            if result["source"] == "model":
+                self.model_count += 1
+            else:
+                self.local_count += 1
+            self.tokens_avoided += self._request_tokens(message_text)
+            logger.info(f"Detected request type by {result['source']}: {result['type']} (confidence: {result['confidence']})")
+            return result
+        
+        self.escalated_count += 1
+        if self.cache is not None:
+            return await self.cache.get_or_compute(
+                message_text,
+                lambda: self._detect_with_llm(message_text, fallback=guess)
             )
-            
-            # Парсим JSON ответ
-            result_text = response.choices[0].message.content.strip()
-            
-            # Убираем возможные markdown блоки
-            if result_text.startswith("```json"):
-                result_text = result_text[7:]
-            if result_text.endswith("```"):
-                result_text = result_text[:-3]
-            
-            result = json.loads(result_text)
+        return await self._detect_with_llm(message_text, fallback=guess)
+    
+    def _log_detection(self, message_text: str, result: Dict[str, any]) -> None:
+        """Ставит решение LLM в очередь журнала для обучения локальной модели"""
+        record = {
+            "ts": int(time.time()),
+            "text": message_text,
+            "type": result.get("type"),
+            "confidence": result.get("confidence"),
+            "source": "llm"
+        }
+        self._log_buffer.append(json.dumps(record, ensure_ascii=False) + "\n")
+        # Файл пишет одна фоновая задача: event loop не ждет диска, порядок строк сохраняется
+        if self._log_task is None or self._log_task.done():
+            self._log_task = asyncio.create_task(self.flush_log())
+    
+    def _append_log(self, lines: List[str]) -> None:
+        """Дописывает строки в журнал (выполняется в отдельном потоке)"""
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.writelines(lines)
+    
+    async def flush_log(self) -> None:
+        """Записывает накопленные строки журнала решений"""
+        while self._log_buffer:
+            lines, self._log_buffer = self._log_buffer, []
+            try:
+                await asyncio.to_thread(self._append_log, lines)
+            except Exception as e:
+                logger.warning(f"Failed to log detection: {e}")
+    
+    async def _detect_with_llm(self, message_text: str, fallback: Optional[Dict[str, any]] = None) -> Dict[str, any]:
+        """Определяет тип запроса пользователя через LLM (при ошибке - fallback или ключевые слова)"""
+        try:
+            if self.batch_size > 1:
+                result = await self._submit_to_batch(message_text)
+            else:
+                result = await self._classify_one(message_text)
             
             logger.info(f"Detected request type: {result['type']} (confidence: {result['confidence']})")
+            if self.log_path:
+                self._log_detection(message_text, result)
             return result
             
         except json.JSONDecodeError as e:
             logger.error(f"JSON decode error: {e}")
-            return self._fallback_detection(message_text)
+            return fallback or self._fallback_detection(message_text)
         except Exception as e:
             logger.error(f"Error in smart detection: {e}")
-            return self._fallback_detection(message_text)
+            return fallback or self._fallback_detection(message_text)
+    
+    async def _classify_one(self, message_text: str) -> Dict[str, any]:
+        """Один запрос к LLM на одно сообщение"""
+        response = await governed(
+            self.governor,
+            self.openai_client.chat.completions.create,
+            priority=PRIORITY_USER,
+            tokens=self._request_tokens(message_text),
+            model=self.llm_model,
+            messages=[
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": message_text}
+            ],
+            response_format=self._response_format,
+            temperature=0,
+            max_tokens=self.max_tokens
+        )
+        return parse_result(_message_json(response))
+    
+    async def _submit_to_batch(self, message_text: str) -> Dict[str, any]:
+        """Ставит сообщение в пачку и ждет свой результат"""
+        future = asyncio.get_running_loop().create_future()
+        self._batch.append((message_text, future))
+        if len(self._batch) >= self.batch_size:
+            self._flush_batch()
+        elif self._batch_timer is None:
+            self._batch_timer = asyncio.create_task(self._batch_timeout())
+        return await future
+    
+    async def _batch_timeout(self) -> None:
+        """Отправляет неполную пачку по истечении ожидания"""
+        await asyncio.sleep(self.batch_wait)
+        self._batch_timer = None
+        self._flush_batch()
+    
+    def _flush_batch(self) -> None:
+        """Забирает накопленную пачку и отправляет ее в фоне"""
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        items, self._batch = self._batch, []
+        if items:
+            asyncio.create_task(self._run_batch(items))
+    
+    async def _run_batch(self, items: List[Tuple[str, asyncio.Future]]) -> None:
+        """Классифицирует пачку одним запросом и раздает результаты ожидающим"""
+        results: List[Any] = [None] * len(items)
+        if len(items) > 1:
+            try:
+                results = await self._classify_batch([text for text, _ in items])
+                self.batches_count += 1
+                self.batched_items += len(items)
+            except ValueError as e:
+                # Ответ не разобран - ниже каждое сообщение получит свой запрос
+                logger.warning(f"Batch detection response of {len(items)} messages not parsed: {e}")
+            except Exception as e:
+                # Ошибка запроса: не умножаем нагрузку повторами, у каждого есть запасной ответ
+                logger.warning(f"Batch detection of {len(items)} messages failed: {e}")
+                results = [e] * len(items)
+        
+        # Сообщения без корректного результата классифицируются по одному
+        retry = [i for i, result in enumerate(results) if result is None]
+        if len(items) > 1:
+            self.batch_item_retries += len(retry)
+        retried = await asyncio.gather(*(self._classify_one(items[i][0]) for i in retry), return_exceptions=True)
+        for i, result in zip(retry, retried):
+            results[i] = result
+        
+        for (_, future), result in zip(items, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+    
+    async def _classify_batch(self, texts: List[str]) -> List[Optional[Dict[str, any]]]:
+        """
+        Один запрос к LLM на несколько сообщений
+        
+        Returns:
+            Результаты в порядке сообщений; None - для сообщений без корректного ответа
+        """
+        payload = json.dumps([{"id": i + 1, "text": text} for i, text in enumerate(texts)], ensure_ascii=False)
+        system_prompt = self.rules_prompt + BATCH_FORMAT_PROMPT
+        max_tokens = BATCH_ITEM_MAX_TOKENS * len(texts) + 10
+        response = await governed(
+            self.governor,
+            self.openai_client.chat.completions.create,
+            priority=PRIORITY_USER,
+            tokens=estimate_tokens(system_prompt) + estimate_tokens(payload) + max_tokens,
+            model=self.llm_model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": payload}
+            ],
+            response_format=self._batch_response_format,
+            temperature=0,
+            max_tokens=max_tokens
+        )
+        
+        data = _message_json(response)
+        items = data.get("results") if isinstance(data, dict) else None
+        if not isinstance(items, list):
+            raise ValueError("Batch response has no results array")
+        
+        results: List[Optional[Dict[str, any]]] = [None] * len(texts)
+        for item in items:
+            item_id = item.get("id") if isinstance(item, dict) else None
+            if not isinstance(item_id, int) or not 1 <= item_id <= len(texts):
+                continue
+            try:
+                results[item_id - 1] = parse_result(item)
+            except ValueError:
+                continue
+        return results
     
     def _fallback_detection(self, message_text: str) -> Dict[str, any]:
         """Резервный метод определения через ключевые слова"""
@@ -111,6 +454,25 @@ GENERAL_CHAT - все остальное:
             "confidence": 0.9,
             "reasoning": "обычное общение"
         }
+    
+    def get_stats(self) -> Dict[str, any]:
+        """
+        Возвращает статистику детектора
+        
+        Returns:
+            Dict[str, any]: Статистика
+        """
+        total = self.local_count + self.model_count + self.escalated_count
+        return {
+            "batches": self.batches_count,
+            "batched_items": self.batched_items,
+            "batch_item_retries": self.batch_item_retries,
+            "local": self.local_count,
+            "model": self.model_count,
+            "escalated": self.escalated_count,
+            "escalation_rate": self.escalated_count / total if total else 0.0,
+            "tokens_avoided": self.tokens_avoided
+        }
 
 async def test_smart_detector():
     """Тестирование умного детектора"""
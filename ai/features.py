@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Признаки текста для локальных моделей
+Хэшированные символьные n-граммы без словаря и внешних зависимостей, кроме NumPy
+"""
+
+import zlib
+from typing import Tuple
+
+import numpy as np
+
+from bot.filters import normalize_text
+
+
+def char_ngrams(text: str, ngram_range: Tuple[int, int] = (3, 5)):
+    """
+    Перебирает символьные n-граммы слов нормализованного текста
+
+    Каждое слово обрамляется пробелами, чтобы n-граммы различали начало и конец слова.
+    """
+    min_n, max_n = ngram_range
+    for word in normalize_text(text).split():
+        padded = f" {word} "
+        for n in range(min_n, max_n + 1):
+            if len(padded) < n:
+                break
+            for i in range(len(padded) - n + 1):
+                yield padded[i:i + n]
+
+
+def hashed_ngram_counts(text: str, dim: int, ngram_range: Tuple[int, int] = (3, 5)) -> np.ndarray:
+    """
+    Считает хэшированные частоты n-грамм текста
+
+    Args:
+        text: Исходный текст
+        dim: Размерность вектора (количество корзин хэша)
+        ngram_range: Минимальная и максимальная длина n-граммы
+
+    Returns:
+        np.ndarray: Вектор частот float32 длины dim
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    for gram in char_ngrams(text, ngram_range):
+        # crc32 стабилен между запусками, в отличие от встроенного hash()
+        vector[zlib.crc32(gram.encode('utf-8')) % dim] += 1.0
+    return vector
+
+
+def embed_text(text: str, dim: int, ngram_range: Tuple[int, int] = (3, 5)) -> np.ndarray:
+    """
+    Строит L2-нормированный вектор текста с сублинейным весом частот
+
+    Args:
+        text: Исходный текст
+        dim: Размерность вектора
+        ngram_range: Минимальная и максимальная длина n-граммы
+
+    Returns:
+        np.ndarray: Единичный вектор float32 (нулевой для пустого текста)
+    """
+    vector = hashed_ngram_counts(text, dim, ngram_range)
+    np.log1p(vector, out=vector)
+    norm = float(np.linalg.norm(vector))
+    if norm > 0:
+        vector /= norm
+    return vector
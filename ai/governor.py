@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+Общий регулятор запросов к OpenAI
+Ограничивает параллельность, запросы и токены в минуту, пропускает запросы
+пользователей вперед фоновых и учитывает Retry-After при ответах 429.
+Регулятор - единственное место повторов: клиент OpenAI создается с
+max_retries=0, иначе SDK повторял бы запросы сам, не отпуская слот.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from openai import APIConnectionError, InternalServerError, RateLimitError
+
+from ai.resilience import RequestHedger
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты (полосы): меньше - важнее
+PRIORITY_USER = 0        # Запросы, которых ждет пользователь
+PRIORITY_POLL = 1        # Опрос статусов и чтение результатов
+PRIORITY_BACKGROUND = 2  # Фоновые задачи (пул threads, очистка)
+
+LANE_NAMES = {
+    PRIORITY_USER: "user",
+    PRIORITY_POLL: "poll",
+    PRIORITY_BACKGROUND: "background",
+}
+
+
+class TokenBucket:
+    """Корзина токенов с равномерным пополнением"""
+
+    def __init__(self, per_minute: float):
+        """
+        Инициализация корзины
+
+        Args:
+            per_minute: Емкость корзины и скорость пополнения в минуту
+        """
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        """Пополняет корзину за прошедшее время"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def time_until(self, amount: float, now: float) -> float:
+        """Сколько секунд ждать, пока в корзине наберется amount"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        """Забирает amount из корзины"""
+        self.tokens -= min(amount, self.capacity)
+
+
+def _retry_after_seconds(error: RateLimitError) -> Optional[float]:
+    """Достает задержку из заголовков retry-after-ms / retry-after"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class OpenAIGovernor:
+    """Планировщик запросов к OpenAI с лимитами и приоритетами"""
+
+    def __init__(self,
+                 max_concurrency: int = 16,
+                 requests_per_minute: int = 500,
+                 tokens_per_minute: int = 200000,
+                 max_retries: int = 3):
+        """
+        Инициализация регулятора
+
+        Args:
+            max_concurrency: Максимум одновременных запросов
+            requests_per_minute: Лимит запросов в минуту
+            tokens_per_minute: Лимит токенов в минуту
+            max_retries: Сколько раз повторять запрос после ответа 429, 5xx или ошибки соединения
+        """
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+
+        self._active = 0
+        self._waiters: List[tuple] = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        # Статистика ожидания по полосам
+        self._lane_stats: Dict[int, Dict[str, float]] = {
+            priority: {"requests": 0, "total_wait": 0.0, "max_wait": 0.0}
+            for priority in LANE_NAMES
+        }
+        self._recent_waits: Dict[int, deque] = {priority: deque(maxlen=1000) for priority in LANE_NAMES}
+        self.rate_limited_count = 0
+        self.transient_error_count = 0
+
+    def pause(self, seconds: float) -> None:
+        """Приостанавливает выдачу запросов (например, по Retry-After)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._schedule()
+
+    def has_headroom(self, tokens: int = 0, reserve: float = 0.1) -> bool:
+        """
+        Можно ли сразу выдать еще один слот, оставив запас лимитов
+
+        Args:
+            tokens: Оценка токенов запроса
+            reserve: Доля лимитов в минуту, которую нужно оставить нетронутой
+
+        Returns:
+            bool: True, если запрос не встанет в очередь и не исчерпает лимиты
+        """
+        now = time.monotonic()
+        if now < self._paused_until or self._active >= self.max_concurrency:
+            return False
+        if any(not waiter[-1].done() for waiter in self._waiters):
+            return False
+        return (self._requests.time_until(1 + self._requests.capacity * reserve, now) == 0
+                and self._tokens.time_until(tokens + self._tokens.capacity * reserve, now) == 0)
+
+    async def _acquire(self, priority: int, tokens: int) -> None:
+        """Ждет своей очереди на выполнение запроса"""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), tokens, time.monotonic(), future))
+        self._schedule()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слот уже выдан, но ожидающий отменен - возвращаем слот
+                self._release()
+            raise
+
+    def _release(self) -> None:
+        """Освобождает слот и выдает его следующему"""
+        self._active -= 1
+        self._schedule()
+
+    def _schedule(self) -> None:
+        """Выдает слоты ожидающим, пока позволяют лимиты"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._waiters and self._active < self.max_concurrency:
+            priority, _, tokens, enqueued_at, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+
+            now = time.monotonic()
+            delay = max(
+                self._paused_until - now,
+                self._requests.time_until(1, now),
+                self._tokens.time_until(tokens, now)
+            )
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._schedule)
+                return
+
+            heapq.heappop(self._waiters)
+            self._requests.consume(1)
+            self._tokens.consume(tokens)
+            self._active += 1
+            self._record_wait(priority, now - enqueued_at)
+            future.set_result(True)
+
+    def _record_wait(self, priority: int, wait: float) -> None:
+        """Учитывает время ожидания в очереди"""
+        stats = self._lane_stats[priority]
+        stats["requests"] += 1
+        stats["total_wait"] += wait
+        stats["max_wait"] = max(stats["max_wait"], wait)
+        self._recent_waits[priority].append(wait)
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_USER, tokens: int = 0):
+        """
+        Занимает слот на время выполнения блока
+
+        Args:
+            priority: Приоритет (PRIORITY_USER, PRIORITY_POLL, PRIORITY_BACKGROUND)
+            tokens: Оценка токенов запроса для лимита в минуту
+        """
+        await self._acquire(priority, tokens)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def call(self,
+                   fn: Callable[..., Awaitable[Any]],
+                   *args,
+                   priority: int = PRIORITY_USER,
+                   tokens: int = 0,
+                   hedger: Optional[RequestHedger] = None,
+                   **kwargs) -> Any:
+        """
+        Выполняет запрос к OpenAI через регулятор
+
+        Args:
+            fn: Метод клиента OpenAI
+            priority: Приоритет запроса
+            tokens: Оценка токенов запроса
+            hedger: Дублирование медленного идемпотентного запроса. Задержка
+                считается с получения слота, а дубль занимает свой слот и
+                отправляется, только если лимиты это позволяют без очереди
+            *args, **kwargs: Аргументы метода
+
+        Returns:
+            Результат метода
+        """
+        attempt = 0
+        while True:
+            backoff = 0.0
+            async with self.slot(priority, tokens):
+                try:
+                    if hedger is None:
+                        return await fn(*args, **kwargs)
+                    return await hedger.run(
+                        lambda: fn(*args, **kwargs),
+                        hedge_request=lambda: self._call_once(fn, *args, priority=priority, tokens=tokens, **kwargs),
+                        can_hedge=lambda: self.has_headroom(tokens)
+                    )
+                except RateLimitError as e:
+                    self.rate_limited_count += 1
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = _retry_after_seconds(e) or min(2 ** attempt, 30)
+                    logger.warning(f"OpenAI rate limit hit, pausing requests for {delay:.1f}s")
+                    self.pause(delay)
+                except (APIConnectionError, InternalServerError) as e:
+                    # Сбой одного запроса - повторяем его, не останавливая остальные
+                    self.transient_error_count += 1
+                    if attempt >= self.max_retries:
+                        raise
+                    backoff = min(0.5 * 2 ** attempt, 8)
+                    logger.warning(f"OpenAI request failed ({type(e).__name__}), retrying in {backoff:.1f}s")
+            # Ждем вне слота, чтобы не занимать его паузой
+            if backoff:
+                await asyncio.sleep(backoff)
+            attempt += 1
+
+    async def _call_once(self, fn: Callable[..., Awaitable[Any]], *args,
+                         priority: int, tokens: int, **kwargs) -> Any:
+        """Выполняет запрос в отдельном слоте без повторов (дубль при hedging)"""
+        async with self.slot(priority, tokens):
+            return await fn(*args, **kwargs)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику регулятора
+
+        Returns:
+            Dict[str, Any]: Статистика по полосам (время ожидания в мс) и общая
+        """
+        lanes = {}
+        for priority, name in LANE_NAMES.items():
+            stats = self._lane_stats[priority]
+            waits = sorted(self._recent_waits[priority])
+            p95 = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+            lanes[name] = {
+                "requests": int(stats["requests"]),
+                "avg_wait_ms": stats["total_wait"] / stats["requests"] * 1000 if stats["requests"] else 0.0,
+                "p95_wait_ms": p95 * 1000,
+                "max_wait_ms": stats["max_wait"] * 1000
+            }
+        return {
+            "active": self._active,
+            "queued": sum(1 for waiter in self._waiters if not waiter[4].done()),
+            "rate_limited": self.rate_limited_count,
+            "transient_errors": self.transient_error_count,
+            "lanes": lanes
+        }
+
+
+async def governed(governor: Optional[OpenAIGovernor],
+                   fn: Callable[..., Awaitable[Any]],
+                   *args,
+                   priority: int = PRIORITY_USER,
+                   tokens: int = 0,
+                   hedger: Optional[RequestHedger] = None,
+                   **kwargs) -> Any:
+    """Выполняет запрос через регулятор, если он задан, иначе напрямую"""
+    if governor is None:
+        if hedger is not None:
+            return await hedger.run(lambda: fn(*args, **kwargs))
+        return await fn(*args, **kwargs)
+    return await governor.call(fn, *args, priority=priority, tokens=tokens, hedger=hedger, **kwargs)
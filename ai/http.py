@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP-клиент для OpenAI
+Общий пул соединений с keep-alive, опциональным HTTP/2, прогревом и статистикой загрузки
+"""
+
+import asyncio
+import logging
+from typing import Any, Dict
+
+from openai import DefaultAsyncHttpxClient
+
+try:
+    import httpx2 as httpx  # Новые версии openai построены на форке httpx2
+except ImportError:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+
+def http2_available() -> bool:
+    """Проверяет, установлен ли пакет h2 (нужен httpx для HTTP/2)"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def build_timeout(connect_timeout: float, read_timeout: float) -> httpx.Timeout:
+    """
+    Создает таймауты запросов к OpenAI
+
+    Args:
+        connect_timeout: Таймаут установки соединения (сек)
+        read_timeout: Таймаут чтения, записи и ожидания соединения из пула (сек)
+
+    Returns:
+        httpx.Timeout: Таймауты
+    """
+    return httpx.Timeout(read_timeout, connect=connect_timeout)
+
+
+def create_http_client(max_connections: int = 100,
+                       max_keepalive_connections: int = 20,
+                       keepalive_expiry: float = 30,
+                       http2: bool = False,
+                       connect_timeout: float = 5,
+                       read_timeout: float = 60) -> httpx.AsyncClient:
+    """
+    Создает HTTP-клиент с настроенным пулом соединений
+
+    Args:
+        max_connections: Максимум одновременных соединений
+        max_keepalive_connections: Сколько простаивающих соединений держать открытыми
+        keepalive_expiry: Через сколько секунд простоя соединение закрывается
+        http2: Использовать HTTP/2 (нужен пакет h2)
+        connect_timeout: Таймаут установки соединения (сек)
+        read_timeout: Таймаут чтения (сек)
+
+    Returns:
+        httpx.AsyncClient: Клиент для передачи в AsyncOpenAI(http_client=...)
+    """
+    if http2 and not http2_available():
+        logger.warning("HTTP/2 requested but 'h2' is not installed (pip install 'httpx[http2]'), using HTTP/1.1")
+        http2 = False
+
+    return DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        ),
+        timeout=build_timeout(connect_timeout, read_timeout),
+        http2=http2
+    )
+
+
+async def prewarm_connections(http_client: httpx.AsyncClient, url: str, count: int) -> int:
+    """
+    Заранее открывает соединения (DNS, TCP, TLS), чтобы первые запросы их не ждали
+
+    Отправляет параллельные HEAD-запросы без авторизации: ответ не важен,
+    соединения остаются в пуле keep-alive.
+
+    Args:
+        http_client: HTTP-клиент
+        url: Адрес API
+        count: Сколько соединений открыть
+
+    Returns:
+        int: Сколько запросов прошло успешно
+    """
+    if count <= 0:
+        return 0
+
+    results = await asyncio.gather(
+        *(http_client.head(url) for _ in range(count)),
+        return_exceptions=True
+    )
+    warmed = sum(1 for result in results if not isinstance(result, BaseException))
+    if warmed < count:
+        errors = [result for result in results if isinstance(result, BaseException)]
+        logger.warning(f"Prewarmed {warmed}/{count} OpenAI connections: {errors[0]}")
+    else:
+        logger.info(f"Prewarmed {warmed} OpenAI connections")
+    return warmed
+
+
+def get_pool_stats(http_client: httpx.AsyncClient) -> Dict[str, Any]:
+    """
+    Возвращает загрузку пула соединений
+
+    Читает внутреннее состояние httpcore; если его нет (другой транспорт
+    или версия), возвращает нули.
+
+    Args:
+        http_client: HTTP-клиент
+
+    Returns:
+        Dict[str, Any]: Соединения всего/занято/простаивает, ожидающие запросы и доля занятых
+    """
+    transport = getattr(http_client, '_transport', None)
+    pool = getattr(transport, '_pool', None)
+    connections = list(getattr(pool, 'connections', None) or [])
+    max_connections = getattr(pool, '_max_connections', None) or 0
+    requests = list(getattr(pool, '_requests', None) or [])
+
+    active = 0
+    for connection in connections:
+        try:
+            if not connection.is_idle():
+                active += 1
+        except Exception:
+            pass
+
+    return {
+        "connections": len(connections),
+        "active": active,
+        "idle": len(connections) - active,
+        "waiting": sum(1 for request in requests if getattr(request, 'connection', None) is None),
+        "max_connections": max_connections,
+        "utilization": active / max_connections if max_connections else 0.0
+    }
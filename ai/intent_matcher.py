@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Локальное определение типа запроса по ключевым словам
+Все ключевые слова собраны в один автомат Ахо-Корасик, поэтому текст
+просматривается за один проход независимо от количества слов. Совпадения
+дают взвешенную оценку; к LLM обращаемся только в полосе неопределенности.
+"""
+
+import math
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from bot.filters import normalize_text
+
+TZ_FILE = "TZ_FILE"
+WAREHOUSE_IMAGES = "WAREHOUSE_IMAGES"
+GENERAL_CHAT = "GENERAL_CHAT"
+
+# Ключевые слова (основы, совпадают с начала слова) и их вес для каждого типа
+INTENT_KEYWORDS: Dict[str, Dict[str, float]] = {
+    TZ_FILE: {
+        "файл тз": 2.0,
+        "тз": 0.7,
+        "техническ": 0.8,
+        "задани": 0.8,
+        "техзадани": 1.0,
+        "эксель": 0.9,
+        "excel": 0.9,
+        "бланк": 1.0,
+        "шаблон": 0.6,
+        "форм": 0.4,
+        "заполн": 0.4,
+        "скачат": 0.4,
+        "файл": 0.4,
+        "пришлите файл": 0.8,
+    },
+    WAREHOUSE_IMAGES: {
+        "склад": 0.7,
+        "адрес": 1.0,
+        "где наход": 0.9,
+        "где вы": 0.7,
+        "где": 0.6,
+        "как добрат": 1.2,
+        "как проехат": 1.2,
+        "как доехат": 1.2,
+        "проезд": 0.9,
+        "схем": 0.6,
+        "покажите склад": 0.8,
+        "фото склад": 1.0,
+        "местоположени": 0.8,
+        "казан": 0.4,
+    },
+    GENERAL_CHAT: {
+        "привет": 0.8,
+        "здравствуй": 0.8,
+        "добрый день": 0.6,
+        "спасибо": 0.9,
+        "сколько стоит": 0.9,
+        "стоимост": 0.7,
+        "цен": 0.5,
+        "расчет": 0.7,
+        "рассчита": 0.7,
+        "посчита": 0.7,
+        "тариф": 0.6,
+        "хранени": 0.5,
+        "штук": 0.5,
+        "доставк": 0.4,
+        "упаковк": 0.4,
+        "маркировк": 0.4,
+    },
+}
+
+FILE_INTENTS = (TZ_FILE, WAREHOUSE_IMAGES)
+
+
+class KeywordAutomaton:
+    """Автомат Ахо-Корасик: поиск всех вхождений набора строк за один проход"""
+
+    def __init__(self, patterns: Iterable[Tuple[str, Any]]):
+        """
+        Строит автомат
+
+        Args:
+            patterns: Пары (строка, данные совпадения)
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Для каждого состояния - (длина строки, данные) всех строк, оканчивающихся в нем
+        self._out: List[List[Tuple[int, Any]]] = [[]]
+
+        for pattern, payload in patterns:
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = next_state
+            self._out[state].append((len(pattern), payload))
+
+        # Ссылки неудач строятся обходом в ширину
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._out[next_state].extend(self._out[self._fail[next_state]])
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, Any]]:
+        """
+        Перебирает все вхождения строк автомата в текст
+
+        Args:
+            text: Текст
+
+        Yields:
+            (позиция начала вхождения, данные совпадения)
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, payload in out[state]:
+                yield position - length + 1, payload
+
+
+@dataclass
+class IntentMatch:
+    """Результат локального определения типа запроса"""
+    type: str
+    confidence: float
+    # Оценка того, что это запрос файла (ТЗ или склада)
+    score: float
+    ambiguous: bool
+    keywords: List[str] = field(default_factory=list)
+
+    def to_result(self) -> Dict[str, Any]:
+        """Результат в формате детектора запросов"""
+        reasoning = f"ключевые слова: {', '.join(self.keywords)}" if self.keywords else "нет ключевых слов запроса файла"
+        return {
+            "type": self.type,
+            "confidence": round(self.confidence, 2),
+            "reasoning": reasoning,
+            "source": "local"
+        }
+
+
+class IntentMatcher:
+    """Оценка типа запроса по ключевым словам с полосой неопределенности"""
+
+    def __init__(self,
+                 ambiguity_low: float = 0.35,
+                 ambiguity_high: float = 0.75,
+                 keywords: Dict[str, Dict[str, float]] = INTENT_KEYWORDS):
+        """
+        Инициализация
+
+        Args:
+            ambiguity_low: Оценка запроса файла, ниже которой это общее общение
+            ambiguity_high: Оценка, начиная с которой это запрос файла
+            keywords: Ключевые слова и веса для каждого типа
+        """
+        self.ambiguity_low = ambiguity_low
+        self.ambiguity_high = ambiguity_high
+        self._automaton = KeywordAutomaton(
+            (normalize_text(keyword), (intent, keyword, weight))
+            for intent, intent_keywords in keywords.items()
+            for keyword, weight in intent_keywords.items()
+        )
+
+    def match(self, text: str) -> IntentMatch:
+        """
+        Оценивает тип запроса
+
+        Args:
+            text: Текст сообщения
+
+        Returns:
+            IntentMatch: Тип, уверенность и признак неопределенности
+        """
+        # Пробелы по краям, чтобы ключевое слово в начале текста тоже начиналось после пробела
+        normalized = f" {normalize_text(text)} "
+        weights = {TZ_FILE: 0.0, WAREHOUSE_IMAGES: 0.0, GENERAL_CHAT: 0.0}
+        seen = set()
+        for start, (intent, keyword, weight) in self._automaton.iter_matches(normalized):
+            # Ключевое слово - основа, поэтому оно должно начинаться с начала слова
+            if normalized[start - 1] != " " or keyword in seen:
+                continue
+            seen.add(keyword)
+            weights[intent] += weight
+
+        # Сумма весов переводится в силу свидетельства от 0 до 1
+        evidence = {intent: 1.0 - math.exp(-weight) for intent, weight in weights.items()}
+        top = max(FILE_INTENTS, key=lambda intent: evidence[intent])
+        other = WAREHOUSE_IMAGES if top == TZ_FILE else TZ_FILE
+        # Признаки другого типа снижают уверенность в лучшем
+        score = evidence[top] * (1.0 - 0.35 * max(evidence[other], evidence[GENERAL_CHAT]))
+        keywords = sorted(seen)
+
+        if score >= self.ambiguity_high:
+            return IntentMatch(top, score, score, False, keywords)
+        if score <= self.ambiguity_low:
+            return IntentMatch(GENERAL_CHAT, 1.0 - score, score, False, keywords)
+        # Без LLM выбираем ближайший тип
+        if score >= 0.5:
+            return IntentMatch(top, score, score, True, keywords)
+        return IntentMatch(GENERAL_CHAT, 1.0 - score, score, True, keywords)
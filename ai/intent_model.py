@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+Локальная модель типа запроса
+Мультиномиальный наивный Байес над хэшированными символьными n-граммами.
+Параметры - массивы NumPy (файл .npz), предсказание не требует сети и занимает
+порядка 0.1 мс на короткое сообщение - 50-150 мкс в зависимости от длины
+текста и машины (бенчмарк intent_model.predict/mixed в benchmarks/run.py).
+Корпус для обучения можно собрать из журнала решений LLM-детектора
+(DETECTOR_LOG_PATH).
+
+Формат корпуса - JSONL: {"text": "...", "label": "TZ_FILE|WAREHOUSE_IMAGES|GENERAL_CHAT"}
+
+Запуск:
+    python -m ai.intent_model bootstrap --log detections.jsonl --out corpus.jsonl
+    python -m ai.intent_model train --corpus corpus.jsonl --out intent_model.npz
+    python -m ai.intent_model evaluate --model intent_model.npz --corpus corpus.jsonl
+    python -m ai.intent_model export --model intent_model.npz --out intent_model.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+import zlib
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from ai.features import char_ngrams
+from ai.intent_matcher import GENERAL_CHAT, TZ_FILE, WAREHOUSE_IMAGES
+from bot.filters import normalize_text
+
+logger = logging.getLogger(__name__)
+
+INTENT_LABELS = (TZ_FILE, WAREHOUSE_IMAGES, GENERAL_CHAT)
+
+
+class IntentModel:
+    """Наивный Байес по хэшированным символьным n-граммам"""
+
+    def __init__(self,
+                 labels: Sequence[str],
+                 log_prior: np.ndarray,
+                 log_likelihood: np.ndarray,
+                 ngram_range: Tuple[int, int] = (3, 5)):
+        """
+        Args:
+            labels: Типы запросов (порядок строк массивов)
+            log_prior: Логарифмы априорных вероятностей типов, форма (K,)
+            log_likelihood: Логарифмы вероятностей корзин n-грамм, форма (K, dim)
+            ngram_range: Минимальная и максимальная длина n-граммы
+        """
+        self.labels = list(labels)
+        self.log_prior = log_prior.astype(np.float32)
+        self.log_likelihood = log_likelihood.astype(np.float32)
+        self.ngram_range = tuple(ngram_range)
+        self.dim = self.log_likelihood.shape[1]
+        # Строка на корзину: выборка по n-граммам текста читает смежную память
+        self._by_bucket = np.ascontiguousarray(self.log_likelihood.T)
+
+    def _indices(self, text: str) -> np.ndarray:
+        """Номера корзин n-грамм текста (с повторами)"""
+        return np.fromiter(
+            (zlib.crc32(gram.encode('utf-8')) % self.dim for gram in char_ngrams(text, self.ngram_range)),
+            dtype=np.int64
+        )
+
+    @classmethod
+    def train(cls,
+              texts: Sequence[str],
+              labels: Sequence[str],
+              dim: int = 1 << 14,
+              alpha: float = 0.5,
+              ngram_range: Tuple[int, int] = (3, 5)) -> "IntentModel":
+        """
+        Обучает модель
+
+        Args:
+            texts: Тексты сообщений
+            labels: Типы запросов
+            dim: Количество корзин хэша n-грамм
+            alpha: Сглаживание Лапласа
+            ngram_range: Минимальная и максимальная длина n-граммы
+
+        Returns:
+            IntentModel: Обученная модель
+        """
+        known = [label for label in INTENT_LABELS if label in set(labels)]
+        index = {label: i for i, label in enumerate(known)}
+        counts = np.zeros((len(known), dim), dtype=np.float64)
+        docs = np.zeros(len(known), dtype=np.float64)
+        for text, label in zip(texts, labels):
+            row = index[label]
+            docs[row] += 1
+            for gram in char_ngrams(text, ngram_range):
+                counts[row, zlib.crc32(gram.encode('utf-8')) % dim] += 1
+
+        log_prior = np.log(docs / docs.sum())
+        smoothed = counts + alpha
+        log_likelihood = np.log(smoothed / smoothed.sum(axis=1, keepdims=True))
+        return cls(known, log_prior, log_likelihood, ngram_range)
+
+    def predict_proba(self, text: str) -> np.ndarray:
+        """
+        Вероятности типов запроса
+
+        Args:
+            text: Текст сообщения
+
+        Returns:
+            np.ndarray: Вероятности в порядке self.labels
+        """
+        indices = self._indices(text)
+        joint = self.log_prior + self._by_bucket[indices].sum(axis=0)
+        joint -= joint.max()
+        proba = np.exp(joint)
+        return proba / proba.sum()
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """
+        Определяет тип запроса
+
+        Args:
+            text: Текст сообщения
+
+        Returns:
+            (тип запроса, вероятность)
+        """
+        proba = self.predict_proba(text)
+        best = int(proba.argmax())
+        return self.labels[best], float(proba[best])
+
+    def save(self, path: str) -> None:
+        """Сохраняет модель в файл .npz (ровно по указанному пути)"""
+        # Через открытый файл: по имени np.savez дописал бы .npz, и load(path) не нашел бы модель
+        with open(path, 'wb') as f:
+            np.savez(
+                f,
+                labels=np.array(self.labels),
+                log_prior=self.log_prior,
+                log_likelihood=self.log_likelihood,
+                ngram_range=np.array(self.ngram_range)
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "IntentModel":
+        """Загружает модель из файла .npz"""
+        if not os.path.exists(path) and os.path.exists(path + ".npz"):
+            # Модель, сохраненная раньше через np.savez по имени без суффикса
+            path = path + ".npz"
+        with np.load(path) as data:
+            return cls(
+                [str(label) for label in data["labels"]],
+                data["log_prior"],
+                data["log_likelihood"],
+                tuple(int(n) for n in data["ngram_range"])
+            )
+
+
+def load_corpus(path: str) -> Tuple[List[str], List[str]]:
+    """
+    Читает размеченный корпус JSONL
+
+    Args:
+        path: Путь к корпусу
+
+    Returns:
+        (тексты, типы запросов)
+    """
+    texts, labels = [], []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("label") not in INTENT_LABELS or not record.get("text"):
+                logger.warning(f"Пропущена запись {line_number} в {path}: {line.strip()[:80]}")
+                continue
+            texts.append(record["text"])
+            labels.append(record["label"])
+    return texts, labels
+
+
+def bootstrap_corpus(log_path: str, out_path: str, min_confidence: float = 0.8) -> Dict[str, int]:
+    """
+    Собирает корпус из журнала решений LLM-детектора
+
+    Повторы одного текста (после нормализации) сводятся голосованием;
+    тексты без явного большинства пропускаются.
+
+    Args:
+        log_path: Журнал решений детектора (JSONL)
+        out_path: Куда записать корпус
+        min_confidence: Минимальная уверенность LLM
+
+    Returns:
+        Количество записей каждого типа в корпусе
+    """
+    votes: Dict[str, Counter] = defaultdict(Counter)
+    originals: Dict[str, str] = {}
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("source") != "llm" or record.get("type") not in INTENT_LABELS:
+                continue
+            if float(record.get("confidence", 0)) < min_confidence:
+                continue
+            key = normalize_text(record.get("text", ""))
+            if not key:
+                continue
+            votes[key][record["type"]] += 1
+            originals.setdefault(key, record["text"])
+
+    stats: Counter = Counter()
+    with open(out_path, 'w', encoding='utf-8') as f:
+        for key, counter in votes.items():
+            label, count = counter.most_common(1)[0]
+            if count * 2 <= sum(counter.values()):
+                continue
+            f.write(json.dumps({"text": originals[key], "label": label}, ensure_ascii=False) + "\n")
+            stats[label] += 1
+    return dict(stats)
+
+
+def split_holdout(texts: Sequence[str], labels: Sequence[str], holdout: float) -> Tuple[Tuple[list, list], Tuple[list, list]]:
+    """Детерминированно делит корпус на обучающую и проверочную части по хэшу текста"""
+    train, test = ([], []), ([], [])
+    for text, label in zip(texts, labels):
+        part = test if zlib.crc32(normalize_text(text).encode('utf-8')) % 1000 < holdout * 1000 else train
+        part[0].append(text)
+        part[1].append(label)
+    return train, test
+
+
+def evaluate(model: IntentModel, texts: Sequence[str], labels: Sequence[str]) -> Dict[str, Any]:
+    """
+    Оценивает модель на размеченных текстах
+
+    Returns:
+        Точность, полнота и F1 по типам, матрица ошибок (строки - истинный тип)
+        и среднее время предсказания
+    """
+    order = list(INTENT_LABELS)
+    confusion = np.zeros((len(order), len(order)), dtype=np.int64)
+    started = time.perf_counter()
+    for text, label in zip(texts, labels):
+        predicted, _ = model.predict(text)
+        confusion[order.index(label), order.index(predicted)] += 1
+    elapsed = time.perf_counter() - started
+
+    per_class = {}
+    for i, label in enumerate(order):
+        true_positive = confusion[i, i]
+        predicted_count = confusion[:, i].sum()
+        actual_count = confusion[i, :].sum()
+        precision = true_positive / predicted_count if predicted_count else 0.0
+        recall = true_positive / actual_count if actual_count else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        per_class[label] = {
+            "precision": float(precision),
+            "recall": float(recall),
+            "f1": float(f1),
+            "support": int(actual_count)
+        }
+
+    total = int(confusion.sum())
+    return {
+        "accuracy": float(np.trace(confusion) / total) if total else 0.0,
+        "per_class": per_class,
+        "labels": order,
+        "confusion": confusion.tolist(),
+        "avg_predict_us": elapsed / total * 1e6 if total else 0.0
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    """Печатает отчет evaluate"""
+    print(f"{'type':<18} {'precision':>9} {'recall':>9} {'f1':>9} {'support':>8}")
+    for label, metrics in report["per_class"].items():
+        print(f"{label:<18} {metrics['precision']:>9.3f} {metrics['recall']:>9.3f} "
+              f"{metrics['f1']:>9.3f} {metrics['support']:>8}")
+    print(f"\naccuracy: {report['accuracy']:.3f}, predict: {report['avg_predict_us']:.1f} us")
+    print("\nconfusion (rows - true, columns - predicted):")
+    labels = report["labels"]
+    print(" " * 18 + "".join(f"{label[:16]:>18}" for label in labels))
+    for label, row in zip(labels, report["confusion"]):
+        print(f"{label:<18}" + "".join(f"{value:>18}" for value in row))
+
+
+def main() -> None:
+    """Точка входа CLI модели"""
+    parser = argparse.ArgumentParser(description="Локальная модель типа запроса")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bootstrap_parser = commands.add_parser("bootstrap", help="Собрать корпус из журнала детектора")
+    bootstrap_parser.add_argument("--log", required=True, help="Журнал решений детектора (DETECTOR_LOG_PATH)")
+    bootstrap_parser.add_argument("--out", required=True, help="Куда записать корпус")
+    bootstrap_parser.add_argument("--min-confidence", type=float, default=0.8)
+
+    train_parser = commands.add_parser("train", help="Обучить модель")
+    train_parser.add_argument("--corpus", required=True)
+    train_parser.add_argument("--out", required=True, help="Файл модели .npz")
+    train_parser.add_argument("--dim", type=int, default=1 << 14)
+    train_parser.add_argument("--alpha", type=float, default=0.5)
+    train_parser.add_argument("--holdout", type=float, default=0.2, help="Доля корпуса для проверки (0 - без проверки)")
+
+    evaluate_parser = commands.add_parser("evaluate", help="Оценить модель на корпусе")
+    evaluate_parser.add_argument("--model", required=True)
+    evaluate_parser.add_argument("--corpus", required=True)
+
+    export_parser = commands.add_parser("export", help="Выгрузить модель в JSON")
+    export_parser.add_argument("--model", required=True)
+    export_parser.add_argument("--out", required=True)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+
+    if args.command == "bootstrap":
+        stats = bootstrap_corpus(args.log, args.out, args.min_confidence)
+        print(f"Корпус {args.out}: {sum(stats.values())} записей {stats}")
+
+    elif args.command == "train":
+        texts, labels = load_corpus(args.corpus)
+        (train_texts, train_labels), (test_texts, test_labels) = split_holdout(texts, labels, args.holdout)
+        model = IntentModel.train(train_texts, train_labels, dim=args.dim, alpha=args.alpha)
+        model.save(args.out)
+        print(f"Модель {args.out}: обучено на {len(train_texts)} текстах, типы {model.labels}")
+        if test_texts:
+            print(f"\nПроверка на {len(test_texts)} отложенных текстах:\n")
+            print_report(evaluate(model, test_texts, test_labels))
+
+    elif args.command == "evaluate":
+        model = IntentModel.load(args.model)
+        texts, labels = load_corpus(args.corpus)
+        print_report(evaluate(model, texts, labels))
+
+    elif args.command == "export":
+        model = IntentModel.load(args.model)
+        data = {
+            "labels": model.labels,
+            "ngram_range": list(model.ngram_range),
+            "dim": model.dim,
+            "hash": "crc32(utf-8 n-gram) % dim",
+            "log_prior": model.log_prior.tolist(),
+            "log_likelihood": model.log_likelihood.tolist()
+        }
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        print(f"Модель выгружена в {args.out}")
+
+
+if __name__ == "__main__":
+    main()
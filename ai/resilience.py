@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Защита от деградации OpenAI
+Автомат отключения (circuit breaker) по доле ошибок и медленных ответов
+и дублирование (hedging) идемпотентных чтений при медленном первом ответе
+"""
+
+import asyncio
+import time
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Состояния автомата
+STATE_CLOSED = "closed"        # Запросы идут как обычно
+STATE_OPEN = "open"            # Запросы сразу отклоняются
+STATE_HALF_OPEN = "half_open"  # Пропускается пробный запрос
+
+
+class CircuitBreaker:
+    """Автомат отключения по доле ошибок и медленных вызовов в скользящем окне"""
+
+    def __init__(self,
+                 name: str,
+                 window: float = 60,
+                 min_requests: int = 10,
+                 failure_rate: float = 0.5,
+                 slow_call_seconds: float = 30,
+                 slow_call_rate: float = 0.8,
+                 open_seconds: float = 30):
+        """
+        Инициализация автомата
+
+        Args:
+            name: Имя защищаемого вызова (для логов)
+            window: Длина скользящего окна (сек)
+            min_requests: Минимум вызовов в окне для принятия решения
+            failure_rate: Доля ошибок, при которой автомат размыкается (0.0-1.0)
+            slow_call_seconds: Вызов дольше этого считается медленным (сек)
+            slow_call_rate: Доля медленных вызовов, при которой автомат размыкается
+            open_seconds: Сколько держать автомат разомкнутым до пробного вызова (сек)
+        """
+        self.name = name
+        self.window = window
+        self.min_requests = min_requests
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+
+        self.state = STATE_CLOSED
+        # (время, ошибка, медленный) - результаты вызовов в окне
+        self._calls: deque = deque()
+        self._opened_at = 0.0
+        self._probe_started_at: Optional[float] = None
+
+        # Статистика
+        self.opened_count = 0
+        self.rejected_count = 0
+
+    def _trim(self, now: float) -> None:
+        """Убирает из окна устаревшие вызовы"""
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+    def allow(self) -> bool:
+        """
+        Проверяет, можно ли выполнить вызов
+
+        Разрешивший вызов обязан сообщить результат через record().
+
+        Returns:
+            bool: True если вызов разрешен
+        """
+        now = time.monotonic()
+        if self.state == STATE_OPEN and now - self._opened_at >= self.open_seconds:
+            self.state = STATE_HALF_OPEN
+            self._probe_started_at = None
+            logger.info(f"Circuit '{self.name}' half-open, probing")
+
+        if self.state == STATE_HALF_OPEN:
+            # Один пробный вызов за раз; зависшая проба не блокирует автомат навсегда
+            if self._probe_started_at is None or now - self._probe_started_at >= self.open_seconds:
+                self._probe_started_at = now
+                return True
+            self.rejected_count += 1
+            return False
+
+        if self.state == STATE_OPEN:
+            self.rejected_count += 1
+            return False
+        return True
+
+    def record(self, success: bool, latency: float) -> None:
+        """
+        Учитывает результат вызова
+
+        Args:
+            success: Успешен ли вызов
+            latency: Длительность вызова (сек)
+        """
+        now = time.monotonic()
+        slow = latency >= self.slow_call_seconds
+
+        if self.state == STATE_HALF_OPEN:
+            if success and not slow:
+                self.state = STATE_CLOSED
+                self._calls.clear()
+                logger.info(f"Circuit '{self.name}' closed")
+            else:
+                self._open(now)
+            return
+        if self.state == STATE_OPEN:
+            return  # Вызов начат до размыкания
+
+        self._calls.append((now, not success, slow))
+        self._trim(now)
+        if len(self._calls) < self.min_requests:
+            return
+
+        failures = sum(1 for _, failed, _ in self._calls if failed)
+        slow_calls = sum(1 for _, _, is_slow in self._calls if is_slow)
+        if (failures / len(self._calls) >= self.failure_rate
+                or slow_calls / len(self._calls) >= self.slow_call_rate):
+            self._open(now)
+
+    def _open(self, now: float) -> None:
+        """Размыкает автомат"""
+        self.state = STATE_OPEN
+        self._opened_at = now
+        self._calls.clear()
+        self.opened_count += 1
+        logger.warning(f"Circuit '{self.name}' opened for {self.open_seconds:.0f}s")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику автомата
+
+        Returns:
+            Dict[str, Any]: Статистика
+        """
+        self._trim(time.monotonic())
+        calls = len(self._calls)
+        failures = sum(1 for _, failed, _ in self._calls if failed)
+        return {
+            "state": self.state,
+            "calls": calls,
+            "failure_rate": failures / calls if calls else 0.0,
+            "opened": self.opened_count,
+            "rejected": self.rejected_count
+        }
+
+
+class RequestHedger:
+    """Повторяет медленный запрос параллельно и берет первый успешный ответ"""
+
+    def __init__(self,
+                 percentile: float = 0.95,
+                 min_delay: float = 0.2,
+                 min_samples: int = 20,
+                 max_samples: int = 500):
+        """
+        Инициализация
+
+        Args:
+            percentile: Перцентиль задержки, после которого отправляется второй запрос
+            min_delay: Минимальная задержка перед вторым запросом (сек)
+            min_samples: Сколько замеров нужно, прежде чем начать дублировать
+            max_samples: Сколько последних замеров хранить
+        """
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self._latencies: deque = deque(maxlen=max_samples)
+
+        # Статистика
+        self.requests = 0
+        self.hedged_count = 0
+        self.hedge_wins = 0
+        # Дубли, не отправленные из-за нехватки лимита
+        self.suppressed_count = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        """Задержка перед вторым запросом или None, пока замеров мало"""
+        if len(self._latencies) < self.min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * self.percentile))
+        return max(latencies[index], self.min_delay)
+
+    async def run(self,
+                  request: Callable[[], Awaitable[Any]],
+                  hedge_request: Optional[Callable[[], Awaitable[Any]]] = None,
+                  can_hedge: Optional[Callable[[], bool]] = None) -> Any:
+        """
+        Выполняет запрос, дублируя его, если первый ответ задерживается
+
+        Задержка отсчитывается от вызова run, поэтому его нужно вызывать,
+        когда запрос действительно отправляется (например, уже со слотом регулятора).
+
+        Args:
+            request: Функция без аргументов, создающая первый запрос
+            hedge_request: Функция, создающая дублирующий запрос (по умолчанию request)
+            can_hedge: Можно ли сейчас отправить дубль (например, есть ли запас лимита)
+
+        Returns:
+            Результат первого успешного запроса
+        """
+        self.requests += 1
+        started_at = time.monotonic()
+        delay = self.hedge_delay()
+        first = asyncio.ensure_future(request())
+        if delay is None:
+            result = await first
+            self._latencies.append(time.monotonic() - started_at)
+            return result
+
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                if can_hedge is None or can_hedge():
+                    self.hedged_count += 1
+                    pending.add(asyncio.ensure_future((hedge_request or request)()))
+                else:
+                    self.suppressed_count += 1
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.hedge_wins += 1
+                        self._latencies.append(time.monotonic() - started_at)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику дублирования
+
+        Returns:
+            Dict[str, Any]: Статистика
+        """
+        delay = self.hedge_delay()
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged_count,
+            "hedge_wins": self.hedge_wins,
+            "suppressed": self.suppressed_count,
+            "hedge_delay_ms": delay * 1000 if delay is not None else None
+        }
+
@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""
+Централизованное отслеживание run'ов OpenAI Assistant
+Один фоновый цикл опрашивает все активные run'ы с адаптивным интервалом
+"""
+
+import asyncio
+import random
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Optional, Tuple
+from openai import AsyncOpenAI
+
+from ai.governor import OpenAIGovernor, PRIORITY_POLL, governed
+from ai.resilience import RequestHedger
+
+logger = logging.getLogger(__name__)
+
+# Статусы, после которых run больше не меняется
+TERMINAL_RUN_STATUSES: FrozenSet[str] = frozenset({
+    'completed', 'failed', 'cancelled', 'expired', 'incomplete'
+})
+
+
+def extract_message_text(message) -> str:
+    """Склеивает все текстовые части сообщения Assistants API"""
+    parts = []
+    for part in message.content or []:
+        if getattr(part, 'type', None) == 'text':
+            parts.append(part.text.value)
+    return ''.join(parts)
+
+
+async def fetch_run_output_text(openai_client: AsyncOpenAI,
+                                thread_id: str,
+                                run_id: str,
+                                governor: Optional[OpenAIGovernor] = None,
+                                hedger: Optional[RequestHedger] = None) -> Optional[str]:
+    """
+    Получает текст ответа, созданного конкретным run'ом
+    
+    Запрашивает только сообщение этого run'а (run_id, limit=1, новые первыми),
+    а если его нет - ищет ID сообщения в шагах run'а (message_creation).
+    
+    Args:
+        openai_client: Клиент OpenAI
+        thread_id: ID thread'а
+        run_id: ID завершенного run'а
+        governor: Регулятор запросов к OpenAI
+        hedger: Дублирование медленных запросов messages.list
+        
+    Returns:
+        Текст ответа или None, если run не создал текстового сообщения
+    """
+    messages = await governed(
+        governor,
+        openai_client.beta.threads.messages.list,
+        priority=PRIORITY_POLL,
+        hedger=hedger,
+        thread_id=thread_id,
+        run_id=run_id,
+        limit=1,
+        order="desc"
+    )
+    for message in messages.data:
+        text = extract_message_text(message)
+        if message.role == 'assistant' and text:
+            return text
+    
+    logger.info(f"No output message found by run_id for run {run_id}, checking run steps")
+    steps = await governed(
+        governor,
+        openai_client.beta.threads.runs.steps.list,
+        priority=PRIORITY_POLL,
+        thread_id=thread_id,
+        run_id=run_id,
+        order="desc"
+    )
+    for step in steps.data:
+        if step.type != 'message_creation':
+            continue
+        message = await governed(
+            governor,
+            openai_client.beta.threads.messages.retrieve,
+            priority=PRIORITY_POLL,
+            thread_id=thread_id,
+            message_id=step.step_details.message_creation.message_id
+        )
+        text = extract_message_text(message)
+        if text:
+            return text
+    
+    return None
+
+
+class RunRegistry:
+    """
+    Локальный учет активных run'ов по threads
+    
+    Все run'ы создает сам бот, поэтому их статус известен без runs.list.
+    Thread считается известным, если его состояние наблюдалось в этом процессе;
+    для неизвестных threads (после перезапуска) нужна проверка через API.
+    """
+
+    def __init__(self, max_known_threads: int = 100000):
+        """
+        Инициализация реестра
+
+        Args:
+            max_known_threads: Сколько threads без активного run'а помнить (LRU)
+        """
+        self.max_known_threads = max_known_threads
+
+        # Активные run'ы: thread_id -> последний известный объект run'а
+        self._active: Dict[str, object] = {}
+        # Threads, про которые известно, что активного run'а нет
+        self._idle: "OrderedDict[str, None]" = OrderedDict()
+
+        # Статистика
+        self.hits = 0
+        self.misses = 0
+
+    def is_known(self, thread_id: str) -> bool:
+        """Проверяет, известно ли состояние thread'а (учитывается в статистике)"""
+        if thread_id in self._active or thread_id in self._idle:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def get_active(self, thread_id: str):
+        """Возвращает последний известный активный run thread'а или None"""
+        return self._active.get(thread_id)
+
+    def update(self, thread_id: str, run) -> None:
+        """
+        Записывает актуальное состояние run'а
+
+        Args:
+            thread_id: ID thread'а
+            run: Объект run'а с актуальным статусом
+        """
+        if run.status in TERMINAL_RUN_STATUSES:
+            active = self._active.get(thread_id)
+            if active is not None and active.id != run.id:
+                return  # Устаревший run - активен уже другой
+            self._active.pop(thread_id, None)
+            self.mark_idle(thread_id)
+        else:
+            self._idle.pop(thread_id, None)
+            self._active[thread_id] = run
+
+    def mark_idle(self, thread_id: str) -> None:
+        """Отмечает, что у thread'а нет активного run'а"""
+        self._active.pop(thread_id, None)
+        self._idle[thread_id] = None
+        self._idle.move_to_end(thread_id)
+        while len(self._idle) > self.max_known_threads:
+            self._idle.popitem(last=False)
+
+    def forget(self, thread_id: str) -> None:
+        """Забывает thread (например, после удаления)"""
+        self._active.pop(thread_id, None)
+        self._idle.pop(thread_id, None)
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Возвращает статистику реестра
+
+        Returns:
+            Dict[str, int]: Статистика
+        """
+        return {
+            "active_runs": len(self._active),
+            "known_threads": len(self._active) + len(self._idle),
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+@dataclass
+class _TrackedRun:
+    """Состояние одного отслеживаемого run'а"""
+    thread_id: str
+    run: object
+    interval: float
+    next_poll_at: float
+    polling: bool = False
+    waiters: List[Tuple[asyncio.Future, FrozenSet[str]]] = field(default_factory=list)
+
+
+class RunTracker:
+    """Опрашивает статусы всех run'ов в одном цикле и будит ожидающие корутины"""
+
+    def __init__(self,
+                 openai_client: AsyncOpenAI,
+                 registry: Optional[RunRegistry] = None,
+                 governor: Optional[OpenAIGovernor] = None,
+                 hedger: Optional[RequestHedger] = None,
+                 initial_interval: float = 0.15,
+                 max_interval: float = 2.0,
+                 backoff: float = 1.6,
+                 jitter: float = 0.2):
+        """
+        Инициализация трекера
+
+        Args:
+            openai_client: Клиент OpenAI
+            registry: Реестр активных run'ов, обновляемый по результатам опроса
+            governor: Регулятор запросов к OpenAI
+            hedger: Дублирование медленных запросов runs.retrieve
+            initial_interval: Первый интервал опроса run'а (сек)
+            max_interval: Максимальный интервал опроса (сек)
+            backoff: Множитель увеличения интервала после каждого опроса
+            jitter: Доля случайного разброса интервала (0.0-1.0)
+        """
+        self.openai_client = openai_client
+        self.registry = registry
+        self.governor = governor
+        self.hedger = hedger
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+
+        self._runs: Dict[Tuple[str, str], _TrackedRun] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        # Статистика
+        self.polls_count = 0
+        self.resolved_count = 0
+
+    async def wait(self,
+                   thread_id: str,
+                   run,
+                   timeout: float,
+                   stop_statuses: FrozenSet[str] = TERMINAL_RUN_STATUSES):
+        """
+        Ждет, пока run перейдет в один из статусов stop_statuses
+
+        Args:
+            thread_id: ID thread'а
+            run: Текущий объект run'а
+            timeout: Максимальное время ожидания (сек)
+            stop_statuses: Статусы, при которых ожидание завершается
+
+        Returns:
+            Последний полученный объект run'а (по таймауту - с нетерминальным статусом)
+        """
+        if run.status in stop_statuses:
+            return run
+
+        loop = asyncio.get_running_loop()
+        key = (thread_id, run.id)
+        entry = self._runs.get(key)
+        if entry is None:
+            entry = _TrackedRun(
+                thread_id=thread_id,
+                run=run,
+                interval=self.initial_interval,
+                next_poll_at=loop.time() + self.initial_interval
+            )
+            self._runs[key] = entry
+
+        future = loop.create_future()
+        waiter = (future, stop_statuses)
+        entry.waiters.append(waiter)
+        self._ensure_running()
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return entry.run
+        finally:
+            if not future.done():
+                future.cancel()
+            if waiter in entry.waiters:
+                entry.waiters.remove(waiter)
+            if not entry.waiters and self._runs.get(key) is entry:
+                del self._runs[key]
+
+    def _ensure_running(self) -> None:
+        """Запускает фоновый цикл опроса, если он не запущен"""
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._poll_loop())
+        self._wakeup.set()
+
+    async def _poll_loop(self) -> None:
+        """Фоновый цикл: опрашивает run'ы, у которых подошло время"""
+        loop = asyncio.get_running_loop()
+        while self._runs:
+            now = loop.time()
+            next_due = None
+            for entry in list(self._runs.values()):
+                if entry.polling:
+                    continue
+                if entry.next_poll_at <= now:
+                    entry.polling = True
+                    asyncio.create_task(self._poll(entry))
+                elif next_due is None or entry.next_poll_at < next_due:
+                    next_due = entry.next_poll_at
+
+            self._wakeup.clear()
+            timeout = None if next_due is None else max(next_due - now, 0)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, entry: _TrackedRun) -> None:
+        """Получает актуальный статус run'а и будит дождавшихся"""
+        loop = asyncio.get_running_loop()
+        try:
+            self.polls_count += 1
+            entry.run = await governed(
+                self.governor,
+                self.openai_client.beta.threads.runs.retrieve,
+                priority=PRIORITY_POLL,
+                hedger=self.hedger,
+                thread_id=entry.thread_id,
+                run_id=entry.run.id
+            )
+            if self.registry is not None:
+                self.registry.update(entry.thread_id, entry.run)
+        except Exception as e:
+            logger.warning(f"Error polling run {entry.run.id}: {e}")
+        finally:
+            entry.polling = False
+
+        for waiter in list(entry.waiters):
+            future, stop_statuses = waiter
+            if entry.run.status in stop_statuses:
+                entry.waiters.remove(waiter)
+                if not future.done():
+                    future.set_result(entry.run)
+                    self.resolved_count += 1
+
+        key = (entry.thread_id, entry.run.id)
+        if not entry.waiters:
+            if self._runs.get(key) is entry:
+                del self._runs[key]
+        else:
+            entry.interval = min(entry.interval * self.backoff, self.max_interval)
+            spread = entry.interval * self.jitter
+            entry.next_poll_at = loop.time() + entry.interval + random.uniform(-spread, spread)
+
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Возвращает статистику трекера
+
+        Returns:
+            Dict[str, int]: Статистика
+        """
+        return {
+            "tracked_runs": len(self._runs),
+            "polls": self.polls_count,
+            "resolved": self.resolved_count
+        }
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Кэш почти повторяющихся вопросов
+Находит ранее заданные вопросы, отличающиеся порядком слов, опечатками или
+словами-связками ("где склад" / "где ваш склад"), по косинусной близости
+локальных векторов символьных n-грамм и возвращает сохраненный ответ.
+
+Векторы n-грамм сравнивают написание, а не смысл: перефразы другими словами
+не находятся ("где склад" / "адрес вашего склада" - 0.40). Перестановки, опечатки
+и слова-связки дают 0.87-1.00, но и вопросы, отличающиеся одним значимым словом,
+бывают близки к порогу или выше него ("возвраты с озон" / "возвраты с вб",
+"как заключить договор" / "...с ИП" - 0.96). Поэтому близость только отбирает
+кандидата, а попадание засчитывается, если у вопросов совпадают наборы основ
+значимых слов (без предлогов, местоимений и вежливых слов).
+"""
+
+import time
+import logging
+from typing import Any, Dict, FrozenSet, List, Optional
+
+import numpy as np
+
+from ai.cache import is_cacheable_question
+from ai.features import embed_text
+from bot.filters import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Слова, не меняющие смысла вопроса
+_FILLER_WORDS = {
+    "а", "и", "в", "во", "на", "с", "со", "к", "ко", "у", "о", "об", "по", "за", "для", "из", "от", "до",
+    "ли", "же", "бы", "не", "то", "вы", "вас", "вам", "ваш", "ваша", "ваше", "ваши", "вашего", "вашей",
+    "вашу", "ваших", "я", "мы", "нам", "нас", "мне", "меня", "пожалуйста", "подскажите", "скажите",
+    "здравствуйте", "добрый", "день", "привет", "можно"
+}
+# Длина основы: окончания русских слов отличаются после нее
+_STEM_LENGTH = 5
+
+
+def content_stems(question: str) -> FrozenSet[str]:
+    """
+    Основы значимых слов вопроса
+
+    Args:
+        question: Текст вопроса
+
+    Returns:
+        Множество начал слов без слов-связок
+    """
+    return frozenset(word[:_STEM_LENGTH] for word in normalize_text(question).split() if word not in _FILLER_WORDS)
+
+
+class SemanticCache:
+    """Кэш ответов с поиском ближайшего вопроса по матрице векторов float32"""
+
+    def __init__(self,
+                 capacity: int = 5000,
+                 dim: int = 1024,
+                 threshold: float = 0.85,
+                 ttl: float = 3600,
+                 max_words: int = 12):
+        """
+        Инициализация кэша
+
+        Args:
+            capacity: Максимальное количество вопросов
+            dim: Размерность векторов
+            threshold: Минимальная косинусная близость для попадания (0.0-1.0)
+            ttl: Время жизни ответа (сек)
+            max_words: Вопросы длиннее этого числа слов не кэшируются
+        """
+        self.capacity = capacity
+        self.dim = dim
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_words = max_words
+
+        # Строка i матрицы - вектор i-го вопроса; векторы нормированы, поэтому
+        # скалярное произведение равно косинусной близости
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._expires_at = np.zeros(capacity, dtype=np.float64)
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._questions: List[Optional[str]] = [None] * capacity
+        self._stems: List[FrozenSet[str]] = [frozenset()] * capacity
+        self._answers: List[Optional[str]] = [None] * capacity
+        self._size = 0
+
+        # Статистика
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _search(self, vector: np.ndarray, now: float):
+        """Возвращает индекс и близость ближайшего живого вопроса"""
+        scores = self._vectors[:self._size] @ vector
+        scores[self._expires_at[:self._size] < now] = -1.0
+        index = int(np.argmax(scores))
+        return index, float(scores[index])
+
+    def get(self, question: str) -> Optional[str]:
+        """
+        Ищет ответ на похожий вопрос
+
+        Args:
+            question: Текст вопроса
+
+        Returns:
+            Ответ или None
+        """
+        if self._size == 0 or not is_cacheable_question(question, self.max_words):
+            return None
+
+        vector = embed_text(question, self.dim)
+        if not vector.any():
+            return None
+
+        now = time.time()
+        index, score = self._search(vector, now)
+        # Близкое написание при другом значимом слове (озон / вб) - другой вопрос
+        if score < self.threshold or content_stems(question) != self._stems[index]:
+            self.misses += 1
+            return None
+
+        self._last_used[index] = now
+        self.hits += 1
+        logger.info(f"Semantic cache hit ({score:.2f}): '{question[:50]}' ~ '{self._questions[index][:50]}'")
+        return self._answers[index]
+
+    def set(self, question: str, answer: str) -> None:
+        """
+        Сохраняет ответ, если вопрос кэшируемый
+
+        Args:
+            question: Текст вопроса
+            answer: Ответ ассистента
+        """
+        if not answer or not is_cacheable_question(question, self.max_words):
+            return
+
+        vector = embed_text(question, self.dim)
+        if not vector.any():
+            return
+
+        now = time.time()
+        index = None
+        if self._size:
+            nearest, score = self._search(vector, now)
+            if score >= 0.99 and content_stems(question) == self._stems[nearest]:
+                index = nearest  # Тот же вопрос - обновляем ответ
+        if index is None:
+            if self._size < self.capacity:
+                index = self._size
+                self._size += 1
+            else:
+                # Вытесняем устаревший или дольше всех не использованный вопрос
+                usage = np.where(self._expires_at < now, -1.0, self._last_used)
+                index = int(np.argmin(usage))
+                self.evictions += 1
+
+        self._vectors[index] = vector
+        self._expires_at[index] = now + self.ttl
+        self._last_used[index] = now
+        self._questions[index] = question
+        self._stems[index] = content_stems(question)
+        self._answers[index] = answer
+
+    def clear(self) -> None:
+        """Очищает кэш"""
+        self._size = 0
+        self._questions = [None] * self.capacity
+        self._stems = [frozenset()] * self.capacity
+        self._answers = [None] * self.capacity
+
+    def __len__(self) -> int:
+        """Возвращает количество вопросов"""
+        return self._size
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику кэша
+
+        Returns:
+            Dict[str, Any]: Статистика
+        """
+        total = self.hits + self.misses
+        return {
+            "entries": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / total if total else 0.0
+        }
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Сборщик устаревших threads OpenAI
+Threads, к которым пользователи не обращались дольше TTL, удаляются из
+хранилища, а сами threads удаляются в OpenAI пачками с ограничением скорости
+в фоновой полосе регулятора
+"""
+
+import asyncio
+import logging
+from typing import Dict, Optional
+from openai import AsyncOpenAI, NotFoundError
+
+from ai.governor import OpenAIGovernor, PRIORITY_BACKGROUND, governed
+from ai.runs import RunRegistry
+from storage.threads import ThreadStorage
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadCollector:
+    """Фоновое истечение простаивающих threads и их удаление в OpenAI"""
+
+    def __init__(self,
+                 openai_client: AsyncOpenAI,
+                 storage: ThreadStorage,
+                 registry: RunRegistry,
+                 ttl: float = 30 * 86400,
+                 interval: float = 3600,
+                 batch_size: int = 10,
+                 delete_rate: float = 2.0,
+                 governor: Optional[OpenAIGovernor] = None):
+        """
+        Инициализация сборщика
+
+        Args:
+            openai_client: Клиент OpenAI
+            storage: Хранилище threads
+            registry: Реестр активных run'ов (threads с активным run'ом не трогаем)
+            ttl: Время простоя, после которого thread истекает (сек, 0 - не истекает)
+            interval: Период сборки и сохранения отметок обращений (сек)
+            batch_size: Сколько threads удалять параллельно
+            delete_rate: Максимум удалений в секунду
+            governor: Регулятор запросов к OpenAI
+        """
+        self.openai_client = openai_client
+        self.storage = storage
+        self.registry = registry
+        self.ttl = ttl
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.delete_rate = delete_rate
+        self.governor = governor
+
+        self._loop_task: Optional[asyncio.Task] = None
+        self._drain_task: Optional[asyncio.Task] = None
+
+        # Статистика
+        self.expired_count = 0
+        self.deleted_count = 0
+        self.failed_count = 0
+
+    def start(self) -> None:
+        """Запускает периодическую сборку"""
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.create_task(self._run())
+        self.ensure_drain()
+
+    async def stop(self) -> None:
+        """Останавливает сборку и сохраняет отметки обращений"""
+        for task in (self._loop_task, self._drain_task):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self.storage.flush()
+
+    async def _run(self) -> None:
+        """Периодически сохраняет отметки обращений и собирает устаревшие threads"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.collect()
+                self.storage.flush()
+                # Повтор удалений, не прошедших в прошлый раз
+                self.ensure_drain()
+            except Exception as e:
+                logger.error(f"Thread collection failed: {e}")
+
+    def collect(self) -> int:
+        """
+        Удаляет из хранилища threads, простаивающие дольше TTL
+
+        Returns:
+            Количество истекших threads
+        """
+        if self.ttl <= 0:
+            return 0
+        expired = self.storage.expire_idle(
+            self.ttl,
+            keep=lambda thread_id: self.registry.get_active(thread_id) is not None,
+            save=False
+        )
+        if not expired:
+            return 0
+        for thread_id in expired:
+            self.registry.forget(thread_id)
+        self.storage.delete_queue_add(expired)
+        self.expired_count += len(expired)
+        logger.info(f"Expired {len(expired)} idle threads, {self.storage.delete_queue_size()} queued for deletion")
+        self.ensure_drain()
+        return len(expired)
+
+    def enqueue(self, thread_id: str) -> None:
+        """
+        Ставит thread в очередь на удаление в OpenAI
+
+        Args:
+            thread_id: Thread ID
+        """
+        self.storage.delete_queue_add([thread_id])
+        self.ensure_drain()
+
+    def ensure_drain(self) -> None:
+        """Запускает удаление, если очередь не пуста"""
+        if not self.storage.delete_queue_size():
+            return
+        if self._drain_task is None or self._drain_task.done():
+            self._drain_task = asyncio.create_task(self._drain())
+
+    async def _delete(self, thread_id: str) -> None:
+        """Удаляет thread в OpenAI; уже удаленный считается успехом"""
+        try:
+            await governed(
+                self.governor,
+                self.openai_client.beta.threads.delete,
+                priority=PRIORITY_BACKGROUND,
+                thread_id=thread_id
+            )
+        except NotFoundError:
+            pass
+
+    async def _drain(self) -> None:
+        """Удаляет threads из очереди пачками, не быстрее delete_rate в секунду"""
+        deleted = 0
+        # Очередь сохраняется в файл при flush, а не после каждой пачки:
+        # повторное удаление уже удаленного thread безвредно
+        while self.storage.delete_queue_size():
+            batch = self.storage.delete_queue_take(self.batch_size, save=False)
+            try:
+                results = await asyncio.gather(*(self._delete(thread_id) for thread_id in batch),
+                                               return_exceptions=True)
+            except asyncio.CancelledError:
+                self.storage.delete_queue_add(batch, save=False)
+                raise
+            failed = [thread_id for thread_id, result in zip(batch, results) if isinstance(result, BaseException)]
+            deleted += len(batch) - len(failed)
+            self.deleted_count += len(batch) - len(failed)
+            if failed:
+                # Возвращаем в очередь - повторим на следующей сборке
+                self.failed_count += len(failed)
+                self.storage.delete_queue_add(failed, save=False)
+                logger.warning(f"Failed to delete {len(failed)} threads, deletion paused")
+                break
+            if self.delete_rate > 0:
+                await asyncio.sleep(len(batch) / self.delete_rate)
+        self.storage.flush()
+        if deleted:
+            logger.info(f"Deleted {deleted} threads, {self.storage.delete_queue_size()} left in queue")
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Возвращает статистику сборщика
+
+        Returns:
+            Dict[str, int]: Статистика
+        """
+        return {
+            "expired": self.expired_count,
+            "deleted": self.deleted_count,
+            "failed": self.failed_count,
+            "queued": self.storage.delete_queue_size()
+        }
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Пул заранее созданных threads OpenAI
+Новый пользователь получает готовый thread без лишнего запроса к API
+"""
+
+import asyncio
+import logging
+from typing import Dict, Optional
+from openai import AsyncOpenAI
+
+from ai.governor import OpenAIGovernor, PRIORITY_BACKGROUND, governed
+from storage.threads import ThreadStorage
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadPool:
+    """Фоновое пополнение пула свободных threads между нижней и верхней границей"""
+
+    def __init__(self,
+                 openai_client: AsyncOpenAI,
+                 storage: ThreadStorage,
+                 low_watermark: int = 5,
+                 high_watermark: int = 20,
+                 concurrency: int = 5,
+                 governor: Optional[OpenAIGovernor] = None):
+        """
+        Инициализация пула
+
+        Args:
+            openai_client: Клиент OpenAI
+            storage: Хранилище threads, в котором сохраняется пул
+            low_watermark: При каком размере пула запускается пополнение
+            high_watermark: До какого размера пул пополняется
+            concurrency: Сколько threads создавать параллельно
+            governor: Регулятор запросов к OpenAI
+        """
+        self.openai_client = openai_client
+        self.storage = storage
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self.concurrency = concurrency
+        self.governor = governor
+
+        self._refill_task: Optional[asyncio.Task] = None
+
+        # Статистика
+        self.served_count = 0
+        self.miss_count = 0
+        self.created_count = 0
+
+    def acquire(self) -> Optional[str]:
+        """
+        Выдает свободный thread из пула (без сохранения - его делает вызывающий)
+
+        Returns:
+            Thread ID или None, если пул пуст
+        """
+        thread_id = self.storage.pool_pop(save=False)
+        if thread_id:
+            self.served_count += 1
+        else:
+            self.miss_count += 1
+        self.ensure_refill()
+        return thread_id
+
+    def ensure_refill(self) -> None:
+        """Запускает пополнение, если пул опустился до нижней границы"""
+        if self.storage.pool_size() > self.low_watermark:
+            return
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self) -> None:
+        """Создает threads, пока пул не достигнет верхней границы"""
+        while self.storage.pool_size() < self.high_watermark:
+            batch = min(self.concurrency, self.high_watermark - self.storage.pool_size())
+            results = await asyncio.gather(
+                *(governed(self.governor, self.openai_client.beta.threads.create, priority=PRIORITY_BACKGROUND)
+                  for _ in range(batch)),
+                return_exceptions=True
+            )
+            created = [thread.id for thread in results if not isinstance(thread, BaseException)]
+            if created:
+                self.storage.pool_add(created)
+                self.created_count += len(created)
+            if len(created) < batch:
+                logger.warning(f"Failed to create {batch - len(created)} pool threads, refill paused")
+                return
+        logger.info(f"Thread pool refilled: {self.storage.pool_size()} threads")
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Возвращает статистику пула
+
+        Returns:
+            Dict[str, int]: Статистика
+        """
+        return {
+            "size": self.storage.pool_size(),
+            "served": self.served_count,
+            "misses": self.miss_count,
+            "created": self.created_count
+        }
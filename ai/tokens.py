@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Оценка количества токенов
+Без токенизатора: для русского текста один токен в среднем приходится на ~3 символа
+"""
+
+from typing import Dict, Iterable
+
+# Средняя длина токена в символах (консервативно для кириллицы)
+CHARS_PER_TOKEN = 3
+
+# Служебные токены на каждое сообщение чата (роль, разделители)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Оценивает количество токенов в тексте
+
+    Args:
+        text: Исходный текст
+
+    Returns:
+        int: Примерное количество токенов
+    """
+    if not text:
+        return 0
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def estimate_messages_tokens(messages: Iterable[Dict[str, str]]) -> int:
+    """
+    Оценивает количество токенов в списке сообщений чата
+
+    Args:
+        messages: Сообщения в формате {"role": ..., "content": ...}
+
+    Returns:
+        int: Примерное количество токенов
+    """
+    return sum(estimate_tokens(m.get("content") or "") + MESSAGE_OVERHEAD_TOKENS for m in messages)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Инструменты ассистента для отправки файлов
+Вместо отдельного запроса к детектору ассистент сам вызывает инструмент,
+а бот выполняет его, когда run переходит в статус requires_action
+"""
+
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Обработчик вызова: (имя инструмента, аргументы) -> текст результата для ассистента
+ToolHandler = Callable[[str, Dict[str, Any]], Awaitable[str]]
+
+ASSISTANT_TOOLS: List[Dict[str, Any]] = [
+    {
+        "type": "function",
+        "function": {
+            "name": "send_tz_file",
+            "description": (
+                "Отправляет пользователю Excel-файл технического задания (ТЗ) для заполнения. "
+                "Вызывай, только если пользователь явно просит файл ТЗ, бланк или форму."
+            ),
+            "parameters": {"type": "object", "properties": {}, "required": []}
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "send_warehouse_media",
+            "description": (
+                "Отправляет фото склада, адрес, ссылку на карту и схему проезда. "
+                "Вызывай, когда пользователь спрашивает, где находится склад или как до него добраться."
+            ),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "city": {
+                        "type": "string",
+                        "description": "Город склада, если пользователь его назвал"
+                    }
+                },
+                "required": []
+            }
+        }
+    }
+]
+
+TOOL_NAMES = frozenset(tool["function"]["name"] for tool in ASSISTANT_TOOLS)
+
+# Дополнение к инструкциям ассистента на каждый run
+TOOLS_INSTRUCTIONS = (
+    "Если пользователь просит файл ТЗ, вызови send_tz_file. "
+    "Если спрашивает адрес склада или как добраться, вызови send_warehouse_media. "
+    "После вызова коротко сообщи, что отправил."
+)
+
+
+def merge_tools(existing: List[Any], extra: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Добавляет инструменты к уже настроенным у ассистента
+
+    Инструменты run'а заменяют инструменты ассистента, поэтому его собственные
+    (например, file_search) нужно передать вместе с новыми.
+
+    Args:
+        existing: Инструменты ассистента (объекты SDK или словари)
+        extra: Добавляемые инструменты
+
+    Returns:
+        Список инструментов для runs.create
+    """
+    extra_names = {tool["function"]["name"] for tool in extra}
+    merged = []
+    for tool in existing:
+        data = tool.model_dump(exclude_none=True) if hasattr(tool, 'model_dump') else dict(tool)
+        if data.get("type") == "function" and data.get("function", {}).get("name") in extra_names:
+            continue
+        merged.append(data)
+    return merged + list(extra)
+
+
+async def execute_tool_calls(tool_calls: List[Any], handler: ToolHandler) -> List[Dict[str, str]]:
+    """
+    Выполняет вызовы инструментов
+
+    Args:
+        tool_calls: Вызовы (с полями id и function.name / function.arguments)
+        handler: Обработчик вызова инструмента
+
+    Returns:
+        Результаты в формате tool_outputs ({"tool_call_id", "output"})
+    """
+    outputs = []
+    for call in tool_calls:
+        try:
+            arguments = json.loads(call.function.arguments or "{}")
+        except json.JSONDecodeError:
+            arguments = {}
+
+        try:
+            output = await handler(call.function.name, arguments)
+        except Exception as e:
+            logger.error(f"Error executing tool {call.function.name}: {e}")
+            output = f"Ошибка выполнения: {e}"
+
+        logger.info(f"Executed tool {call.function.name} ({call.id})")
+        outputs.append({"tool_call_id": call.id, "output": output})
+    return outputs
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк поиска в кэше похожих вопросов
+Заполняет кэш синтетическими вопросами и измеряет задержку get()
+
+Запуск:
+    python -m benchmarks.bench_semantic_cache --sizes 10000 100000
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+from ai.features import embed_text
+from ai.semantic_cache import SemanticCache
+
+# Словарь для генерации правдоподобных вопросов службе поддержки
+WORDS = [
+    "где", "склад", "адрес", "как", "добраться", "сколько", "стоит", "доставка",
+    "фулфилмент", "упаковка", "маркировка", "хранение", "озон", "вайлдберриз",
+    "яндекс", "маркет", "казань", "москва", "носки", "футболки", "кроссовки",
+    "коробка", "паллета", "приемка", "отгрузка", "тариф", "договор", "оплата",
+    "сроки", "заявка", "поставка", "товар", "возврат", "этикетка", "честный", "знак"
+]
+
+
+LETTERS = "абвгдеежзийклмнопрстуфхцчшщыэюя"
+
+
+def make_question(rng: random.Random) -> str:
+    """Генерирует случайный вопрос: слова словаря и пара редких слов"""
+    words = [rng.choice(WORDS) for _ in range(rng.randint(2, 5))]
+    words += [''.join(rng.choice(LETTERS) for _ in range(rng.randint(5, 9))) for _ in range(2)]
+    rng.shuffle(words)
+    return ' '.join(words)
+
+
+def bench(size: int, dim: int, queries: int, seed: int) -> dict:
+    """Заполняет кэш до size записей и измеряет задержку поиска"""
+    rng = random.Random(seed)
+    cache = SemanticCache(capacity=size, dim=dim, threshold=0.85)
+
+    # Заполняем строки напрямую: set() ищет дубликаты и сделал бы заполнение O(n^2)
+    started = time.perf_counter()
+    now = time.time()
+    for i in range(size):
+        question = make_question(rng)
+        cache._vectors[i] = embed_text(question, dim)
+        cache._questions[i] = question
+        cache._answers[i] = "ответ"
+    cache._expires_at[:size] = now + cache.ttl
+    cache._last_used[:size] = now
+    cache._size = size
+    fill_time = time.perf_counter() - started
+
+    latencies = []
+    for _ in range(queries):
+        question = make_question(rng)
+        started = time.perf_counter()
+        cache.get(question)
+        latencies.append(time.perf_counter() - started)
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "size": len(cache),
+        "matrix_mb": cache._vectors.nbytes / 1024 / 1024,
+        "fill_s": fill_time,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+
+
+def main() -> None:
+    """Точка входа бенчмарка"""
+    parser = argparse.ArgumentParser(description="Бенчмарк кэша похожих вопросов")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'entries':>8} {'matrix MB':>10} {'fill s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for size in args.sizes:
+        r = bench(size, args.dim, args.queries, args.seed)
+        print(f"{r['size']:>8} {r['matrix_mb']:>10.1f} {r['fill_s']:>8.1f} "
+              f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
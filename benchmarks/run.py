@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Набор микробенчмарков для CPU-нагруженных участков бота
+Входные данные генерируются с фиксированным seed, поэтому прогоны сравнимы
+между собой. Результаты можно сохранить как базовую линию (JSON) и затем
+сравнивать с ней: замедление сверх порога считается регрессией.
+
+Логирование на время замеров отключено - измеряется только сам код.
+
+Запуск:
+    python -m benchmarks.run                              # таблица результатов
+    python -m benchmarks.run --save baseline.json         # сохранить базовую линию
+    python -m benchmarks.run --compare baseline.json      # сравнить (код выхода 1 при регрессии)
+    python -m benchmarks.run --filter cleaner
+"""
+
+import argparse
+import json
+import logging
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from ai.cleaner import clean_all_text_marks, clean_source_marks
+from ai.detector import SmartFileDetector
+from ai.intent_matcher import GENERAL_CHAT, TZ_FILE, WAREHOUSE_IMAGES, IntentMatcher
+from ai.intent_model import IntentModel
+from bot.behavior import HumanBehaviorConfig, HumanBehaviorSimulator
+from bot.filters import DuplicateMessageFilter
+from storage.state import StateStorage
+from storage.threads import ThreadStorage
+
+SENTENCES = [
+    "Мы принимаем товар на склад в течение одного рабочего дня после поставки.",
+    "Стоимость хранения одной паллеты составляет 900 рублей в месяц.",
+    "Маркировка «Честный знак» выполняется нашими сотрудниками на месте.",
+    "Отгрузка на склады Wildberries и Ozon происходит по графику маркетплейса.",
+    "Для расчета стоимости пришлите, пожалуйста, объем партии и габариты товара.",
+    "Упаковка в зип-пакет с этикеткой стоит от 12 рублей за единицу.",
+    "Договор можно подписать через ЭДО в течение дня.",
+]
+SOURCE_MARKS = ["【4:11†source】", "[8:14source]", "[8:0tsource]", "【6:0†addresses.txt】", "「3:2source」"]
+QUESTIONS = [
+    "Пришлите файл ТЗ, пожалуйста",
+    "Где находится ваш склад?",
+    "Сколько стоит хранение одной паллеты?",
+    "Как добраться до склада в Казани",
+    "Вы работаете с Ozon и Wildberries?",
+    "Добрый день! Подскажите сроки приемки товара на склад",
+]
+# Тип каждого вопроса QUESTIONS - корпус для обучения локальной модели
+QUESTION_LABELS = [TZ_FILE, WAREHOUSE_IMAGES, GENERAL_CHAT, WAREHOUSE_IMAGES, GENERAL_CHAT, GENERAL_CHAT]
+
+
+def assistant_output(rng: random.Random, sentences: int, mark_every: int = 3) -> str:
+    """Ответ ассистента: абзацы из предложений с метками source"""
+    parts = []
+    for i in range(sentences):
+        parts.append(rng.choice(SENTENCES))
+        if i % mark_every == mark_every - 1:
+            parts.append(rng.choice(SOURCE_MARKS))
+        if i % 5 == 4:
+            parts.append("\n\n   ")
+    return " ".join(parts)
+
+
+@dataclass
+class Benchmark:
+    """Описание бенчмарка"""
+    name: str
+    setup: Callable[[random.Random], Callable[[], Any]]
+    number: int = 100
+    repeat: int = 7
+
+
+BENCHMARKS: List[Benchmark] = []
+
+# Ресурсы текущего бенчмарка (временные директории), освобождаются после замеров
+_resources = ExitStack()
+
+
+def benchmark(name: str, number: int = 100, repeat: int = 7) -> Callable:
+    """Регистрирует функцию подготовки бенчмарка; она возвращает измеряемую операцию"""
+    def register(setup: Callable[[random.Random], Callable[[], Any]]) -> Callable:
+        BENCHMARKS.append(Benchmark(name, setup, number, repeat))
+        return setup
+    return register
+
+
+def temp_directory(prefix: str) -> Path:
+    """Временная директория, удаляемая после замеров бенчмарка"""
+    return Path(_resources.enter_context(tempfile.TemporaryDirectory(prefix=prefix)))
+
+
+@benchmark("cleaner.clean_source_marks/realistic", number=2000)
+def bench_clean_source_realistic(rng: random.Random) -> Callable[[], Any]:
+    text = assistant_output(rng, 12)
+    return lambda: clean_source_marks(text)
+
+
+@benchmark("cleaner.clean_source_marks/large", number=5)
+def bench_clean_source_large(rng: random.Random) -> Callable[[], Any]:
+    text = assistant_output(rng, 4000)
+    return lambda: clean_source_marks(text)
+
+
+@benchmark("cleaner.clean_all_text_marks/realistic", number=2000)
+def bench_clean_all_realistic(rng: random.Random) -> Callable[[], Any]:
+    text = assistant_output(rng, 12)
+    return lambda: clean_all_text_marks(text)
+
+
+@benchmark("cleaner.clean_all_text_marks/large", number=5)
+def bench_clean_all_large(rng: random.Random) -> Callable[[], Any]:
+    text = assistant_output(rng, 4000)
+    return lambda: clean_all_text_marks(text)
+
+
+@benchmark("filters.is_duplicate/full_deques", number=2000)
+def bench_is_duplicate(rng: random.Random) -> Callable[[], Any]:
+    users = 10000
+    duplicate_filter = DuplicateMessageFilter(time_window=10 ** 9)
+    for user_id in range(users):
+        for i in range(duplicate_filter.max_messages_per_user):
+            duplicate_filter.is_duplicate(user_id, f"{rng.choice(QUESTIONS)} {user_id}-{i}")
+    counter = iter(range(10 ** 9))
+
+    def run() -> bool:
+        # Новое уникальное сообщение сравнивается со всей очередью пользователя
+        n = next(counter)
+        return duplicate_filter.is_duplicate(n % users, f"{QUESTIONS[n % len(QUESTIONS)]} новое {n}")
+    return run
+
+
+@benchmark("behavior.process_response/realistic", number=1000)
+def bench_process_response(rng: random.Random) -> Callable[[], Any]:
+    # Симулятор использует модуль random - фиксируем его состояние
+    random.seed(rng.random())
+    simulator = HumanBehaviorSimulator(HumanBehaviorConfig())
+    text = clean_source_marks(assistant_output(rng, 8))
+    return lambda: simulator.process_response(text, "100500")
+
+
+@benchmark("detector._fallback_detection/mixed", number=5000)
+def bench_fallback_detection(rng: random.Random) -> Callable[[], Any]:
+    detector = SmartFileDetector(openai_client=None)
+    questions = [rng.choice(QUESTIONS) for _ in range(64)]
+    counter = iter(range(10 ** 9))
+    return lambda: detector._fallback_detection(questions[next(counter) % len(questions)])
+
+
+@benchmark("intent_matcher.match/mixed", number=5000)
+def bench_intent_matcher(rng: random.Random) -> Callable[[], Any]:
+    matcher = IntentMatcher()
+    questions = [rng.choice(QUESTIONS) for _ in range(64)]
+    counter = iter(range(10 ** 9))
+    return lambda: matcher.match(questions[next(counter) % len(questions)])
+
+
+@benchmark("intent_model.predict/mixed", number=2000)
+def bench_intent_model(rng: random.Random) -> Callable[[], Any]:
+    model = IntentModel.train(QUESTIONS * 20, QUESTION_LABELS * 20)
+    questions = [rng.choice(QUESTIONS) for _ in range(64)]
+    counter = iter(range(10 ** 9))
+    return lambda: model.predict(questions[next(counter) % len(questions)])
+
+
+@benchmark("state.is_bot_active_in_chat/large_blacklist", number=500)
+def bench_is_bot_active(rng: random.Random) -> Callable[[], Any]:
+    storage = StateStorage(str(temp_directory("bench_state_") / "bot_state.json"))
+    size = 10000
+    storage._state["blacklisted_chats"] = {
+        "by_id": [-1000000 - i for i in range(size)],
+        "by_username": [f"chat_{i}" for i in range(size)],
+        "by_title": [f"Чат {i}" for i in range(size)]
+    }
+    # Активный чат - худший случай: проверяются все три списка
+    return lambda: storage.is_bot_active_in_chat(-42, "active_chat", "Активный чат")
+
+
+@benchmark("threads.set/100k", number=1, repeat=5)
+def bench_thread_storage_set(rng: random.Random) -> Callable[[], Any]:
+    storage = ThreadStorage(str(temp_directory("bench_threads_") / "threads.json"))
+    for user_id in range(100000):
+        storage.set(str(user_id), f"thread_{rng.getrandbits(96):024x}", save=False)
+    counter = iter(range(10 ** 9))
+    return lambda: storage.set(str(next(counter) % 100000), f"thread_{next(counter):024x}")
+
+
+def run_benchmark(case: Benchmark, seed: int, scale: float) -> Dict[str, float]:
+    """
+    Выполняет бенчмарк
+
+    Args:
+        case: Бенчмарк
+        seed: Seed входных данных
+        scale: Множитель числа операций в замере (меньше - быстрее, но шумнее)
+
+    Returns:
+        Время одной операции (мкс): медиана, минимум и разброс замеров
+    """
+    with _resources:
+        operation = case.setup(random.Random(seed))
+        number = max(1, int(case.number * scale))
+        operation()  # Прогрев
+
+        samples = []
+        for _ in range(case.repeat):
+            started = time.perf_counter()
+            for _ in range(number):
+                operation()
+            samples.append((time.perf_counter() - started) / number * 1e6)
+
+    return {
+        "median_us": statistics.median(samples),
+        "min_us": min(samples),
+        "stdev_us": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "number": number,
+        "repeat": case.repeat
+    }
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Сравнивает медианы с базовой линией и печатает изменения
+
+    Returns:
+        Названия бенчмарков с регрессией
+    """
+    regressions = []
+    base_results = baseline.get("results", {})
+    print(f"\n{'benchmark':<46} {'baseline us':>12} {'current us':>12} {'change':>8}")
+    for name, result in results.items():
+        base = base_results.get(name)
+        if base is None:
+            print(f"{name:<46} {'-':>12} {result['median_us']:>12.2f} {'new':>8}")
+            continue
+        change = result["median_us"] / base["median_us"] - 1 if base["median_us"] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"{name:<46} {base['median_us']:>12.2f} {result['median_us']:>12.2f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main() -> None:
+    """Точка входа набора бенчмарков"""
+    parser = argparse.ArgumentParser(description="Микробенчмарки CPU-нагруженных участков бота")
+    parser.add_argument("--filter", default="", help="Запускать только бенчмарки, содержащие строку")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--scale", type=float, default=1.0, help="Множитель числа операций в замере")
+    parser.add_argument("--save", default="", help="Сохранить результаты в JSON (базовая линия)")
+    parser.add_argument("--compare", default="", help="Сравнить с базовой линией из JSON")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Допустимое замедление медианы (доля)")
+    parser.add_argument("--list", action="store_true", help="Показать список бенчмарков")
+    args = parser.parse_args()
+
+    cases = [case for case in BENCHMARKS if args.filter in case.name]
+    if args.list:
+        for case in cases:
+            print(case.name)
+        return
+
+    logging.disable(logging.CRITICAL)
+    results = {}
+    print(f"{'benchmark':<46} {'median us':>12} {'min us':>12} {'stdev us':>12}")
+    for case in cases:
+        result = run_benchmark(case, args.seed, args.scale)
+        results[case.name] = result
+        print(f"{case.name:<46} {result['median_us']:>12.2f} {result['min_us']:>12.2f} {result['stdev_us']:>12.2f}")
+
+    if args.save:
+        data = {
+            "meta": {
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "seed": args.seed,
+                "scale": args.scale
+            },
+            "results": results
+        }
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты сохранены в {args.save}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nРегрессии ({len(regressions)}): {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nРегрессий нет")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Склейка серий сообщений
+Пользователи часто разбивают один вопрос на несколько сообщений подряд -
+сообщения, пришедшие в пределах окна, объединяются в один запрос к ИИ
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, List
+
+logger = logging.getLogger(__name__)
+
+# Каждый склеенный запрос экономит вызов детектора и run ассистента
+CALLS_PER_TURN = 2
+
+
+@dataclass
+class _Burst:
+    """Накапливаемая серия сообщений одного пользователя"""
+    first_at: float
+    last_at: float
+    items: List[Any] = field(default_factory=list)
+
+
+class MessageCoalescer:
+    """Откладывает обработку сообщений на окно тишины и объединяет серии"""
+
+    def __init__(self,
+                 on_flush: Callable[[Hashable, List[Any]], None],
+                 window: float = 0.5,
+                 max_wait: float = 4.0):
+        """
+        Инициализация склейки
+
+        Args:
+            on_flush: Вызывается с ключом и списком накопленных элементов серии
+            window: Сколько секунд ждать следующего сообщения после последнего
+            max_wait: Максимальная задержка от первого сообщения серии (сек)
+        """
+        self.on_flush = on_flush
+        self.window = window
+        self.max_wait = max_wait
+
+        self._bursts: Dict[Hashable, _Burst] = {}
+
+        # Статистика
+        self.messages_count = 0
+        self.flushes_count = 0
+
+    def add(self, key: Hashable, item: Any) -> None:
+        """
+        Добавляет сообщение в серию
+
+        Args:
+            key: Ключ серии (например, чат и пользователь)
+            item: Данные сообщения, передаваемые в on_flush
+        """
+        self.messages_count += 1
+
+        if self.window <= 0:
+            self._flush(key, [item])
+            return
+
+        now = asyncio.get_running_loop().time()
+        burst = self._bursts.get(key)
+        if burst is None:
+            burst = _Burst(first_at=now, last_at=now)
+            self._bursts[key] = burst
+            asyncio.create_task(self._timer(key, burst))
+        burst.last_at = now
+        burst.items.append(item)
+
+    async def _timer(self, key: Hashable, burst: _Burst) -> None:
+        """Ждет окончания серии и передает ее дальше"""
+        loop = asyncio.get_running_loop()
+        while True:
+            deadline = min(burst.last_at + self.window, burst.first_at + self.max_wait)
+            delay = deadline - loop.time()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+
+        if self._bursts.get(key) is burst:
+            del self._bursts[key]
+        self._flush(key, burst.items)
+
+    def _flush(self, key: Hashable, items: List[Any]) -> None:
+        """Передает серию обработчику"""
+        self.flushes_count += 1
+        if len(items) > 1:
+            saved = (len(items) - 1) * CALLS_PER_TURN
+            logger.info(f"Coalesced {len(items)} messages for {key}, saved {saved} OpenAI calls")
+        try:
+            self.on_flush(key, items)
+        except Exception as e:
+            logger.error(f"Error flushing coalesced messages for {key}: {e}")
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Возвращает статистику склейки
+
+        Returns:
+            Dict[str, int]: Статистика
+        """
+        merged = self.messages_count - self.flushes_count - sum(
+            len(burst.items) for burst in self._bursts.values()
+        )
+        return {
+            "messages": self.messages_count,
+            "turns": self.flushes_count,
+            "merged": merged,
+            "saved_calls": merged * CALLS_PER_TURN,
+            "open_bursts": len(self._bursts)
+        }
@@ -4,6 +4,7 @@
 """
 
 import hashlib
+import re
 import time
 import logging
 from typing import Dict, Set, Optional
@@ -11,6 +12,30 @@ from collections import defaultdict, deque
 
 logger = logging.getLogger(__name__)
 
+def normalize_text(text: str) -> str:
+    """
+    Нормализует текст для сравнения
+    
+    Args:
+        text: Исходный текст
+        
+    Returns:
+        str: Нормализованный текст
+    """
+    if not text:
+        return ""
+    
+    # Приводим к нижнему регистру
+    normalized = text.lower().strip()
+    
+    # Удаляем лишние пробелы
+    normalized = ' '.join(normalized.split())
+    
+    # Удаляем знаки препинания для лучшего сравнения
+    normalized = re.sub(r'[^\w\s]', '', normalized)
+    
+    return normalized
+
 class DuplicateMessageFilter:
     """Фильтр для блокировки дубликатов сообщений"""
     
@@ -53,20 +78,7 @@ class DuplicateMessageFilter:
         Returns:
             str: Нормализованный текст
         """
-        if not text:
-            return ""
-        
-        # Приводим к нижнему регистру
-        normalized = text.lower().strip()
-        
-        # Удаляем лишние пробелы
-        normalized = ' '.join(normalized.split())
-        
-        # Удаляем знаки препинания для лучшего сравнения
-        import re
-        normalized = re.sub(r'[^\w\s]', '', normalized)
-        
-        return normalized
+        return normalize_text(text)
 
     def _calculate_similarity(self, text1: str, text2: str) -> float:
         """
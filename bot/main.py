@@ -5,20 +5,40 @@ import json
 import os
 import logging
 import random
+import time
+from collections import deque
 from typing import Dict, Optional
-from pyrogram import Client, filters
+from pyrogram import Client, filters, idle
 from pyrogram.enums import ChatAction
 from openai import AsyncOpenAI
 from bot.behavior import HumanBehaviorSimulator, HumanBehaviorConfig
 # Убрали калькулятор - работаем только с OpenAI API
 from files.manager import FileManager
 from ai.detector import SmartFileDetector
+from ai.intent_matcher import IntentMatcher
+from ai.intent_model import IntentModel
 from ai.cleaner import clean_source_marks
+from ai.runs import RunRegistry, RunTracker
+from ai.thread_gc import ThreadCollector
+from ai.thread_pool import ThreadPool
+from ai.cache import DetectionCache, ResponseCache
+from ai.semantic_cache import SemanticCache
+from ai.governor import OpenAIGovernor
+from ai.tokens import estimate_tokens
+from ai.resilience import CircuitBreaker, RequestHedger
+from ai.tools import ToolHandler
+from ai.backends import AssistantsBackend, ChatCompletionsBackend, ConversationBackend
+from ai.http import build_timeout, create_http_client, get_pool_stats, prewarm_connections
 from bot.filters import is_duplicate_message, get_duplicate_stats, clear_user_duplicates
+from bot.streaming import StreamingReply
+from bot.user_queue import UserQueueManager
+from bot.coalescer import MessageCoalescer
+from bot.speculation import Speculation, SpeculationStats
 
 # Импорты новых модулей
 from config import get_settings
 from storage.threads import ThreadStorage
+from storage.history import HistoryStorage
 from storage.state import StateStorage
 
 # Загружаем настройки из конфигурации
@@ -35,6 +55,37 @@ BOT_STATE_FILE = settings.bot.bot_state_file
 LOG_LEVEL = settings.bot.log_level_int
 HUMAN_BEHAVIOR_ENABLED = settings.bot.human_behavior_enabled
 HUMAN_BEHAVIOR_CONFIG = settings.bot.human_behavior_config
+RUN_TIMEOUT = settings.assistant.run_timeout
+STREAMING_ENABLED = settings.assistant.streaming_enabled
+STREAM_EDIT_INTERVAL = settings.assistant.stream_edit_interval
+SPECULATIVE_ENABLED = settings.assistant.speculative_enabled
+DETECTION_MODE = settings.assistant.detection_mode
+CONVERSATION_BACKEND = settings.assistant.backend
+RUN_POLL_INITIAL_INTERVAL = settings.assistant.poll_initial_interval
+RUN_POLL_MAX_INTERVAL = settings.assistant.poll_max_interval
+THREAD_POOL_LOW = settings.assistant.thread_pool_low
+THREAD_POOL_HIGH = settings.assistant.thread_pool_high
+THREAD_TTL_DAYS = settings.assistant.thread_ttl_days
+RESPONSE_CACHE_ENABLED = settings.cache.response_cache_enabled
+SEMANTIC_CACHE_ENABLED = settings.cache.semantic_cache_enabled
+RUN_TOKENS_ESTIMATE = settings.rate_limit.run_tokens_estimate
+BREAKER_ENABLED = settings.resilience.breaker_enabled
+HEDGE_ENABLED = settings.resilience.hedge_enabled
+
+KAZAN_KEYWORDS = ["казань", "казани", "казан", "в казани", "в казань"]
+# Красивая подпись с адресом и ссылкой
+KAZAN_WAREHOUSE_CAPTION = (
+    "📍 **Адрес склада в Казани:**\n"
+    "ул. Горьковское Шоссе, 49 (Технополис \"Химград\")\n\n"
+    "🗺️ **Ссылка на карту:**\n"
+    "https://yandex.ru/maps/-/CHX8J03h\n\n"
+    "📸 **Фото склада и схема проезда** 👆"
+)
+# Ответ, пока автомат отключения ассистента разомкнут
+ASSISTANT_UNAVAILABLE_REPLY = (
+    "Извините, сейчас не получается ответить - сервис временно перегружен. "
+    "Попробуйте, пожалуйста, через пару минут 🙏"
+)
 
 logging.basicConfig(
     level=LOG_LEVEL,
@@ -47,8 +98,14 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 openai_client: Optional[AsyncOpenAI] = None
+http_client = None  # Общий пул HTTP-соединений клиента OpenAI
+governor = OpenAIGovernor(  # Все запросы к OpenAI проходят через общий регулятор
+    max_concurrency=settings.rate_limit.max_concurrency,
+    requests_per_minute=settings.rate_limit.requests_per_minute,
+    tokens_per_minute=settings.rate_limit.tokens_per_minute,
+    max_retries=settings.rate_limit.max_retries
+)
 app: Optional[Client] = None
-processing_users = set()  # Track users currently being processed
 
 # Инициализируем хранилища
 thread_storage = ThreadStorage(THREADS_FILE)
@@ -56,8 +113,51 @@ state_storage = StateStorage(BOT_STATE_FILE)
 
 # Инициализируем компоненты
 human_simulator = HumanBehaviorSimulator(HUMAN_BEHAVIOR_CONFIG)
+user_queues = UserQueueManager(  # Не больше одного запроса к ассистенту на пользователя
+    idle_timeout=settings.bot.user_queue_idle_timeout,
+    max_pending=settings.bot.user_queue_max_pending
+)
 file_manager = FileManager()  # Инициализируем менеджер файлов
+response_cache = ResponseCache(  # Ответы на частые вопросы без запуска ассистента
+    version=f"{ASSISTANT_ID}:{settings.cache.response_cache_version}",
+    max_entries=settings.cache.response_cache_max_entries,
+    ttl=settings.cache.response_cache_ttl,
+    max_bytes=settings.cache.response_cache_max_bytes
+)
+semantic_cache = SemanticCache(  # Ответы на почти повторяющиеся частые вопросы
+    capacity=settings.cache.semantic_cache_capacity,
+    dim=settings.cache.semantic_cache_dim,
+    threshold=settings.cache.semantic_cache_threshold,
+    ttl=settings.cache.response_cache_ttl
+) if SEMANTIC_CACHE_ENABLED else None
 smart_detector = None  # Будет инициализирован после создания OpenAI клиента
+run_registry = RunRegistry()  # Активные run'ы, запущенные этим процессом
+run_tracker: Optional[RunTracker] = None  # Общий опрос статусов run'ов
+thread_pool: Optional[ThreadPool] = None  # Пул заранее созданных threads
+thread_collector: Optional[ThreadCollector] = None  # Сборщик устаревших threads
+conversation_backend: Optional[ConversationBackend] = None  # Движок диалога (Assistants или Chat Completions)
+speculation_stats = SpeculationStats()  # Ответы, начатые до определения типа запроса
+tool_call_counts: Dict[str, int] = {}  # Вызовы инструментов по именам
+turn_latencies: deque = deque(maxlen=1000)  # Время обработки запросов (сек)
+assistant_breaker = CircuitBreaker(  # Быстрый отказ, пока ассистент деградирует
+    "assistant",
+    window=settings.resilience.breaker_window,
+    min_requests=settings.resilience.breaker_min_requests,
+    failure_rate=settings.resilience.breaker_failure_rate,
+    slow_call_seconds=settings.resilience.breaker_slow_call_seconds,
+    slow_call_rate=settings.resilience.breaker_slow_call_rate,
+    open_seconds=settings.resilience.breaker_open_seconds
+) if BREAKER_ENABLED else None
+retrieve_hedger = RequestHedger(  # Дублирование медленных runs.retrieve
+    percentile=settings.resilience.hedge_percentile,
+    min_delay=settings.resilience.hedge_min_delay,
+    min_samples=settings.resilience.hedge_min_samples
+) if HEDGE_ENABLED else None
+messages_hedger = RequestHedger(  # Дублирование медленных messages.list
+    percentile=settings.resilience.hedge_percentile,
+    min_delay=settings.resilience.hedge_min_delay,
+    min_samples=settings.resilience.hedge_min_samples
+) if HEDGE_ENABLED else None
 
 def is_admin(user_id: int) -> bool:
     """Check if user is admin."""
@@ -106,109 +206,201 @@ async def quick_typing(client: Client, chat_id: int, duration: float = None) ->
     await client.send_chat_action(chat_id, ChatAction.TYPING)
     await asyncio.sleep(0.3)
 
-async def get_or_create_thread(user_id: str) -> str:
-    """Get existing thread or create new one for user."""
-    thread_id = thread_storage.get(user_id)
-    if not thread_id:
-        try:
-            thread = await openai_client.beta.threads.create()
-            thread_storage.set(user_id, thread.id)
-            logger.info(f"Created new thread for user {user_id}: {thread.id}")
-            return thread.id
-        except Exception as e:
-            logger.error(f"Error creating thread for user {user_id}: {e}")
-            raise
-    return thread_id
+def get_cached_response(user_id: str, message_text: str) -> Optional[str]:
+    """Look up an answer in the exact and then the semantic response cache."""
+    # Общий ответ подходит только к первому вопросу: дальше вопрос может опираться на диалог
+    if conversation_backend.has_context(user_id):
+        return None
+    cached_response = response_cache.get(message_text) if RESPONSE_CACHE_ENABLED else None
+    if not cached_response and semantic_cache:
+        cached_response = semantic_cache.get(message_text)
+    return cached_response
+
+def remember_response(message_text: str, response_text: str) -> None:
+    """Store a successful assistant answer in the response caches."""
+    if RESPONSE_CACHE_ENABLED:
+        response_cache.set(message_text, response_text)
+    if semantic_cache:
+        semantic_cache.set(message_text, response_text)
+
+def record_assistant_call(success: bool, started_at: float) -> None:
+    """Report an assistant turn outcome to the circuit breaker."""
+    if assistant_breaker:
+        assistant_breaker.record(success, time.monotonic() - started_at)
+
+def record_wasted_turn(message_text: str) -> None:
+    """Meter the spend of a discarded speculative answer."""
+    # Движок Assistants до подтверждения только читает thread - run не запускался
+    if conversation_backend.speculative_generation:
+        speculation_stats.record_wasted_run(RUN_TOKENS_ESTIMATE + estimate_tokens(message_text))
 
-async def get_assistant_response(user_id: str, message_text: str) -> str:
-    """Get response from OpenAI Assistant with proper thread management."""
+async def get_assistant_response(user_id: str, message_text: str,
+                                 tool_handler: Optional[ToolHandler] = None,
+                                 gate: Optional[asyncio.Event] = None) -> str:
+    """Get response from the conversation backend.
+    
+    With a tool handler the assistant may call the file-sending tools; the answer
+    is empty if it only called tools. With a gate the backend leaves the
+    conversation untouched until the gate is set.
+    """
+    if assistant_breaker and not assistant_breaker.allow():
+        return ASSISTANT_UNAVAILABLE_REPLY
+    
+    started_at = time.monotonic()
+    # В кэш попадают только ответы без предыдущего контекста диалога
+    first_turn = not conversation_backend.has_context(user_id)
     try:
-        thread_id = await get_or_create_thread(user_id)
+        result = await conversation_backend.run_turn(user_id, message_text, tool_handler=tool_handler, gate=gate)
+        record_assistant_call(result.status == 'completed', started_at)
         
-        try:
-            runs = await openai_client.beta.threads.runs.list(thread_id=thread_id, limit=1)
-            if runs.data and runs.data[0].status in ['queued', 'in_progress', 'requires_action']:
-                logger.info(f"Waiting for active run to complete for user {user_id}")
-                active_run = runs.data[0]
-                
-                timeout = 30
-                elapsed = 0
-                while active_run.status in ['queued', 'in_progress', 'requires_action'] and elapsed < timeout:
-                    await asyncio.sleep(1)
-                    elapsed += 1
-                    active_run = await openai_client.beta.threads.runs.retrieve(
-                        thread_id=thread_id,
-                        run_id=active_run.id
-                    )
-                
-                if elapsed >= timeout:
-                    logger.warning(f"Timeout waiting for active run for user {user_id}")
-                    try:
-                        await openai_client.beta.threads.runs.cancel(
-                            thread_id=thread_id,
-                            run_id=active_run.id
-                        )
-                    except:
-                        pass
-        except Exception as e:
-            logger.warning(f"Error checking active runs: {e}")
+        if result.status == 'completed' and result.text:
+            # Очищаем ответ от меток source
+            cleaned_response = clean_source_marks(result.text)
+            if first_turn and not result.tool_calls:
+                # Ответ без отправленного файла не заменит вызов инструмента
+                remember_response(message_text, cleaned_response)
+            return cleaned_response
+        if result.status == 'completed' and result.tool_calls:
+            return ""
         
-        # Add user message to thread with retry logic
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                await openai_client.beta.threads.messages.create(
-                    thread_id=thread_id,
-                    role="user",
-                    content=message_text
-                )
-                break
-            except Exception as e:
-                logger.warning(f"Attempt {attempt + 1} failed to add message: {e}")
-                if attempt < max_retries - 1:
-                    await asyncio.sleep(2)  # Wait before retry
-                else:
-                    raise e
-        
-        # Run assistant
-        run = await openai_client.beta.threads.runs.create(
-            thread_id=thread_id,
-            assistant_id=ASSISTANT_ID
+        logger.error(f"Turn failed with status: {result.status}")
+        return f"Ошибка ассистента: {result.status}"
+    
+    except asyncio.CancelledError:
+        # Отброшенный спекулятивный ответ
+        record_wasted_turn(message_text)
+        raise
+    except Exception as e:
+        record_assistant_call(False, started_at)
+        logger.error(f"Error getting assistant response: {e}")
+        return f"Ошибка: {str(e)}"
+
+async def stream_assistant_response(client: Client, chat_id: int, user_id: str, message_text: str,
+                                    gate: Optional[asyncio.Event] = None,
+                                    tool_handler: Optional[ToolHandler] = None) -> str:
+    """Stream response from the conversation backend into a progressively edited message.
+    
+    With a gate nothing is sent to the chat until the gate is set. With a tool
+    handler the assistant may call the file-sending tools.
+    """
+    if assistant_breaker and not assistant_breaker.allow():
+        if gate:
+            await gate.wait()
+        await send_human_like_response(client, chat_id, ASSISTANT_UNAVAILABLE_REPLY, user_id)
+        return ASSISTANT_UNAVAILABLE_REPLY
+    
+    reply = StreamingReply(client, chat_id, edit_interval=STREAM_EDIT_INTERVAL, gate=gate)
+    if gate:
+        reply.start_when_open()
+    started_at = time.monotonic()
+    # В кэш попадают только ответы без предыдущего контекста диалога
+    first_turn = not conversation_backend.has_context(user_id)
+    
+    try:
+        if not gate:
+            await reply.start()
+        result = await conversation_backend.run_turn(
+            user_id, message_text, on_text=reply.update, tool_handler=tool_handler, gate=gate
         )
+        record_assistant_call(result.status == 'completed', started_at)
         
-        # Wait for completion with timeout
-        timeout = 60  # 60 seconds timeout
-        elapsed = 0
-        while run.status in ['queued', 'in_progress', 'requires_action'] and elapsed < timeout:
-            await asyncio.sleep(1)
-            elapsed += 1
-            run = await openai_client.beta.threads.runs.retrieve(
-                thread_id=thread_id,
-                run_id=run.id
-            )
-        
-        if run.status == 'completed':
-            messages = await openai_client.beta.threads.messages.list(thread_id=thread_id)
-            if messages.data:
-                last_message = messages.data[0]
-                if last_message.content:
-                    response_text = last_message.content[0].text.value
-                    # Очищаем ответ от меток source
-                    cleaned_response = clean_source_marks(response_text)
-                    return cleaned_response
+        if result.status == 'completed' and result.text:
+            response_text = clean_source_marks(result.text)
+            await reply.finish(response_text)
+            if first_turn and not result.tool_calls:
+                # Ответ без отправленного файла не заменит вызов инструмента
+                remember_response(message_text, response_text)
+            return response_text
+        if result.status == 'completed' and result.tool_calls:
+            # Ассистент только отправил файлы - заглушка не нужна
+            await reply.discard()
+            return ""
         
-        logger.error(f"Run failed with status: {run.status} (timeout: {elapsed >= timeout})")
-        return f"Ошибка ассистента: {run.status}"
-            
+        logger.error(f"Streamed turn failed with status: {result.status}")
+        response_text = f"Ошибка ассистента: {result.status}"
+    
+    except asyncio.CancelledError:
+        # Отброшенный спекулятивный ответ
+        reply.cancel()
+        record_wasted_turn(message_text)
+        raise
     except Exception as e:
-        logger.error(f"Error getting assistant response: {e}")
-        return f"Ошибка: {str(e)}"
+        record_assistant_call(False, started_at)
+        logger.error(f"Error streaming assistant response: {e}")
+        response_text = f"Ошибка: {str(e)}"
+    
+    try:
+        await reply.finish(response_text)
+    except Exception as e:
+        logger.error(f"Error sending message: {e}")
+    return response_text
 
-async def detect_request_type_smart(message_text: str) -> Dict[str, any]:
+async def reply_with_assistant(client: Client, chat_id: int, user_id: str, message_text: str,
+                               gate: Optional[asyncio.Event] = None,
+                               tool_handler: Optional[ToolHandler] = None) -> None:
+    """Answer via OpenAI Assistant, streaming the reply when enabled.
+    
+    With a gate the answer is prepared right away but shown only once the gate is set.
+    With a tool handler the assistant can send files itself.
+    """
+    # Частые общие вопросы отвечаются из кэша без run'а
+    # (в thread пользователя такой вопрос не попадает)
+    cached_response = get_cached_response(user_id, message_text)
+    if cached_response:
+        if gate:
+            await gate.wait()
+        await send_human_like_response(client, chat_id, cached_response, user_id)
+        return
+    
+    if STREAMING_ENABLED:
+        await stream_assistant_response(client, chat_id, user_id, message_text, gate, tool_handler)
+    else:
+        response = await get_assistant_response(user_id, message_text, tool_handler, gate)
+        if gate:
+            try:
+                await gate.wait()
+            except asyncio.CancelledError:
+                # Ответ уже получен, но не понадобился
+                record_wasted_turn(message_text)
+                raise
+        if response:
+            await send_human_like_response(client, chat_id, response, user_id)
+
+def start_speculative_reply(client: Client, chat_id: int, user_id: str, message_text: str,
+                            local_result: Optional[Dict[str, any]] = None) -> Optional[Speculation]:
+    """Start preparing the assistant answer before the request type is known."""
+    if not SPECULATIVE_ENABLED or DETECTION_MODE != "llm":
+        return None
+    # Assistants до подтверждения только читает thread - выигрыша нет, а слоты заняты
+    if not conversation_backend.speculative_generation:
+        return None
+    # Уверенный локальный ответ детектора приходит сразу - готовить ответ заранее незачем
+    if local_result is not None:
+        return None
+    speculation_stats.started += 1
+    return Speculation(lambda gate: reply_with_assistant(client, chat_id, user_id, message_text, gate))
+
+async def answer_general(client: Client, chat_id: int, user_id: str, message_text: str,
+                         speculation: Optional[Speculation] = None) -> None:
+    """Answer via the assistant, reusing the speculative answer when there is one."""
+    if speculation is None:
+        await reply_with_assistant(client, chat_id, user_id, message_text)
+        return
+    speculation_stats.confirmed += 1
+    await speculation.confirm()
+
+def discard_speculation(speculation: Optional[Speculation]) -> None:
+    """Drop a speculative answer that turned out not to be needed."""
+    if speculation is None or speculation.settled:
+        return
+    speculation_stats.discarded += 1
+    speculation.discard()
+
+async def detect_request_type_smart(message_text: str, local: Optional[tuple] = None) -> Dict[str, any]:
     """Умное определение типа запроса с использованием OpenAI"""
     try:
         if smart_detector:
-            result = await smart_detector.detect_request_type(message_text)
+            result = await smart_detector.detect_request_type(message_text, local)
             
             # Минимальная валидация - только очень низкая уверенность
             if result["confidence"] < 0.5:
@@ -270,33 +462,52 @@ async def handle_tz_file_request(client: Client, message) -> None:
             str(message.from_user.id)
         )
 
-async def handle_warehouse_request_with_chatgpt(client: Client, message) -> None:
+def mentions_kazan(text: str) -> bool:
+    """Check whether the text is about the Kazan warehouse."""
+    text_lower = text.lower()
+    return any(keyword in text_lower for keyword in KAZAN_KEYWORDS)
+
+def make_tool_handler(client: Client, message, text: str) -> ToolHandler:
+    """Build the assistant tool handler that sends files to the message's chat."""
+    chat_id = message.chat.id
+    
+    async def handle_tool(name: str, arguments: Dict[str, any]) -> str:
+        tool_call_counts[name] = tool_call_counts.get(name, 0) + 1
+        if name == "send_tz_file":
+            await client.send_chat_action(chat_id, ChatAction.UPLOAD_DOCUMENT)
+            if await file_manager.send_tz_file(client, chat_id):
+                logger.info(f"Sent TZ file to user {message.from_user.id} (tool call)")
+                return "Файл ТЗ отправлен пользователю."
+            return "Не удалось отправить файл ТЗ. Извинись и предложи попробовать позже."
+        if name == "send_warehouse_media":
+            if not mentions_kazan(arguments.get("city") or text):
+                return "Фото и схема проезда есть только для склада в Казани. Ответь пользователю текстом."
+            await client.send_chat_action(chat_id, ChatAction.UPLOAD_PHOTO)
+            if await file_manager.send_warehouse_with_caption(client, chat_id, KAZAN_WAREHOUSE_CAPTION):
+                logger.info(f"Sent warehouse info for Kazan to user {message.from_user.id} (tool call)")
+                return "Фото склада в Казани, адрес и ссылка на карту отправлены пользователю."
+            return "Не удалось отправить фото склада. Сообщи адрес текстом."
+        return f"Неизвестный инструмент: {name}"
+    
+    return handle_tool
+
+async def handle_warehouse_request_with_chatgpt(client: Client, message, text: Optional[str] = None,
+                                                speculation: Optional[Speculation] = None) -> None:
     """Обрабатывает запросы о складе с интеграцией ChatGPT и изображений"""
     try:
-        # Проверяем, упоминается ли Казань в запросе
-        text_lower = message.text.lower()
-        kazan_keywords = ["казань", "казани", "казан", "в казани", "в казань"]
+        text = text or message.text
         
-        if any(keyword in text_lower for keyword in kazan_keywords):
+        # Проверяем, упоминается ли Казань в запросе
+        if mentions_kazan(text):
             # Для Казани - отправляем изображения с красивой подписью
+            discard_speculation(speculation)
             await client.send_chat_action(message.chat.id, ChatAction.UPLOAD_PHOTO)
-            
-            # Красивая подпись с адресом и ссылкой
-            caption = (
-                "📍 **Адрес склада в Казани:**\n"
-                "ул. Горьковское Шоссе, 49 (Технополис \"Химград\")\n\n"
-                "🗺️ **Ссылка на карту:**\n"
-                "https://yandex.ru/maps/-/CHX8J03h\n\n"
-                "📸 **Фото склада и схема проезда** 👆"
-            )
-            
-            await file_manager.send_warehouse_with_caption(client, message.chat.id, caption)
+            await file_manager.send_warehouse_with_caption(client, message.chat.id, KAZAN_WAREHOUSE_CAPTION)
             
             logger.info(f"Sent warehouse info for Kazan to user {message.from_user.id}")
         else:
             # Для других городов - только ответ от ChatGPT
-            response = await get_assistant_response(str(message.from_user.id), message.text)
-            await send_human_like_response(client, message.chat.id, response, str(message.from_user.id))
+            await answer_general(client, message.chat.id, str(message.from_user.id), text, speculation)
             logger.info(f"Sent ChatGPT response for non-Kazan request to user {message.from_user.id}")
         
     except Exception as e:
@@ -332,6 +543,67 @@ async def handle_warehouse_images_request(client: Client, message) -> None:
             str(message.from_user.id)
         )
 
+async def process_user_request(client: Client, message, text: str, source: str) -> None:
+    """Detect request type and answer it (runs inside the user's queue)."""
+    started_at = time.monotonic()
+    if DETECTION_MODE == "tools":
+        # Тип запроса определяет сам ассистент, вызывая инструменты
+        try:
+            await reply_with_assistant(
+                client, message.chat.id, str(message.from_user.id), text,
+                tool_handler=make_tool_handler(client, message, text)
+            )
+            logger.info(f"Replied to {source} message from user {message.from_user.id}")
+        except Exception as e:
+            logger.error(f"Error handling {source} message: {e}")
+        finally:
+            turn_latencies.append(time.monotonic() - started_at)
+        return
+    
+    # Локальные уровни детектора считаются один раз: для спекуляции и для определения типа
+    local = smart_detector.detect_locally(text) if smart_detector else None
+    # Ответ ассистента готовится параллельно с определением типа запроса
+    speculation = start_speculative_reply(
+        client, message.chat.id, str(message.from_user.id), text, local[0] if local else None
+    )
+    try:
+        # Умное определение типа запроса
+        detection_result = await detect_request_type_smart(text, local)
+        request_type = detection_result.get("type", "GENERAL_CHAT")
+        confidence = detection_result.get("confidence", 0.5)
+        
+        logger.info(f"Detected {source} request type: {request_type} (confidence: {confidence})")
+        
+        # Обрабатываем в зависимости от типа
+        if request_type == "TZ_FILE":
+            discard_speculation(speculation)
+            await handle_tz_file_request(client, message)
+        elif request_type == "WAREHOUSE_IMAGES":
+            # Для запросов о складе - сначала получаем ответ от ChatGPT, затем добавляем изображения
+            await handle_warehouse_request_with_chatgpt(client, message, text, speculation)
+        else:  # GENERAL_CHAT и LOGISTICS_CALCULATION - обрабатываем как обычное общение
+            # Обычная обработка через OpenAI Assistant
+            await answer_general(client, message.chat.id, str(message.from_user.id), text, speculation)
+            logger.info(f"Replied to {source} message from user {message.from_user.id}")
+            
+    except Exception as e:
+        logger.error(f"Error handling {source} message: {e}")
+    finally:
+        discard_speculation(speculation)
+        turn_latencies.append(time.monotonic() - started_at)
+
+def submit_coalesced(key: tuple, items: list) -> None:
+    """Send a burst of messages from one user to the user's queue as one request."""
+    client, message, _, source = items[-1]
+    text = '\n'.join(item[2] for item in items)
+    user_queues.submit(message.from_user.id, lambda: process_user_request(client, message, text, source))
+
+message_coalescer = MessageCoalescer(  # Склейка серий сообщений в один запрос
+    on_flush=submit_coalesced,
+    window=settings.bot.coalesce_window,
+    max_wait=settings.bot.coalesce_max_wait
+)
+
 async def handle_private_message(client: Client, message) -> None:
     """Handle private messages."""
     if not message.text:
@@ -350,47 +622,16 @@ async def handle_private_message(client: Client, message) -> None:
         logger.info(f"User {user_id} (@{user_username}) is blocked")
         return
     
-    # Check if user is already being processed
-    if user_id in processing_users:
-        logger.info(f"User {user_id} is already being processed, skipping")
-        return
-    
-    # Add user to processing set
-    processing_users.add(user_id)
-    
-    # Debug info
-    logger.info(f"Processing message from user {user_id} (@{user_username}) - not blocked")
-    
     # Проверяем на дубликаты сообщений
     if is_duplicate_message(user_id, message.text):
         logger.info(f"Duplicate message blocked from user {user_id}: {message.text[:50]}...")
         return
     
-    try:
-        # Умное определение типа запроса
-        detection_result = await detect_request_type_smart(message.text)
-        request_type = detection_result.get("type", "GENERAL_CHAT")
-        confidence = detection_result.get("confidence", 0.5)
-        
-        logger.info(f"Detected request type: {request_type} (confidence: {confidence})")
-        
-        # Обрабатываем в зависимости от типа
-        if request_type == "TZ_FILE":
-            await handle_tz_file_request(client, message)
-        elif request_type == "WAREHOUSE_IMAGES":
-            # Для запросов о складе - сначала получаем ответ от ChatGPT, затем добавляем изображения
-            await handle_warehouse_request_with_chatgpt(client, message)
-        else:  # GENERAL_CHAT и LOGISTICS_CALCULATION - обрабатываем как обычное общение
-            # Обычная обработка через OpenAI Assistant
-            response = await get_assistant_response(str(message.from_user.id), message.text)
-            await send_human_like_response(client, message.chat.id, response, str(message.from_user.id))
-            logger.info(f"Replied to private message from user {message.from_user.id}")
-            
-    except Exception as e:
-        logger.error(f"Error handling private message: {e}")
-    finally:
-        # Remove user from processing set
-        processing_users.discard(user_id)
+    # Debug info
+    logger.info(f"Processing message from user {user_id} (@{user_username}) - not blocked")
+    
+    # Серия сообщений склеивается и уходит в очередь пользователя одним запросом
+    message_coalescer.add((message.chat.id, user_id), (client, message, message.text, "private"))
 
 async def handle_group_message(client: Client, message) -> None:
     """Handle group messages when bot is mentioned."""
@@ -406,28 +647,8 @@ async def handle_group_message(client: Client, message) -> None:
     if not user_text:
         return
     
-    try:
-        # Умное определение типа запроса
-        detection_result = await detect_request_type_smart(user_text)
-        request_type = detection_result.get("type", "GENERAL_CHAT")
-        confidence = detection_result.get("confidence", 0.5)
-        
-        logger.info(f"Detected group request type: {request_type} (confidence: {confidence})")
-        
-        # Обрабатываем в зависимости от типа
-        if request_type == "TZ_FILE":
-            await handle_tz_file_request(client, message)
-        elif request_type == "WAREHOUSE_IMAGES":
-            # Для запросов о складе - сначала получаем ответ от ChatGPT, затем добавляем изображения
-            await handle_warehouse_request_with_chatgpt(client, message)
-        else:  # GENERAL_CHAT и LOGISTICS_CALCULATION - обрабатываем как обычное общение
-            # Обычная обработка через OpenAI Assistant
-            response = await get_assistant_response(str(message.from_user.id), user_text)
-            await send_human_like_response(client, message.chat.id, response, str(message.from_user.id))
-            logger.info(f"Replied to group message from user {message.from_user.id}")
-            
-    except Exception as e:
-        logger.error(f"Error handling group message: {e}")
+    # Thread общий для лички и групп, поэтому очередь тоже общая
+    message_coalescer.add((chat_id, message.from_user.id), (client, message, user_text, "group"))
 
 # Остальные функции остаются без изменений...
 async def start_command(client: Client, message) -> None:
@@ -438,8 +659,7 @@ async def start_command(client: Client, message) -> None:
 async def clear_context(client: Client, message) -> None:
     """Handle /clear command."""
     user_id = str(message.from_user.id)
-    if thread_storage.get(user_id):
-        thread_storage.delete(user_id)
+    if await conversation_backend.reset(user_id):
         logger.info(f"Cleared context for user {user_id}")
     await quick_typing(client, message.chat.id)
     await message.reply('✅ Контекст очищен!')
@@ -466,11 +686,21 @@ async def status_command(client: Client, message) -> None:
     # Получаем статистику дубликатов
     duplicate_stats = get_duplicate_stats()
     
+    # Получаем статистику очередей
+    queue_stats = user_queues.get_stats()
+    coalesce_stats = message_coalescer.get_stats()
+    registry_stats = run_registry.get_stats()
+    cache_stats = response_cache.get_stats()
+    governor_stats = governor.get_stats()
+    user_lane = governor_stats["lanes"]["user"]
+    poll_lane = governor_stats["lanes"]["poll"]
+    
     status_text = (
         f'📊 **Статус бота:** {global_status}\n'
         f'🧵 **Thread:** {thread_id}\n'
         f'🤖 **Ассистент:** {BOT_NAME}\n'
         f'📁 **Всего threads:** {total_threads}\n'
+        f'🧵 **Свободных threads в пуле:** {thread_storage.pool_size()}\n'
         f'🚫 **Заблокированных чатов:** {total_blocked}\n'
         f'   • По ID: {blacklist_stats["by_id"]}\n'
         f'   • По username: {blacklist_stats["by_username"]}\n'
@@ -481,8 +711,107 @@ async def status_command(client: Client, message) -> None:
         f'🔄 **Фильтр дубликатов:** 🟢 Активен\n'
         f'   • Обработано: {duplicate_stats["total_processed"]}\n'
         f'   • Заблокировано: {duplicate_stats["blocked_count"]}\n'
-        f'   • Активных пользователей: {duplicate_stats["active_users"]}'
+        f'   • Активных пользователей: {duplicate_stats["active_users"]}\n'
+        f'📬 **Очереди сообщений:**\n'
+        f'   • Активных пользователей: {queue_stats["active_users"]}\n'
+        f'   • В ожидании: {queue_stats["pending"]}\n'
+        f'   • Обработано: {queue_stats["processed"]}\n'
+        f'   • Отброшено: {queue_stats["dropped"]}\n'
+        f'🧩 **Склейка сообщений:**\n'
+        f'   • Сообщений: {coalesce_stats["messages"]}\n'
+        f'   • Запросов к ИИ: {coalesce_stats["turns"]}\n'
+        f'   • Сэкономлено вызовов: {coalesce_stats["saved_calls"]}\n'
+        f'🏃 **Активных run\'ов:** {registry_stats["active_runs"]}\n'
+        f'   • Проверок без runs.list: {registry_stats["hits"]}\n'
+        f'   • Проверок через runs.list: {registry_stats["misses"]}\n'
+        f'💾 **Кэш ответов:** {"🟢 Активен" if RESPONSE_CACHE_ENABLED else "🔴 Выключен"}\n'
+        f'   • Записей: {cache_stats["entries"]}\n'
+        f'   • Попаданий: {cache_stats["hits"]}\n'
+        f'   • Промахов: {cache_stats["misses"]}\n'
+        f'🚦 **Запросы к OpenAI:** активных {governor_stats["active"]}, в очереди {governor_stats["queued"]}\n'
+        f'   • Ожидание (польз.): ср. {user_lane["avg_wait_ms"]:.0f} мс, p95 {user_lane["p95_wait_ms"]:.0f} мс\n'
+        f'   • Ожидание (опрос): ср. {poll_lane["avg_wait_ms"]:.0f} мс, p95 {poll_lane["p95_wait_ms"]:.0f} мс\n'
+        f'   • Ответов 429: {governor_stats["rate_limited"]}, сбоев 5xx/сети: {governor_stats["transient_errors"]}'
+    )
+    backend_stats = conversation_backend.get_stats()
+    status_text += (
+        f'\n💬 **Движок диалога:** {"Chat Completions" if backend_stats["backend"] == "chat" else "Assistants API"}, '
+        f'диалогов {backend_stats["conversations"]}'
+    )
+    if "threads_gc" in backend_stats:
+        gc_stats = backend_stats["threads_gc"]
+        status_text += (
+            f'\n🗑 **Сборка threads:** истекло {gc_stats["expired"]}, удалено в OpenAI {gc_stats["deleted"]}\n'
+            f'   • В очереди на удаление: {gc_stats["queued"]}, ошибок: {gc_stats["failed"]}'
+        )
+    latencies = sorted(turn_latencies)
+    status_text += f'\n🧭 **Определение запросов:** {"инструменты ассистента" if DETECTION_MODE == "tools" else "отдельный запрос"}'
+    if DETECTION_MODE == "llm" and smart_detector and (smart_detector.matcher or smart_detector.model):
+        detector_stats = smart_detector.get_stats()
+        status_text += (
+            f'\n   • По ключевым словам: {detector_stats["local"]}, моделью: {detector_stats["model"]}, через LLM: {detector_stats["escalated"]} '
+            f'({detector_stats["escalation_rate"]:.0%}), сэкономлено ~{detector_stats["tokens_avoided"]} токенов'
+        )
+    if DETECTION_MODE == "llm" and smart_detector and smart_detector.cache:
+        detection_cache_stats = smart_detector.cache.get_stats()
+        status_text += (
+            f'\n   • Кэш решений: {detection_cache_stats["entries"]} записей, '
+            f'попаданий {detection_cache_stats["hit_ratio"]:.0%}, '
+            f'общих запросов {detection_cache_stats["shared"]}'
+        )
+    if DETECTION_MODE == "llm" and smart_detector and smart_detector.batch_size > 1:
+        batch_stats = smart_detector.get_stats()
+        status_text += (
+            f'\n   • Пачек: {batch_stats["batches"]} на {batch_stats["batched_items"]} сообщений, '
+            f'повторов по одному: {batch_stats["batch_item_retries"]}'
+        )
+    if latencies:
+        status_text += (
+            f'\n   • Время ответа: p50 {latencies[len(latencies) // 2]:.1f} с, '
+            f'p95 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]:.1f} с'
+        )
+    if tool_call_counts:
+        status_text += '\n   • Вызовов инструментов: ' + ', '.join(
+            f'{name} {count}' for name, count in tool_call_counts.items()
+        )
+    if SPECULATIVE_ENABLED and DETECTION_MODE == "llm" and conversation_backend.speculative_generation:
+        spec_stats = speculation_stats.get_stats()
+        status_text += (
+            f'\n🔮 **Спекулятивные ответы:** {spec_stats["started"]}\n'
+            f'   • Пригодились: {spec_stats["confirmed"]}, отброшено: {spec_stats["discarded"]}\n'
+            f'   • Лишних run\'ов: {spec_stats["wasted_runs"]} (~{spec_stats["wasted_tokens"]} токенов)'
+        )
+    pool_stats = get_pool_stats(http_client)
+    status_text += (
+        f'\n🔌 **Соединения с OpenAI:** {pool_stats["active"]} занято из {pool_stats["connections"]} '
+        f'(лимит {pool_stats["max_connections"]}, загрузка {pool_stats["utilization"]:.0%})\n'
+        f'   • Ждут соединения: {pool_stats["waiting"]}'
     )
+    if assistant_breaker:
+        breaker_stats = assistant_breaker.get_stats()
+        breaker_state = {"closed": "🟢 Замкнут", "open": "🔴 Разомкнут", "half_open": "🟡 Проба"}
+        status_text += (
+            f'\n⚡ **Автомат ассистента:** {breaker_state[breaker_stats["state"]]}\n'
+            f'   • Ошибок в окне: {breaker_stats["failure_rate"]:.0%} из {breaker_stats["calls"]}\n'
+            f'   • Срабатываний: {breaker_stats["opened"]}, отклонено: {breaker_stats["rejected"]}'
+        )
+    if retrieve_hedger and messages_hedger:
+        retrieve_stats = retrieve_hedger.get_stats()
+        messages_stats = messages_hedger.get_stats()
+        status_text += (
+            f'\n🔁 **Дублирование чтений:**\n'
+            f'   • runs.retrieve: {retrieve_stats["hedged"]} из {retrieve_stats["requests"]} '
+            f'(быстрее: {retrieve_stats["hedge_wins"]}, без запаса лимита: {retrieve_stats["suppressed"]})\n'
+            f'   • messages.list: {messages_stats["hedged"]} из {messages_stats["requests"]} '
+            f'(быстрее: {messages_stats["hedge_wins"]}, без запаса лимита: {messages_stats["suppressed"]})'
+        )
+    if semantic_cache:
+        semantic_stats = semantic_cache.get_stats()
+        status_text += (
+            f'\n🧠 **Кэш похожих вопросов:** {semantic_stats["entries"]} вопросов\n'
+            f'   • Попаданий: {semantic_stats["hits"]}\n'
+            f'   • Промахов: {semantic_stats["misses"]}'
+        )
     
     await quick_typing(client, message.chat.id)
     await message.reply(status_text)
@@ -558,22 +887,147 @@ def setup_handlers() -> None:
     
     logger.info("Message handlers setup complete")
 
+def initialize_openai(base_url: Optional[str] = None) -> None:
+    """Initialize the OpenAI client and the services built on it.
+    
+    base_url overrides OPENAI_BASE_URL (the load test points it at the local mock).
+    """
+    global openai_client, http_client, smart_detector, run_tracker, thread_pool, thread_collector, conversation_backend
+    
+    # Initialize OpenAI client
+    logger.info("Initializing OpenAI client...")
+    # Один общий пул соединений с keep-alive вместо настроек по умолчанию
+    http = settings.http
+    http_client = create_http_client(
+        max_connections=http.max_connections,
+        max_keepalive_connections=http.max_keepalive_connections,
+        keepalive_expiry=http.keepalive_expiry,
+        http2=http.http2,
+        connect_timeout=http.connect_timeout,
+        read_timeout=http.read_timeout
+    )
+    openai_client = AsyncOpenAI(
+        api_key=OPENAI_API_KEY,
+        base_url=base_url or settings.openai.base_url or None,
+        default_headers={"OpenAI-Beta": "assistants=v2"},
+        http_client=http_client,
+        timeout=build_timeout(http.connect_timeout, http.read_timeout),
+        # Повторяет запросы только регулятор: повторы SDK держали бы слот и обходили паузу по Retry-After
+        max_retries=0
+    )
+    logger.info("OpenAI client initialized successfully")
+    
+    # Initialize run tracker
+    run_tracker = RunTracker(
+        openai_client,
+        registry=run_registry,
+        governor=governor,
+        hedger=retrieve_hedger,
+        initial_interval=RUN_POLL_INITIAL_INTERVAL,
+        max_interval=RUN_POLL_MAX_INTERVAL
+    )
+    
+    # Initialize conversation backend
+    if CONVERSATION_BACKEND == "chat":
+        conversation_backend = ChatCompletionsBackend(
+            openai_client,
+            HistoryStorage(
+                settings.assistant.chat_history_dir,
+                budget_tokens=settings.assistant.chat_history_tokens,
+                # Без резюме вытесненные из окна сообщения не нужны
+                pending_budget_tokens=(
+                    settings.assistant.chat_history_tokens if settings.assistant.chat_summary_enabled else 0
+                ),
+                max_loaded_users=settings.assistant.chat_history_max_users
+            ),
+            model=settings.assistant.chat_model or None,
+            assistant_id=ASSISTANT_ID,
+            governor=governor,
+            max_tokens=settings.assistant.chat_max_tokens,
+            timeout=RUN_TIMEOUT,
+            summarize=settings.assistant.chat_summary_enabled,
+            summary_max_tokens=settings.assistant.chat_summary_max_tokens
+        )
+    else:
+        # Thread pool нужен только движку Assistants
+        if THREAD_POOL_HIGH > 0:
+            thread_pool = ThreadPool(
+                openai_client,
+                thread_storage,
+                low_watermark=THREAD_POOL_LOW,
+                high_watermark=THREAD_POOL_HIGH,
+                governor=governor
+            )
+            logger.info(f"Thread pool initialized ({thread_storage.pool_size()} threads ready)")
+        thread_collector = ThreadCollector(
+            openai_client,
+            thread_storage,
+            run_registry,
+            ttl=THREAD_TTL_DAYS * 86400,
+            interval=settings.assistant.thread_gc_interval,
+            batch_size=settings.assistant.thread_delete_batch,
+            delete_rate=settings.assistant.thread_delete_rate,
+            governor=governor
+        )
+        conversation_backend = AssistantsBackend(
+            openai_client,
+            ASSISTANT_ID,
+            thread_storage,
+            registry=run_registry,
+            tracker=run_tracker,
+            governor=governor,
+            thread_pool=thread_pool,
+            hedger=messages_hedger,
+            collector=thread_collector,
+            run_timeout=RUN_TIMEOUT,
+            run_tokens_estimate=RUN_TOKENS_ESTIMATE
+        )
+    logger.info(f"Conversation backend: {CONVERSATION_BACKEND}")
+    
+    # Initialize smart detector
+    matcher = None
+    if settings.assistant.detector_local_enabled:
+        matcher = IntentMatcher(
+            ambiguity_low=settings.assistant.detector_ambiguity_low,
+            ambiguity_high=settings.assistant.detector_ambiguity_high
+        )
+    intent_model = None
+    if settings.assistant.detector_model_path:
+        try:
+            intent_model = IntentModel.load(settings.assistant.detector_model_path)
+            logger.info(f"Intent model loaded from {settings.assistant.detector_model_path} ({intent_model.labels})")
+        except Exception as e:
+            logger.error(f"Failed to load intent model: {e}")
+    detection_cache = None
+    if settings.cache.detection_cache_enabled:
+        detection_cache = DetectionCache(
+            max_entries=settings.cache.detection_cache_max_entries,
+            ttl=settings.cache.detection_cache_ttl,
+            # Запасной ответ при ошибке LLM не запоминаем
+            should_cache=lambda result: result.get("source") == "llm"
+        )
+        detection_cache.warm(settings.cache.detection_cache_file)
+    smart_detector = SmartFileDetector(
+        openai_client,
+        governor=governor,
+        matcher=matcher,
+        model=intent_model,
+        model_threshold=settings.assistant.detector_model_threshold,
+        log_path=settings.assistant.detector_log_path or None,
+        cache=detection_cache,
+        batch_size=settings.assistant.detector_batch_size,
+        batch_wait=settings.assistant.detector_batch_wait_ms / 1000,
+        llm_model=settings.assistant.detector_llm_model,
+        reasoning=settings.assistant.detector_reasoning
+    )
+    logger.info("Smart file detector initialized successfully")
+
 def initialize_clients() -> None:
     """Initialize OpenAI and Telegram clients with session management."""
-    global openai_client, app, smart_detector
+    global app
     
     try:
-        # Initialize OpenAI client
-        logger.info("Initializing OpenAI client...")
-        openai_client = AsyncOpenAI(
-            api_key=OPENAI_API_KEY,
-            default_headers={"OpenAI-Beta": "assistants=v2"}
-        )
-        logger.info("OpenAI client initialized successfully")
-        
-        # Initialize smart detector
-        smart_detector = SmartFileDetector(openai_client)
-        logger.info("Smart file detector initialized successfully")
+        initialize_openai()
         
         # Initialize Telegram client
         logger.info("Initializing Telegram client...")
@@ -588,6 +1042,37 @@ def initialize_clients() -> None:
         logger.error(f"Failed to initialize clients: {e}", exc_info=True)
         raise
 
+def start_background_tasks() -> None:
+    """Start background services that need a running event loop."""
+    if thread_pool:
+        thread_pool.ensure_refill()
+    if thread_collector:
+        thread_collector.start()
+    asyncio.create_task(prewarm_connections(
+        http_client,
+        str(openai_client.base_url),
+        settings.http.prewarm_connections
+    ))
+
+async def run_bot() -> None:
+    """Start Telegram client, background services and wait until stopped."""
+    await app.start()
+    start_background_tasks()
+    try:
+        await idle()
+    finally:
+        if thread_collector:
+            await thread_collector.stop()
+        if smart_detector:
+            await smart_detector.flush_log()
+        if smart_detector and smart_detector.cache:
+            try:
+                smart_detector.cache.persist(settings.cache.detection_cache_file)
+            except Exception as e:
+                logger.error(f"Failed to save detection cache: {e}")
+        await app.stop()
+        await openai_client.close()
+
 def main() -> None:
     """Main function to run the bot."""
     print("🤖 Запуск Support Bot v4 с умным ИИ...")
@@ -613,7 +1098,7 @@ def main() -> None:
         print("=" * 60)
         logger.info(f"🚀 {BOT_NAME} с умным ИИ запущен!")
         
-        app.run()
+        app.run(run_bot())
         
     except KeyboardInterrupt:
         print("\n👋 Остановка бота...")
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Спекулятивное выполнение ответа
+Ответ ассистента готовится параллельно с определением типа запроса
+и показывается пользователю, только если он действительно нужен
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class Speculation:
+    """Заранее запущенная задача, результат которой может быть отброшен"""
+
+    def __init__(self, factory: Callable[[asyncio.Event], Awaitable[Any]]):
+        """
+        Запускает задачу
+
+        Args:
+            factory: Создает корутину; та не должна показывать результат,
+                пока не установлено переданное ей событие gate
+        """
+        self.gate = asyncio.Event()
+        self.task = asyncio.ensure_future(factory(self.gate))
+        self.discarded = False
+
+    @property
+    def settled(self) -> bool:
+        """Решение по задаче уже принято (подтверждена или отброшена)"""
+        return self.gate.is_set() or self.discarded
+
+    async def confirm(self) -> Any:
+        """
+        Разрешает задаче показать результат и ждет ее завершения
+
+        Returns:
+            Результат задачи
+        """
+        self.gate.set()
+        return await self.task
+
+    def discard(self) -> None:
+        """Отменяет задачу (повторный вызов ничего не делает)"""
+        if self.settled:
+            return
+        self.discarded = True
+        if self.task.done():
+            if not self.task.cancelled() and self.task.exception() is not None:
+                logger.debug(f"Discarded speculation failed: {self.task.exception()}")
+            return
+        self.task.cancel()
+
+
+class SpeculationStats:
+    """Учет спекулятивных ответов и впустую потраченных run'ов"""
+
+    def __init__(self):
+        """Инициализация счетчиков"""
+        self.started = 0
+        self.confirmed = 0
+        self.discarded = 0
+        self.wasted_runs = 0
+        self.wasted_tokens = 0
+
+    def record_wasted_run(self, tokens: int) -> None:
+        """
+        Учитывает run, запущенный для отброшенного ответа
+
+        Args:
+            tokens: Оценка потраченных токенов
+        """
+        self.wasted_runs += 1
+        self.wasted_tokens += tokens
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Возвращает статистику
+
+        Returns:
+            Dict[str, int]: Статистика
+        """
+        return {
+            "started": self.started,
+            "confirmed": self.confirmed,
+            "discarded": self.discarded,
+            "wasted_runs": self.wasted_runs,
+            "wasted_tokens": self.wasted_tokens
+        }
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Потоковая отправка ответа ассистента в Telegram
+Сообщение-заглушка отправляется сразу (или после разрешения показа)
+и дописывается по мере прихода дельт
+"""
+
+import asyncio
+import re
+import time
+import logging
+from typing import List, Optional
+from pyrogram import Client
+from pyrogram.errors import FloodWait, MessageNotModified
+
+from ai.cleaner import clean_source_marks
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина текста одного сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Незакрытая метка source в конце потока: "【4:1†sou", "[8:14"
+_PARTIAL_MARK_PATTERN = re.compile(r'(【[^】]*|\[\d+(:\d*[a-z.]*)?)$')
+
+
+def _preview_text(text: str) -> str:
+    """Готовит промежуточный текст: чистит метки и обрезает незакрытую метку в конце"""
+    preview = clean_source_marks(_PARTIAL_MARK_PATTERN.sub('', text))
+    return preview.strip()
+
+
+def _split_for_telegram(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Разбивает длинный текст на части по границам строк"""
+    chunks = []
+    while len(text) > limit:
+        split_at = text.rfind('\n', 0, limit)
+        if split_at <= 0:
+            split_at = limit
+        chunks.append(text[:split_at])
+        text = text[split_at:].lstrip('\n')
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+class StreamingReply:
+    """Сообщение Telegram, которое редактируется по мере генерации ответа"""
+
+    def __init__(self,
+                 client: Client,
+                 chat_id: int,
+                 edit_interval: float = 1.0,
+                 placeholder: str = "✍️ Печатаю...",
+                 gate: Optional[asyncio.Event] = None):
+        """
+        Инициализация потокового ответа
+
+        Args:
+            client: Клиент Telegram
+            chat_id: ID чата для ответа
+            edit_interval: Минимальный интервал между редактированиями (сек)
+            placeholder: Текст заглушки до прихода первых токенов
+            gate: Событие, до установки которого ничего не отправляется
+        """
+        self.client = client
+        self.chat_id = chat_id
+        self.edit_interval = edit_interval
+        self.placeholder = placeholder
+        self.gate = gate
+
+        self.created_at = time.monotonic()
+        self.message_id: Optional[int] = None
+        self.started_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self._shown_text = ""
+        self._next_edit_at = 0.0
+        self._start_task: Optional[asyncio.Task] = None
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        """Время от начала ответа до первых токенов (сек)"""
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - (self.started_at or self.created_at)
+
+    def start_when_open(self) -> None:
+        """Отправляет заглушку в фоне, как только будет разрешен показ"""
+        if self._start_task is None:
+            self._start_task = asyncio.ensure_future(self._send_placeholder())
+
+    def cancel(self) -> None:
+        """Отменяет еще не отправленную заглушку"""
+        if self._start_task is not None and not self._start_task.done():
+            self._start_task.cancel()
+
+    async def start(self) -> None:
+        """Отправляет сообщение-заглушку (дожидаясь разрешения показа)"""
+        self.start_when_open()
+        await asyncio.shield(self._start_task)
+
+    async def _send_placeholder(self) -> None:
+        """Ждет разрешения показа и отправляет заглушку"""
+        if self.gate is not None:
+            await self.gate.wait()
+        self.started_at = time.monotonic()
+        message = await self.client.send_message(self.chat_id, self.placeholder)
+        self.message_id = message.id
+        self._shown_text = self.placeholder
+        self._next_edit_at = self.started_at + self.edit_interval
+
+    async def update(self, text: str) -> None:
+        """
+        Обновляет сообщение накопленным текстом с учетом ограничения частоты
+
+        Args:
+            text: Весь накопленный на данный момент текст ответа
+        """
+        if self.first_token_at is None and text:
+            self.first_token_at = time.monotonic()
+            logger.info(f"Time to first token in chat {self.chat_id}: {self.time_to_first_token:.2f}s")
+
+        if self.message_id is None or time.monotonic() < self._next_edit_at:
+            return
+
+        preview = _preview_text(text)
+        if not preview:
+            return
+        # Пока идет генерация, показываем хвост в пределах одного сообщения
+        # (с курсором и многоточием в начале)
+        if len(preview) > TELEGRAM_MESSAGE_LIMIT - 2:
+            preview = "…" + preview[-(TELEGRAM_MESSAGE_LIMIT - 3):]
+        await self._edit(preview + " ▌")
+
+    async def finish(self, text: str) -> None:
+        """
+        Записывает финальный текст ответа
+
+        Args:
+            text: Окончательный (уже очищенный) текст ответа
+        """
+        chunks = _split_for_telegram(text) or ["…"]
+
+        if self.message_id is None:
+            await self.start()
+
+        await self._edit(chunks[0], force=True)
+        for chunk in chunks[1:]:
+            await self.client.send_message(self.chat_id, chunk)
+
+    async def discard(self) -> None:
+        """Убирает заглушку, если ответ текстом не нужен"""
+        self.cancel()
+        if self.message_id is not None:
+            await self.client.delete_messages(self.chat_id, self.message_id)
+            self.message_id = None
+
+    async def _edit(self, text: str, force: bool = False) -> None:
+        """Редактирует сообщение, обрабатывая FloodWait и неизмененный текст"""
+        if text == self._shown_text:
+            return
+
+        while True:
+            try:
+                await self.client.edit_message_text(self.chat_id, self.message_id, text)
+                self._shown_text = text
+                break
+            except MessageNotModified:
+                self._shown_text = text
+                break
+            except FloodWait as e:
+                logger.warning(f"FloodWait {e.value}s while editing message in chat {self.chat_id}")
+                if not force:
+                    # Промежуточные правки просто откладываем
+                    self._next_edit_at = time.monotonic() + e.value
+                    return
+                await asyncio.sleep(e.value)
+
+        self._next_edit_at = time.monotonic() + self.edit_interval
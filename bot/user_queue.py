@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Очереди сообщений пользователей
+Для каждого пользователя выполняется не больше одной задачи одновременно,
+остальные сообщения ждут своей очереди и обрабатываются по порядку
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable[None]]
+
+
+class UserQueueManager:
+    """Менеджер очередей: один обработчик (актор) на активного пользователя"""
+
+    def __init__(self, idle_timeout: float = 30.0, max_pending: int = 20):
+        """
+        Инициализация менеджера
+
+        Args:
+            idle_timeout: Через сколько секунд простоя обработчик пользователя удаляется
+            max_pending: Максимальное количество ожидающих сообщений на пользователя
+        """
+        self.idle_timeout = idle_timeout
+        self.max_pending = max_pending
+
+        # Очереди активных пользователей: user_id -> asyncio.Queue
+        self._queues: Dict[Hashable, asyncio.Queue] = {}
+
+        # Статистика
+        self.processed_count = 0
+        self.dropped_count = 0
+        self.reaped_count = 0
+
+    def submit(self, user_id: Hashable, job: Job) -> bool:
+        """
+        Ставит задачу в очередь пользователя
+
+        Args:
+            user_id: ID пользователя
+            job: Фабрика корутины, обрабатывающей сообщение
+
+        Returns:
+            bool: False если очередь пользователя переполнена и задача отброшена
+        """
+        queue = self._queues.get(user_id)
+        if queue is None:
+            queue = asyncio.Queue(maxsize=self.max_pending)
+            self._queues[user_id] = queue
+            asyncio.create_task(self._worker(user_id, queue))
+
+        try:
+            queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.dropped_count += 1
+            logger.warning(f"Queue for user {user_id} is full ({self.max_pending}), message dropped")
+            return False
+
+        logger.debug(f"Message from user {user_id} queued (pending: {queue.qsize()})")
+        return True
+
+    async def _worker(self, user_id: Hashable, queue: asyncio.Queue) -> None:
+        """Последовательно выполняет задачи пользователя и завершается при простое"""
+        while True:
+            try:
+                job = await asyncio.wait_for(queue.get(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    # Между проверкой и удалением нет await - новых задач появиться не может
+                    if self._queues.get(user_id) is queue:
+                        del self._queues[user_id]
+                    self.reaped_count += 1
+                    return
+                continue
+
+            try:
+                await job()
+            except Exception as e:
+                logger.error(f"Error processing queued message for user {user_id}: {e}")
+            finally:
+                self.processed_count += 1
+                queue.task_done()
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Возвращает статистику очередей
+
+        Returns:
+            Dict[str, int]: Статистика
+        """
+        return {
+            "active_users": len(self._queues),
+            "pending": sum(queue.qsize() for queue in self._queues.values()),
+            "processed": self.processed_count,
+            "dropped": self.dropped_count,
+            "reaped": self.reaped_count
+        }
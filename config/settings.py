@@ -21,18 +21,46 @@ else:
     load_dotenv(override=True)
 
 
+def _env_bool(name: str, default: bool) -> bool:
+    """Читает булеву переменную окружения ("true"/"false")"""
+    return os.getenv(name, "true" if default else "false").lower() == "true"
+
+
+def _env_int(name: str, default: int) -> int:
+    """Читает целочисленную переменную окружения"""
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} должен быть числом, получено: {value}")
+
+
+def _env_float(name: str, default: float) -> float:
+    """Читает вещественную переменную окружения"""
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"{name} должен быть числом, получено: {value}")
+
+
 @dataclass(frozen=True)
 class OpenAISettings:
     """Настройки OpenAI API"""
     api_key: str
     assistant_id: str
+    base_url: str = ""
     
     @classmethod
     def from_env(cls) -> "OpenAISettings":
         """Создает настройки OpenAI из переменных окружения"""
-        # Проверяем наличие .env файла
+        # Проверяем наличие .env файла (не нужен, если переменные уже заданы в окружении)
         env_path = Path(__file__).parent.parent / ".env"
-        if not env_path.exists():
+        if not env_path.exists() and not (os.getenv("OPENAI_API_KEY") and os.getenv("ASSISTANT_ID")):
             raise ValueError(
                 f"❌ Файл .env не найден!\n"
                 f"📁 Ожидаемый путь: {env_path.absolute()}\n"
@@ -44,7 +72,8 @@ class OpenAISettings:
         # load_dotenv может вернуть False, если файл пустой или не содержит переменных,
         # но это не критично - мы проверим переменные отдельно
         try:
-            load_dotenv(dotenv_path=env_path, override=True)
+            if env_path.exists():
+                load_dotenv(dotenv_path=env_path, override=True)
         except Exception as e:
             raise ValueError(
                 f"❌ Ошибка при загрузке файла .env!\n"
@@ -71,7 +100,10 @@ class OpenAISettings:
                 f"🤖 Создайте Assistant на https://platform.openai.com/assistants"
             )
         
-        return cls(api_key=api_key.strip(), assistant_id=assistant_id.strip())
+        # Другой адрес API (например, локальная заглушка loadtest.mock_openai)
+        base_url = os.getenv("OPENAI_BASE_URL", "").strip()
+        
+        return cls(api_key=api_key.strip(), assistant_id=assistant_id.strip(), base_url=base_url)
 
 
 @dataclass(frozen=True)
@@ -109,6 +141,10 @@ class BotSettings:
     bot_state_file: str = "bot_state.json"
     log_level: str = "INFO"
     human_behavior_enabled: bool = True
+    user_queue_idle_timeout: float = 30.0
+    user_queue_max_pending: int = 20
+    coalesce_window: float = 0.5
+    coalesce_max_wait: float = 4.0
     
     @property
     def log_level_int(self) -> int:
@@ -150,6 +186,218 @@ class BotSettings:
             bot_state_file=os.getenv("BOT_STATE_FILE", "bot_state.json"),
             log_level=os.getenv("LOG_LEVEL", "INFO"),
             human_behavior_enabled=os.getenv("HUMAN_BEHAVIOR_ENABLED", "true").lower() == "true",
+            user_queue_idle_timeout=_env_float("USER_QUEUE_IDLE_TIMEOUT", 30.0),
+            user_queue_max_pending=_env_int("USER_QUEUE_MAX_PENDING", 20),
+            coalesce_window=_env_float("COALESCE_WINDOW", 0.5),
+            coalesce_max_wait=_env_float("COALESCE_MAX_WAIT", 4.0),
+        )
+
+
+@dataclass(frozen=True)
+class AssistantSettings:
+    """Настройки выполнения run'ов OpenAI Assistant"""
+    run_timeout: float = 60.0
+    streaming_enabled: bool = True
+    stream_edit_interval: float = 1.0
+    poll_initial_interval: float = 0.15
+    poll_max_interval: float = 2.0
+    thread_pool_low: int = 5
+    thread_pool_high: int = 20
+    thread_ttl_days: float = 30.0
+    thread_gc_interval: float = 3600.0
+    thread_delete_batch: int = 10
+    thread_delete_rate: float = 2.0
+    speculative_enabled: bool = False
+    detection_mode: str = "llm"
+    detector_local_enabled: bool = True
+    detector_ambiguity_low: float = 0.35
+    detector_ambiguity_high: float = 0.75
+    detector_model_path: str = ""
+    detector_model_threshold: float = 0.9
+    detector_log_path: str = ""
+    detector_batch_size: int = 1
+    detector_batch_wait_ms: float = 20.0
+    detector_llm_model: str = "gpt-4o-mini"
+    detector_reasoning: bool = False
+    backend: str = "assistants"
+    chat_model: str = ""
+    chat_history_tokens: int = 3000
+    chat_max_tokens: int = 1000
+    chat_history_dir: str = "history"
+    chat_history_max_users: int = 1000
+    chat_summary_enabled: bool = False
+    chat_summary_max_tokens: int = 300
+    
+    @classmethod
+    def from_env(cls) -> "AssistantSettings":
+        """Создает настройки ассистента из переменных окружения"""
+        # llm - отдельный запрос к детектору, tools - инструменты самого ассистента
+        detection_mode = os.getenv("DETECTION_MODE", "llm").lower()
+        if detection_mode not in ("llm", "tools"):
+            raise ValueError(f"DETECTION_MODE должен быть 'llm' или 'tools', получено: {detection_mode}")
+        
+        # Полоса неопределенности локального детектора: внутри нее решает LLM
+        ambiguity_low = _env_float("DETECTOR_AMBIGUITY_LOW", 0.35)
+        ambiguity_high = _env_float("DETECTOR_AMBIGUITY_HIGH", 0.75)
+        if not 0 <= ambiguity_low <= ambiguity_high <= 1:
+            raise ValueError(
+                f"Нужно 0 <= DETECTOR_AMBIGUITY_LOW <= DETECTOR_AMBIGUITY_HIGH <= 1, "
+                f"получено: {ambiguity_low}, {ambiguity_high}"
+            )
+        
+        # assistants - threads и run'ы OpenAI, chat - Chat Completions с локальной историей
+        backend = os.getenv("CONVERSATION_BACKEND", "assistants").lower()
+        if backend not in ("assistants", "chat"):
+            raise ValueError(f"CONVERSATION_BACKEND должен быть 'assistants' или 'chat', получено: {backend}")
+        
+        return cls(
+            run_timeout=_env_float("ASSISTANT_RUN_TIMEOUT", 60.0),
+            streaming_enabled=_env_bool("ASSISTANT_STREAMING", True),
+            stream_edit_interval=_env_float("STREAM_EDIT_INTERVAL", 1.0),
+            poll_initial_interval=_env_float("RUN_POLL_INITIAL_INTERVAL", 0.15),
+            poll_max_interval=_env_float("RUN_POLL_MAX_INTERVAL", 2.0),
+            thread_pool_low=_env_int("THREAD_POOL_LOW", 5),
+            thread_pool_high=_env_int("THREAD_POOL_HIGH", 20),
+            thread_ttl_days=_env_float("THREAD_TTL_DAYS", 30.0),
+            thread_gc_interval=_env_float("THREAD_GC_INTERVAL", 3600.0),
+            thread_delete_batch=_env_int("THREAD_DELETE_BATCH", 10),
+            thread_delete_rate=_env_float("THREAD_DELETE_RATE", 2.0),
+            speculative_enabled=_env_bool("SPECULATIVE_ASSISTANT", False),
+            detection_mode=detection_mode,
+            detector_local_enabled=_env_bool("DETECTOR_LOCAL", True),
+            detector_ambiguity_low=ambiguity_low,
+            detector_ambiguity_high=ambiguity_high,
+            detector_model_path=os.getenv("DETECTOR_MODEL_PATH", ""),
+            detector_model_threshold=_env_float("DETECTOR_MODEL_THRESHOLD", 0.9),
+            detector_log_path=os.getenv("DETECTOR_LOG_PATH", ""),
+            detector_batch_size=_env_int("DETECTOR_BATCH_SIZE", 1),
+            detector_batch_wait_ms=_env_float("DETECTOR_BATCH_WAIT_MS", 20.0),
+            detector_llm_model=os.getenv("DETECTOR_LLM_MODEL", "gpt-4o-mini"),
+            detector_reasoning=_env_bool("DETECTOR_REASONING", False),
+            backend=backend,
+            chat_model=os.getenv("CHAT_MODEL", ""),
+            chat_history_tokens=_env_int("CHAT_HISTORY_TOKENS", 3000),
+            chat_max_tokens=_env_int("CHAT_MAX_TOKENS", 1000),
+            chat_history_dir=os.getenv("CHAT_HISTORY_DIR", "history"),
+            chat_history_max_users=_env_int("CHAT_HISTORY_MAX_USERS", 1000),
+            chat_summary_enabled=_env_bool("CHAT_SUMMARY_ENABLED", False),
+            chat_summary_max_tokens=_env_int("CHAT_SUMMARY_MAX_TOKENS", 300),
+        )
+
+
+@dataclass(frozen=True)
+class CacheSettings:
+    """Настройки кэширования ответов"""
+    response_cache_enabled: bool = True
+    response_cache_ttl: float = 3600.0
+    response_cache_max_entries: int = 1000
+    response_cache_max_bytes: int = 2 * 1024 * 1024
+    response_cache_version: str = "1"
+    semantic_cache_enabled: bool = False
+    semantic_cache_threshold: float = 0.85
+    semantic_cache_capacity: int = 5000
+    semantic_cache_dim: int = 1024
+    detection_cache_enabled: bool = True
+    detection_cache_max_entries: int = 5000
+    detection_cache_ttl: float = 86400.0
+    detection_cache_file: str = "detection_cache.json"
+    
+    @classmethod
+    def from_env(cls) -> "CacheSettings":
+        """Создает настройки кэширования из переменных окружения"""
+        return cls(
+            response_cache_enabled=_env_bool("RESPONSE_CACHE_ENABLED", True),
+            response_cache_ttl=_env_float("RESPONSE_CACHE_TTL", 3600.0),
+            response_cache_max_entries=_env_int("RESPONSE_CACHE_MAX_ENTRIES", 1000),
+            response_cache_max_bytes=_env_int("RESPONSE_CACHE_MAX_BYTES", 2 * 1024 * 1024),
+            response_cache_version=os.getenv("RESPONSE_CACHE_VERSION", "1"),
+            semantic_cache_enabled=_env_bool("SEMANTIC_CACHE_ENABLED", False),
+            semantic_cache_threshold=_env_float("SEMANTIC_CACHE_THRESHOLD", 0.85),
+            semantic_cache_capacity=_env_int("SEMANTIC_CACHE_CAPACITY", 5000),
+            semantic_cache_dim=_env_int("SEMANTIC_CACHE_DIM", 1024),
+            detection_cache_enabled=_env_bool("DETECTION_CACHE_ENABLED", True),
+            detection_cache_max_entries=_env_int("DETECTION_CACHE_MAX_ENTRIES", 5000),
+            detection_cache_ttl=_env_float("DETECTION_CACHE_TTL", 86400.0),
+            detection_cache_file=os.getenv("DETECTION_CACHE_FILE", "detection_cache.json"),
+        )
+
+
+@dataclass(frozen=True)
+class RateLimitSettings:
+    """Лимиты запросов к OpenAI"""
+    max_concurrency: int = 16
+    requests_per_minute: int = 500
+    tokens_per_minute: int = 200000
+    max_retries: int = 3
+    run_tokens_estimate: int = 2000
+    
+    @classmethod
+    def from_env(cls) -> "RateLimitSettings":
+        """Создает настройки лимитов из переменных окружения"""
+        return cls(
+            max_concurrency=_env_int("OPENAI_MAX_CONCURRENCY", 16),
+            requests_per_minute=_env_int("OPENAI_RPM", 500),
+            tokens_per_minute=_env_int("OPENAI_TPM", 200000),
+            max_retries=_env_int("OPENAI_RATE_LIMIT_RETRIES", 3),
+            run_tokens_estimate=_env_int("RUN_TOKENS_ESTIMATE", 2000),
+        )
+
+
+@dataclass(frozen=True)
+class ResilienceSettings:
+    """Настройки защиты от деградации OpenAI"""
+    breaker_enabled: bool = True
+    breaker_window: float = 60
+    breaker_min_requests: int = 10
+    breaker_failure_rate: float = 0.5
+    breaker_slow_call_seconds: float = 30
+    breaker_slow_call_rate: float = 0.8
+    breaker_open_seconds: float = 30
+    hedge_enabled: bool = True
+    hedge_percentile: float = 0.95
+    hedge_min_delay: float = 0.2
+    hedge_min_samples: int = 20
+    
+    @classmethod
+    def from_env(cls) -> "ResilienceSettings":
+        """Создает настройки защиты из переменных окружения"""
+        return cls(
+            breaker_enabled=_env_bool("BREAKER_ENABLED", True),
+            breaker_window=_env_float("BREAKER_WINDOW", 60),
+            breaker_min_requests=_env_int("BREAKER_MIN_REQUESTS", 10),
+            breaker_failure_rate=_env_float("BREAKER_FAILURE_RATE", 0.5),
+            breaker_slow_call_seconds=_env_float("BREAKER_SLOW_CALL_SECONDS", 30),
+            breaker_slow_call_rate=_env_float("BREAKER_SLOW_CALL_RATE", 0.8),
+            breaker_open_seconds=_env_float("BREAKER_OPEN_SECONDS", 30),
+            hedge_enabled=_env_bool("HEDGE_ENABLED", True),
+            hedge_percentile=_env_float("HEDGE_PERCENTILE", 0.95),
+            hedge_min_delay=_env_float("HEDGE_MIN_DELAY", 0.2),
+            hedge_min_samples=_env_int("HEDGE_MIN_SAMPLES", 20),
+        )
+
+
+@dataclass(frozen=True)
+class HttpSettings:
+    """Настройки HTTP-соединений с OpenAI"""
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30
+    http2: bool = False
+    connect_timeout: float = 5
+    read_timeout: float = 60
+    prewarm_connections: int = 4
+    
+    @classmethod
+    def from_env(cls) -> "HttpSettings":
+        """Создает настройки HTTP из переменных окружения"""
+        return cls(
+            max_connections=_env_int("OPENAI_MAX_CONNECTIONS", 100),
+            max_keepalive_connections=_env_int("OPENAI_MAX_KEEPALIVE", 20),
+            keepalive_expiry=_env_float("OPENAI_KEEPALIVE_EXPIRY", 30),
+            http2=_env_bool("OPENAI_HTTP2", False),
+            connect_timeout=_env_float("OPENAI_CONNECT_TIMEOUT", 5),
+            read_timeout=_env_float("OPENAI_READ_TIMEOUT", 60),
+            prewarm_connections=_env_int("OPENAI_PREWARM_CONNECTIONS", 4),
         )
 
 
@@ -159,6 +407,11 @@ class Settings:
     openai: OpenAISettings
     telegram: TelegramSettings
     bot: BotSettings
+    assistant: AssistantSettings
+    cache: CacheSettings
+    rate_limit: RateLimitSettings
+    resilience: ResilienceSettings
+    http: HttpSettings
     
     @classmethod
     def from_env(cls) -> "Settings":
@@ -167,6 +420,11 @@ class Settings:
             openai=OpenAISettings.from_env(),
             telegram=TelegramSettings.from_env(),
             bot=BotSettings.from_env(),
+            assistant=AssistantSettings.from_env(),
+            cache=CacheSettings.from_env(),
+            rate_limit=RateLimitSettings.from_env(),
+            resilience=ResilienceSettings.from_env(),
+            http=HttpSettings.from_env(),
         )
     
     def validate(self) -> None:
@@ -0,0 +1,3 @@
+"""
+Инструменты нагрузочного тестирования без обращения к OpenAI и Telegram
+"""
@@ -0,0 +1,454 @@
+# -*- coding: utf-8 -*-
+"""
+Сквозной нагрузочный тест бота
+Генерирует синтетические сообщения Telegram (личные и групповые, упоминания,
+команды, серии и дубликаты) и передает их настоящим обработчикам
+handle_private_message / handle_group_message с заданной интенсивностью.
+Вместо Telegram - фиктивный клиент, записывающий отправленные сообщения,
+вместо OpenAI - локальная заглушка loadtest.mock_openai.
+
+Отчет: пропускная способность, задержка до первого ответа и до завершения
+обработки (p50/p95/p99), потерянные сообщения и задержка event loop.
+
+Запуск:
+    python -m loadtest.load_generator --users 200 --rate 20 --duration 60
+"""
+
+import argparse
+import asyncio
+import bisect
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+from loadtest.mock_openai import Latency, MockConfig, MockOpenAIServer
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+GENERAL_QUESTIONS = [
+    "Сколько стоит хранение одной паллеты в месяц?",
+    "Вы работаете с Wildberries?",
+    "Какие сроки приемки товара?",
+    "Можно ли сделать маркировку честный знак?",
+    "Сколько стоит упаковка одной единицы товара?",
+    "Есть ли у вас доставка до склада Ozon?",
+    "Как заключить договор?",
+    "Какие документы нужны для поставки?",
+]
+FILE_QUESTIONS = [
+    "Пришлите, пожалуйста, файл ТЗ",
+    "Где находится ваш склад?",
+    "Как добраться до склада в Казани?",
+    "Нужен бланк технического задания",
+]
+COMMANDS = ["/start", "/help", "/clear", "/status"]
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Перцентиль отсортированного списка (0, если он пуст)"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class FakeClient:
+    """Фиктивный клиент Pyrogram: записывает исходящие действия и время"""
+
+    def __init__(self):
+        self.events: List[Tuple[float, int, str]] = []
+        self._message_ids = itertools.count(1)
+
+    def _record(self, chat_id: int, method: str) -> SimpleNamespace:
+        """Запоминает действие и возвращает отправленное сообщение"""
+        self.events.append((time.monotonic(), chat_id, method))
+        return SimpleNamespace(id=next(self._message_ids), chat=SimpleNamespace(id=chat_id))
+
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> SimpleNamespace:
+        return self._record(chat_id, "send_message")
+
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str, **kwargs) -> SimpleNamespace:
+        return self._record(chat_id, "edit_message_text")
+
+    async def delete_messages(self, chat_id: int, message_ids: Any, **kwargs) -> None:
+        self._record(chat_id, "delete_messages")
+
+    async def send_chat_action(self, chat_id: int, action: Any, **kwargs) -> None:
+        # Индикатор набора - не ответ, в задержку до первого ответа не входит
+        self.events.append((time.monotonic(), chat_id, "send_chat_action"))
+
+    async def send_media_group(self, chat_id: int, media: Any, **kwargs) -> List[SimpleNamespace]:
+        return [self._record(chat_id, "send_media_group")]
+
+    async def send_document(self, chat_id: int, document: Any, **kwargs) -> SimpleNamespace:
+        return self._record(chat_id, "send_document")
+
+    async def send_photo(self, chat_id: int, photo: Any, **kwargs) -> SimpleNamespace:
+        return self._record(chat_id, "send_photo")
+
+    async def send_video(self, chat_id: int, video: Any, **kwargs) -> SimpleNamespace:
+        return self._record(chat_id, "send_video")
+
+    def replies(self) -> Dict[int, List[float]]:
+        """Время ответов (без индикаторов набора) по чатам"""
+        result: Dict[int, List[float]] = {}
+        for at, chat_id, method in self.events:
+            if method != "send_chat_action":
+                result.setdefault(chat_id, []).append(at)
+        return result
+
+    def method_counts(self) -> Dict[str, int]:
+        """Количество вызовов по методам"""
+        counts: Dict[str, int] = {}
+        for _, _, method in self.events:
+            counts[method] = counts.get(method, 0) + 1
+        return counts
+
+
+class FakeMessage(SimpleNamespace):
+    """Входящее сообщение с нужными обработчикам полями Message"""
+
+    async def reply(self, text: str, **kwargs) -> SimpleNamespace:
+        return await self._client.send_message(self.chat.id, text)
+
+
+@dataclass
+class Arrival:
+    """Отправленное боту сообщение"""
+    key: Tuple[int, int]
+    kind: str
+    sent_at: float
+    accepted: bool = False
+    done_at: Optional[float] = None
+
+
+@dataclass
+class LoadProfile:
+    """Состав нагрузки"""
+    users: int = 100
+    rate: float = 10.0
+    duration: float = 30.0
+    group_share: float = 0.2
+    command_share: float = 0.03
+    file_share: float = 0.15
+    duplicate_share: float = 0.05
+    burst_share: float = 0.1
+    seed: int = 42
+
+
+@dataclass
+class LoadStats:
+    """Результаты прогона"""
+    arrivals: List[Arrival] = field(default_factory=list)
+    loop_lags: List[float] = field(default_factory=list)
+
+
+class LoadGenerator:
+    """Подает синтетические сообщения в обработчики бота и собирает метрики"""
+
+    def __init__(self, bot: Any, client: FakeClient, profile: LoadProfile, bot_name: str):
+        """
+        Args:
+            bot: Модуль bot.main (уже инициализированный)
+            client: Фиктивный клиент Telegram
+            profile: Состав нагрузки
+            bot_name: Имя бота для упоминаний в группах
+        """
+        self.bot = bot
+        self.client = client
+        self.profile = profile
+        self.bot_name = bot_name
+        self.rng = random.Random(profile.seed)
+        self.stats = LoadStats()
+        self._pending: Dict[Tuple[int, int], List[Arrival]] = {}
+        self._message_ids = itertools.count(1)
+        self._last_text: Dict[int, str] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def install(self) -> None:
+        """Оборачивает process_user_request, чтобы отмечать завершение обработки"""
+        original = self.bot.process_user_request
+
+        async def tracked(client, message, text: str, source: str) -> None:
+            started = time.monotonic()
+            try:
+                await original(client, message, text, source)
+            finally:
+                self._complete((message.chat.id, message.from_user.id), started)
+
+        self.bot.process_user_request = tracked
+
+    def _complete(self, key: Tuple[int, int], started: float) -> None:
+        """Отмечает обработанными сообщения, пришедшие до начала обработки"""
+        now = time.monotonic()
+        pending = self._pending.get(key, [])
+        while pending and pending[0].sent_at <= started:
+            pending.pop(0).done_at = now
+
+    def _make_message(self, user_id: int, group: bool, text: str) -> FakeMessage:
+        """Создает входящее сообщение"""
+        if group:
+            chat = SimpleNamespace(id=-1000000 - user_id % 50, type="supergroup", username=None, title=f"Группа {user_id % 50}")
+            text = f"@{self.bot_name} {text}"
+        else:
+            chat = SimpleNamespace(id=user_id, type="private", username=f"user{user_id}", title=None)
+        return FakeMessage(
+            _client=self.client,
+            id=next(self._message_ids),
+            chat=chat,
+            from_user=SimpleNamespace(id=user_id, username=f"user{user_id}", is_bot=False),
+            text=text,
+            caption=None,
+            mentioned=group,
+            date=time.time()
+        )
+
+    def _pick_text(self, user_id: int) -> Tuple[str, str]:
+        """Текст и тип следующего сообщения пользователя"""
+        roll = self.rng.random()
+        profile = self.profile
+        if roll < profile.duplicate_share and user_id in self._last_text:
+            return self._last_text[user_id], "duplicate"
+        roll -= profile.duplicate_share
+        if roll < profile.command_share:
+            return self.rng.choice(COMMANDS), "command"
+        roll -= profile.command_share
+        if roll < profile.file_share:
+            return self.rng.choice(FILE_QUESTIONS), "file"
+        return f"{self.rng.choice(GENERAL_QUESTIONS)} (#{self.rng.randint(1, 10 ** 6)})", "general"
+
+    async def _deliver(self, user_id: int, group: bool, text: str, kind: str) -> None:
+        """Передает сообщение обработчику, как это сделал бы Pyrogram"""
+        message = self._make_message(user_id, group, text)
+        arrival = Arrival(key=(message.chat.id, user_id), kind=kind, sent_at=time.monotonic())
+        self.stats.arrivals.append(arrival)
+        self._last_text[user_id] = text
+
+        # Обработчик сам решает, принять ли сообщение: принятое попадает в склейку
+        before = self.bot.message_coalescer.messages_count
+        handler = self.bot.handle_group_message if group else self.bot.handle_private_message
+        await handler(self.client, message)
+        arrival.accepted = self.bot.message_coalescer.messages_count > before
+        if arrival.accepted:
+            self._pending.setdefault(arrival.key, []).append(arrival)
+
+    async def _user_event(self, user_id: int) -> None:
+        """Одно событие пользователя: сообщение или серия сообщений"""
+        group = self.rng.random() < self.profile.group_share
+        text, kind = self._pick_text(user_id)
+        await self._deliver(user_id, group, text, kind)
+        if kind == "general" and self.rng.random() < self.profile.burst_share:
+            # Серия: пользователь дописывает вопрос несколькими сообщениями
+            for _ in range(self.rng.randint(1, 3)):
+                await asyncio.sleep(self.rng.uniform(0.2, 1.0))
+                await self._deliver(user_id, group, self.rng.choice(GENERAL_QUESTIONS), "burst")
+
+    async def _monitor_loop(self, stop: asyncio.Event, interval: float = 0.05) -> None:
+        """Измеряет задержку event loop: насколько позже срабатывает sleep"""
+        while not stop.is_set():
+            expected = time.monotonic() + interval
+            await asyncio.sleep(interval)
+            self.stats.loop_lags.append(max(time.monotonic() - expected, 0.0))
+
+    async def run(self, drain_timeout: float) -> float:
+        """
+        Подает нагрузку (пуассоновский поток) и ждет обработки
+
+        Args:
+            drain_timeout: Сколько ждать обработки после окончания подачи (сек)
+
+        Returns:
+            float: Длительность прогона (сек)
+        """
+        stop = asyncio.Event()
+        monitor = asyncio.create_task(self._monitor_loop(stop))
+        started = time.monotonic()
+        deadline = started + self.profile.duration
+
+        next_at = started
+        while True:
+            next_at += self.rng.expovariate(self.profile.rate)
+            if next_at >= deadline:
+                break
+            await asyncio.sleep(max(next_at - time.monotonic(), 0))
+            user_id = 100000 + self.rng.randrange(self.profile.users)
+            self._tasks.append(asyncio.create_task(self._user_event(user_id)))
+
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        drain_deadline = time.monotonic() + drain_timeout
+        while any(self._pending.values()) and time.monotonic() < drain_deadline:
+            await asyncio.sleep(0.1)
+
+        stop.set()
+        await monitor
+        return time.monotonic() - started
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        """Сводка прогона"""
+        arrivals = self.stats.arrivals
+        accepted = [arrival for arrival in arrivals if arrival.accepted]
+        done = [arrival for arrival in accepted if arrival.done_at is not None]
+        replies = self.client.replies()
+
+        completion = sorted(arrival.done_at - arrival.sent_at for arrival in done)
+        first_reply = []
+        for arrival in done:
+            chat_replies = replies.get(arrival.key[0], [])
+            index = bisect.bisect_left(chat_replies, arrival.sent_at)
+            if index < len(chat_replies) and chat_replies[index] <= arrival.done_at:
+                first_reply.append(chat_replies[index] - arrival.sent_at)
+        first_reply.sort()
+        lags = sorted(self.stats.loop_lags)
+
+        kinds: Dict[str, int] = {}
+        for arrival in arrivals:
+            kinds[arrival.kind] = kinds.get(arrival.kind, 0) + 1
+
+        return {
+            "elapsed_s": elapsed,
+            "messages": len(arrivals),
+            "kinds": kinds,
+            "accepted": len(accepted),
+            "filtered": len(arrivals) - len(accepted),
+            "completed": len(done),
+            "dropped": len(accepted) - len(done),
+            "throughput_per_s": len(done) / elapsed if elapsed else 0.0,
+            "completion_ms": {name: percentile(completion, q) * 1000 for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+            "first_reply_ms": {name: percentile(first_reply, q) * 1000 for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+            "loop_lag_ms": {
+                "p50": percentile(lags, 0.5) * 1000,
+                "p99": percentile(lags, 0.99) * 1000,
+                "max": (lags[-1] if lags else 0.0) * 1000
+            },
+            "client_calls": self.client.method_counts(),
+            "queues": self.bot.user_queues.get_stats(),
+            "coalescer": self.bot.message_coalescer.get_stats(),
+            "governor": {key: value for key, value in self.bot.governor.get_stats().items() if key != "lanes"}
+        }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    """Печатает сводку в читаемом виде"""
+    completion, first_reply, lag = report["completion_ms"], report["first_reply_ms"], report["loop_lag_ms"]
+    print(f"Сообщений: {report['messages']} {report['kinds']}")
+    print(f"Принято: {report['accepted']}, отфильтровано: {report['filtered']}, "
+          f"обработано: {report['completed']}, потеряно: {report['dropped']}")
+    print(f"Пропускная способность: {report['throughput_per_s']:.2f} сообщ./с за {report['elapsed_s']:.1f} с")
+    print(f"До первого ответа:  p50 {first_reply['p50']:.0f} мс, p95 {first_reply['p95']:.0f} мс, p99 {first_reply['p99']:.0f} мс")
+    print(f"До конца обработки: p50 {completion['p50']:.0f} мс, p95 {completion['p95']:.0f} мс, p99 {completion['p99']:.0f} мс")
+    print(f"Задержка event loop: p50 {lag['p50']:.1f} мс, p99 {lag['p99']:.1f} мс, max {lag['max']:.1f} мс")
+    print(f"Вызовы клиента: {report['client_calls']}")
+    print(f"Очереди: {report['queues']}")
+    print(f"Регулятор OpenAI: {report['governor']}")
+
+
+async def run_load(args: argparse.Namespace) -> Dict[str, Any]:
+    """Поднимает заглушку OpenAI, инициализирует бота и подает нагрузку"""
+    mock = None
+    base_url = args.base_url
+    if not base_url:
+        mock = MockOpenAIServer(MockConfig(
+            seed=args.seed,
+            latency=Latency.parse(args.latency),
+            run_duration=Latency.parse(args.run_duration),
+            token_interval=args.token_interval,
+            error_429=args.error_429,
+            error_500=args.error_500,
+            error_timeout=args.error_timeout
+        ))
+        base_url = await mock.start()
+
+    # Импорт после подготовки окружения: bot.main читает настройки при импорте
+    import bot.main as bot
+    from files.manager import FileManager
+
+    logging.getLogger().setLevel(args.log_level)
+    # Файлы ТЗ и фото склада берутся из проекта, состояние бота - из рабочей директории
+    bot.file_manager = FileManager(str(PROJECT_ROOT))
+    bot.initialize_openai(base_url=base_url)
+    bot.start_background_tasks()
+
+    client = FakeClient()
+    profile = LoadProfile(
+        users=args.users,
+        rate=args.rate,
+        duration=args.duration,
+        group_share=args.group_share,
+        command_share=args.command_share,
+        file_share=args.file_share,
+        duplicate_share=args.duplicate_share,
+        burst_share=args.burst_share,
+        seed=args.seed
+    )
+    generator = LoadGenerator(bot, client, profile, bot.BOT_NAME)
+    generator.install()
+    try:
+        elapsed = await generator.run(args.drain_timeout)
+        report = generator.report(elapsed)
+        if mock:
+            report["mock"] = mock.get_stats()
+    finally:
+        await bot.openai_client.close()
+        if mock:
+            await mock.stop()
+    return report
+
+
+def main() -> None:
+    """Точка входа нагрузочного теста"""
+    parser = argparse.ArgumentParser(description="Сквозной нагрузочный тест бота")
+    parser.add_argument("--users", type=int, default=100, help="Число пользователей")
+    parser.add_argument("--rate", type=float, default=10.0, help="Сообщений в секунду (среднее)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Длительность подачи нагрузки (сек)")
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="Сколько ждать обработки после подачи (сек)")
+    parser.add_argument("--group-share", type=float, default=0.2, help="Доля сообщений из групп")
+    parser.add_argument("--command-share", type=float, default=0.03, help="Доля команд")
+    parser.add_argument("--file-share", type=float, default=0.15, help="Доля запросов ТЗ и склада")
+    parser.add_argument("--duplicate-share", type=float, default=0.05, help="Доля повторов предыдущего сообщения")
+    parser.add_argument("--burst-share", type=float, default=0.1, help="Доля вопросов, дописанных серией сообщений")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--base-url", default="", help="Адрес внешнего API вместо встроенной заглушки")
+    parser.add_argument("--latency", default="lognormal:0.08:0.4", help="Задержка заглушки: kind:median[:spread]")
+    parser.add_argument("--run-duration", default="lognormal:1.5:0.4", help="Длительность run'а в заглушке")
+    parser.add_argument("--token-interval", type=float, default=0.02)
+    parser.add_argument("--error-429", type=float, default=0.0)
+    parser.add_argument("--error-500", type=float, default=0.0)
+    parser.add_argument("--error-timeout", type=float, default=0.0)
+    parser.add_argument("--workdir", default="", help="Директория для threads, состояния и логов (по умолчанию временная)")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", default="", help="Сохранить отчет в JSON-файл")
+    args = parser.parse_args()
+
+    json_path = Path(args.json).resolve() if args.json else None
+    # Бот пишет threads, состояние и лог по относительным путям - уводим их из проекта
+    workdir = args.workdir or tempfile.mkdtemp(prefix="loadtest_")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    if str(PROJECT_ROOT) not in sys.path:
+        sys.path.insert(0, str(PROJECT_ROOT))
+    # Учетные данные не нужны: OpenAI заменен заглушкой, Telegram - фиктивным клиентом
+    os.environ.setdefault("OPENAI_API_KEY", "loadtest")
+    os.environ.setdefault("ASSISTANT_ID", "asst_loadtest")
+    os.environ.setdefault("TELEGRAM_API_ID", "1")
+    os.environ.setdefault("TELEGRAM_API_HASH", "loadtest")
+
+    report = asyncio.run(run_load(args))
+    print_report(report)
+    print(f"Рабочая директория: {workdir}")
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
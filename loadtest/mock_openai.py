@@ -0,0 +1,715 @@
+# -*- coding: utf-8 -*-
+"""
+Локальная замена OpenAI API для нагрузочного тестирования
+Реализует эндпоинты, которые использует бот: threads, messages, runs
+(включая потоковые), assistants и chat completions. Задержки берутся из
+настраиваемых распределений, ошибки 429/500 и зависания внедряются
+с заданной вероятностью, ответы детерминированы (seed).
+
+Запуск:
+    python -m loadtest.mock_openai --port 8080 --latency lognormal:0.15:0.5 --error-429 0.02
+
+Бот подключается через OPENAI_BASE_URL=http://127.0.0.1:8080/v1
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+TZ_KEYWORDS = ("тз", "техническое задание", "бланк", "форма")
+WAREHOUSE_KEYWORDS = ("склад", "адрес", "добраться", "проезд")
+
+STATUS_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests", 500: "Internal Server Error"}
+
+
+@dataclass(frozen=True)
+class Latency:
+    """Распределение задержки: fixed, uniform или lognormal с медианой median (сек)"""
+    kind: str = "fixed"
+    median: float = 0.0
+    spread: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "Latency":
+        """Разбирает запись вида kind:median[:spread], например lognormal:0.2:0.5"""
+        parts = spec.split(":")
+        if parts[0] not in ("fixed", "uniform", "lognormal") or len(parts) not in (2, 3):
+            raise ValueError(f"Неверное распределение задержки: {spec}")
+        return cls(parts[0], float(parts[1]), float(parts[2]) if len(parts) == 3 else 0.0)
+
+    def sample(self, rng: random.Random) -> float:
+        """Случайная задержка (сек)"""
+        if self.kind == "uniform":
+            return max(rng.uniform(self.median * (1 - self.spread), self.median * (1 + self.spread)), 0.0)
+        if self.kind == "lognormal" and self.median > 0:
+            return self.median * math.exp(rng.gauss(0, self.spread))
+        return self.median
+
+
+@dataclass
+class MockConfig:
+    """Настройки заглушки"""
+    seed: int = 42
+    latency: Latency = field(default_factory=lambda: Latency("fixed", 0.05))
+    run_duration: Latency = field(default_factory=lambda: Latency("lognormal", 1.5, 0.4))
+    token_interval: float = 0.02
+    error_429: float = 0.0
+    error_500: float = 0.0
+    error_timeout: float = 0.0
+    timeout_hang: float = 120.0
+    retry_after: float = 1.0
+    model: str = "gpt-4o-mini"
+    instructions: str = "Ты вежливый менеджер поддержки фулфилмент-компании."
+
+
+def classify(text: str) -> str:
+    """Тип запроса по ключевым словам (то же, что ответил бы детектор)"""
+    text_lower = text.lower()
+    if any(re.search(rf"\b{re.escape(keyword)}\b", text_lower) for keyword in TZ_KEYWORDS):
+        return "TZ_FILE"
+    if any(keyword in text_lower for keyword in WAREHOUSE_KEYWORDS):
+        return "WAREHOUSE_IMAGES"
+    return "GENERAL_CHAT"
+
+
+def canned_reply(question: str) -> str:
+    """Детерминированный ответ на вопрос"""
+    short = " ".join(question.split())[:60]
+    return (
+        f"Спасибо за вопрос «{short}»! Мы работаем с Ozon, Wildberries и Яндекс Маркетом, "
+        f"принимаем товар на склад, маркируем и отгружаем в срок. Напишите объем партии, "
+        f"и я посчитаю стоимость."
+    )
+
+
+def tool_for(text: str, tools: List[Dict[str, Any]]) -> Optional[str]:
+    """Инструмент, который вызвал бы ассистент, или None"""
+    names = {tool.get("function", {}).get("name") for tool in tools if tool.get("type") == "function"}
+    request_type = classify(text)
+    if request_type == "TZ_FILE" and "send_tz_file" in names:
+        return "send_tz_file"
+    if request_type == "WAREHOUSE_IMAGES" and "send_warehouse_media" in names:
+        return "send_warehouse_media"
+    return None
+
+
+class MockError(Exception):
+    """Ответ с кодом ошибки"""
+
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class MockOpenAIServer:
+    """HTTP-сервер, имитирующий OpenAI API"""
+
+    def __init__(self, config: Optional[MockConfig] = None):
+        """
+        Инициализация заглушки
+
+        Args:
+            config: Настройки задержек, ошибок и ответов
+        """
+        self.config = config or MockConfig()
+        self.rng = random.Random(self.config.seed)
+        self.threads: Dict[str, Dict[str, Any]] = {}
+        self.runs: Dict[str, Dict[str, Any]] = {}
+        self._ids: Dict[str, int] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+        # Статистика
+        self.requests: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {"429": 0, "500": 0, "timeout": 0}
+        self.connections = 0
+        self.stream_disconnects = 0
+
+    def _new_id(self, prefix: str) -> str:
+        """Детерминированный ID объекта"""
+        self._ids[prefix] = self._ids.get(prefix, 0) + 1
+        return f"{prefix}_{self._ids[prefix]:08d}"
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Запускает сервер
+
+        Args:
+            host: Адрес
+            port: Порт (0 - любой свободный)
+
+        Returns:
+            Адрес API для AsyncOpenAI(base_url=...)
+        """
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        port = self._server.sockets[0].getsockname()[1]
+        base_url = f"http://{host}:{port}/v1"
+        logger.info(f"Mock OpenAI listening on {base_url}")
+        return base_url
+
+    async def stop(self) -> None:
+        """Останавливает сервер"""
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику заглушки
+
+        Returns:
+            Dict[str, Any]: Запросы по эндпоинтам, внедренные ошибки, соединения
+        """
+        return {
+            "requests": dict(self.requests),
+            "total_requests": sum(self.requests.values()),
+            "errors": dict(self.errors),
+            "connections": self.connections,
+            "stream_disconnects": self.stream_disconnects,
+            "threads": len(self.threads),
+            "runs": len(self.runs)
+        }
+
+    # --- HTTP ---
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Обрабатывает запросы одного keep-alive соединения"""
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                body = await reader.readexactly(length) if length else b""
+
+                keep_open = await self._handle_request(method, target, body, writer)
+                if not keep_open or headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # Сервер остановлен посреди запроса - это не ошибка заглушки
+            pass
+        finally:
+            writer.close()
+
+    def _write_head(self, writer: asyncio.StreamWriter, status: int, headers: Dict[str, str]) -> None:
+        """Пишет строку статуса и заголовки"""
+        lines = [f"HTTP/1.1 {status} {STATUS_REASONS.get(status, 'Error')}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, payload: Any,
+                         headers: Optional[Dict[str, str]] = None) -> None:
+        """Отправляет JSON-ответ"""
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self._write_head(writer, status, {
+            "Content-Type": "application/json",
+            "Content-Length": str(len(data)),
+            **(headers or {})
+        })
+        writer.write(data)
+        await writer.drain()
+
+    async def _handle_request(self, method: str, target: str, body: bytes, writer: asyncio.StreamWriter) -> bool:
+        """
+        Обрабатывает один запрос
+
+        Returns:
+            bool: Можно ли читать следующий запрос из соединения
+        """
+        url = urlsplit(target)
+        path = url.path[3:] if url.path.startswith("/v1") else url.path
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        if method == "HEAD":
+            self._write_head(writer, 200, {"Content-Length": "0"})
+            await writer.drain()
+            return True
+        if path == "/stats":
+            await self._send_json(writer, 200, self.get_stats())
+            return True
+
+        route = re.sub(r"/(thread|run|msg|step|asst)_[^/]+", r"/{\1}", path)
+        key = f"{method} {route}"
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+        # Внедрение ошибок
+        roll = self.rng.random()
+        if roll < self.config.error_timeout:
+            self.errors["timeout"] += 1
+            await asyncio.sleep(self.config.timeout_hang)
+            return False
+        await asyncio.sleep(self.config.latency.sample(self.rng))
+        roll -= self.config.error_timeout
+        if roll < self.config.error_429:
+            self.errors["429"] += 1
+            await self._send_json(writer, 429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                                  {"Retry-After": str(self.config.retry_after)})
+            return True
+        roll -= self.config.error_429
+        if roll < self.config.error_500:
+            self.errors["500"] += 1
+            await self._send_json(writer, 500, {"error": {"message": "Internal error", "type": "server_error"}})
+            return True
+
+        try:
+            payload = json.loads(body) if body else {}
+            result = await self._route(method, path, query, payload, writer)
+        except MockError as e:
+            await self._send_json(writer, e.status, {"error": {"message": e.message}}, e.headers)
+            return True
+        if result is not None:
+            await self._send_json(writer, 200, result)
+        return True
+
+    async def _route(self, method: str, path: str, query: Dict[str, str], payload: Dict[str, Any],
+                     writer: asyncio.StreamWriter) -> Optional[Dict[str, Any]]:
+        """Выбирает обработчик по пути; None - ответ уже отправлен потоком"""
+        parts = [part for part in path.split("/") if part]
+
+        if parts == ["chat", "completions"] and method == "POST":
+            return await self._chat_completion(payload, writer)
+        if len(parts) == 2 and parts[0] == "assistants" and method == "GET":
+            return self._assistant(parts[1])
+        if parts == ["threads"] and method == "POST":
+            return self._create_thread()
+        if len(parts) >= 2 and parts[0] == "threads":
+            thread = self._get_thread(parts[1])
+            rest = parts[2:]
+            if not rest and method == "DELETE":
+                del self.threads[thread["id"]]
+                return {"id": thread["id"], "object": "thread.deleted", "deleted": True}
+            if rest == ["messages"] and method == "POST":
+                return self._add_message(thread, "user", payload.get("content", ""))
+            if rest == ["messages"] and method == "GET":
+                return self._list_messages(thread, query)
+            if len(rest) == 2 and rest[0] == "messages" and method == "GET":
+                return self._find(thread["messages"], rest[1])
+            if rest == ["runs"] and method == "POST":
+                return await self._create_run(thread, payload, writer)
+            if rest == ["runs"] and method == "GET":
+                runs = [self.runs[run_id] for run_id in reversed(thread["runs"])]
+                for run in runs:
+                    self._advance(run)
+                return self._page(runs[:int(query.get("limit", 20))])
+            if len(rest) >= 2 and rest[0] == "runs":
+                run = self._get_run(thread, rest[1])
+                if len(rest) == 2 and method == "GET":
+                    self._advance(run)
+                    return run
+                if rest[2:] == ["cancel"] and method == "POST":
+                    self._advance(run)
+                    if run["status"] in ("queued", "in_progress", "requires_action"):
+                        run["status"] = "cancelled"
+                    return run
+                if rest[2:] == ["submit_tool_outputs"] and method == "POST":
+                    return await self._submit_tool_outputs(thread, run, payload, writer)
+                if rest[2:] == ["steps"] and method == "GET":
+                    return self._page([])
+        raise MockError(404, f"Unknown route: {method} {path}")
+
+    # --- Объекты ---
+
+    def _page(self, data: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Страница списка"""
+        return {
+            "object": "list",
+            "data": data,
+            "first_id": data[0]["id"] if data else None,
+            "last_id": data[-1]["id"] if data else None,
+            "has_more": False
+        }
+
+    def _find(self, items: List[Dict[str, Any]], item_id: str) -> Dict[str, Any]:
+        """Объект списка по ID"""
+        for item in items:
+            if item["id"] == item_id:
+                return item
+        raise MockError(404, f"No such object: {item_id}")
+
+    def _assistant(self, assistant_id: str) -> Dict[str, Any]:
+        """Описание ассистента"""
+        return {
+            "id": assistant_id,
+            "object": "assistant",
+            "created_at": 0,
+            "name": "Mock assistant",
+            "model": self.config.model,
+            "instructions": self.config.instructions,
+            "tools": [{"type": "file_search"}],
+            "metadata": {}
+        }
+
+    def _create_thread(self) -> Dict[str, Any]:
+        """Создает thread"""
+        thread = {"id": self._new_id("thread"), "object": "thread", "created_at": int(time.time()), "metadata": {}}
+        self.threads[thread["id"]] = {**thread, "messages": [], "runs": []}
+        return thread
+
+    def _get_thread(self, thread_id: str) -> Dict[str, Any]:
+        """Thread по ID"""
+        thread = self.threads.get(thread_id)
+        if thread is None:
+            raise MockError(404, f"No thread found with id '{thread_id}'.")
+        return thread
+
+    def _get_run(self, thread: Dict[str, Any], run_id: str) -> Dict[str, Any]:
+        """Run по ID"""
+        run = self.runs.get(run_id)
+        if run is None or run["thread_id"] != thread["id"]:
+            raise MockError(404, f"No run found with id '{run_id}'.")
+        return run
+
+    def _message(self, thread: Dict[str, Any], role: str, text: str, run_id: Optional[str] = None) -> Dict[str, Any]:
+        """Объект сообщения (не добавляется в thread)"""
+        return {
+            "id": self._new_id("msg"),
+            "object": "thread.message",
+            "created_at": int(time.time()),
+            "thread_id": thread["id"],
+            "role": role,
+            "status": "completed",
+            "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+            "run_id": run_id,
+            "assistant_id": None,
+            "attachments": [],
+            "metadata": {}
+        }
+
+    def _add_message(self, thread: Dict[str, Any], role: str, content: Any, run_id: Optional[str] = None) -> Dict[str, Any]:
+        """Добавляет сообщение в thread"""
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        if role == "user" and thread["runs"]:
+            last_run = self._advance(self.runs[thread["runs"][-1]])
+            if last_run["status"] in ("queued", "in_progress", "requires_action"):
+                raise MockError(400, f"Can't add messages to {thread['id']} while a run is active.")
+        message = self._message(thread, role, content, run_id)
+        thread["messages"].append(message)
+        return message
+
+    def _list_messages(self, thread: Dict[str, Any], query: Dict[str, str]) -> Dict[str, Any]:
+        """Список сообщений thread'а"""
+        messages = thread["messages"]
+        if query.get("run_id"):
+            messages = [message for message in messages if message["run_id"] == query["run_id"]]
+        if query.get("order", "desc") == "desc":
+            messages = list(reversed(messages))
+        return self._page(messages[:int(query.get("limit", 20))])
+
+    def _last_user_text(self, thread: Dict[str, Any]) -> str:
+        """Текст последнего сообщения пользователя"""
+        for message in reversed(thread["messages"]):
+            if message["role"] == "user":
+                return message["content"][0]["text"]["value"]
+        return ""
+
+    def _tool_call_action(self, name: str, call_id: str) -> Dict[str, Any]:
+        """required_action с одним вызовом инструмента"""
+        return {
+            "type": "submit_tool_outputs",
+            "submit_tool_outputs": {
+                "tool_calls": [{"id": call_id, "type": "function", "function": {"name": name, "arguments": "{}"}}]
+            }
+        }
+
+    def _advance(self, run: Dict[str, Any]) -> Dict[str, Any]:
+        """Переводит run в следующий статус, если его время вышло"""
+        if run["_streaming"]:
+            return run  # Статусы потокового run'а меняет сам поток
+        if run["status"] in ("queued", "in_progress") and time.monotonic() >= run["_finish_at"]:
+            thread = self.threads.get(run["thread_id"])
+            if run["_tool"]:
+                run["status"] = "requires_action"
+                run["required_action"] = self._tool_call_action(run["_tool"], self._new_id("call"))
+                run["_tool"] = None
+            else:
+                run["status"] = "completed"
+                run["completed_at"] = int(time.time())
+                if thread is not None:
+                    self._add_message(thread, "assistant", run["_reply"], run["id"])
+        elif run["status"] == "queued":
+            run["status"] = "in_progress"
+        return run
+
+    def _public_run(self, run: Dict[str, Any]) -> Dict[str, Any]:
+        """Run без служебных полей"""
+        return {key: value for key, value in run.items() if not key.startswith("_")}
+
+    async def _create_run(self, thread: Dict[str, Any], payload: Dict[str, Any],
+                          writer: asyncio.StreamWriter) -> Optional[Dict[str, Any]]:
+        """Создает run; при stream=true отвечает потоком событий"""
+        text = self._last_user_text(thread)
+        run = {
+            "id": self._new_id("run"),
+            "object": "thread.run",
+            "created_at": int(time.time()),
+            "thread_id": thread["id"],
+            "assistant_id": payload.get("assistant_id"),
+            "status": "queued",
+            "required_action": None,
+            "last_error": None,
+            "model": self.config.model,
+            "instructions": self.config.instructions,
+            "tools": payload.get("tools") or [],
+            "metadata": {},
+            "_finish_at": time.monotonic() + self.config.run_duration.sample(self.rng),
+            "_tool": tool_for(text, payload.get("tools") or []),
+            "_reply": canned_reply(text),
+            "_streaming": False
+        }
+        self.runs[run["id"]] = run
+        thread["runs"].append(run["id"])
+        if not payload.get("stream"):
+            return self._public_run(run)
+        await self._stream_run(thread, run, writer, created=True)
+        return None
+
+    async def _submit_tool_outputs(self, thread: Dict[str, Any], run: Dict[str, Any], payload: Dict[str, Any],
+                                   writer: asyncio.StreamWriter) -> Optional[Dict[str, Any]]:
+        """Принимает результаты инструментов и продолжает run"""
+        if run["status"] != "requires_action":
+            raise MockError(400, f"Run {run['id']} is not waiting for tool outputs.")
+        run["status"] = "queued"
+        run["required_action"] = None
+        run["_reply"] = "Отправил, посмотрите, пожалуйста 👆"
+        run["_finish_at"] = time.monotonic() + self.config.run_duration.sample(self.rng) / 2
+        if not payload.get("stream"):
+            return self._public_run(run)
+        await self._stream_run(thread, run, writer, created=False)
+        return None
+
+    # --- Потоки SSE ---
+
+    def _start_stream(self, writer: asyncio.StreamWriter) -> None:
+        """Заголовки потокового ответа (chunked, соединение остается открытым)"""
+        self._write_head(writer, 200, {"Content-Type": "text/event-stream", "Transfer-Encoding": "chunked"})
+
+    async def _send_event(self, writer: asyncio.StreamWriter, data: Any, event: Optional[str] = None) -> None:
+        """Отправляет событие SSE одним чанком"""
+        text = (f"event: {event}\n" if event else "") + f"data: {data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)}\n\n"
+        chunk = text.encode("utf-8")
+        writer.write(f"{len(chunk):x}\r\n".encode("latin-1") + chunk + b"\r\n")
+        await writer.drain()
+
+    async def _end_stream(self, writer: asyncio.StreamWriter) -> None:
+        """Завершает chunked-ответ"""
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    def _words(self, text: str) -> List[str]:
+        """Текст по словам для дельт"""
+        return re.findall(r"\S+\s*", text)
+
+    async def _stream_run(self, thread: Dict[str, Any], run: Dict[str, Any],
+                          writer: asyncio.StreamWriter, created: bool) -> None:
+        """Потоковое выполнение run'а: события thread.run.* и thread.message.*"""
+        self._start_stream(writer)
+        run["_streaming"] = True
+        try:
+            await self._send_run_events(thread, run, writer, created)
+            await self._send_event(writer, "[DONE]", "done")
+            await self._end_stream(writer)
+        except (ConnectionError, asyncio.CancelledError):
+            # Клиент закрыл поток: run завершается по времени, как в настоящем API
+            self.stream_disconnects += 1
+        finally:
+            run["_streaming"] = False
+
+    async def _send_run_events(self, thread: Dict[str, Any], run: Dict[str, Any],
+                               writer: asyncio.StreamWriter, created: bool) -> None:
+        """События потокового run'а до финального статуса"""
+        if created:
+            await self._send_event(writer, self._public_run(run), "thread.run.created")
+        run["status"] = "in_progress"
+        await self._send_event(writer, self._public_run(run), "thread.run.in_progress")
+
+        # Время до первого токена - оставшаяся часть длительности run'а
+        reply_words = [] if run["_tool"] else self._words(run["_reply"])
+        think = max(run["_finish_at"] - time.monotonic() - len(reply_words) * self.config.token_interval, 0.0)
+        await asyncio.sleep(think)
+        if run["status"] == "cancelled":
+            await self._send_event(writer, self._public_run(run), "thread.run.cancelled")
+            return
+
+        if run["_tool"]:
+            run["status"] = "requires_action"
+            run["required_action"] = self._tool_call_action(run["_tool"], self._new_id("call"))
+            run["_tool"] = None
+            await self._send_event(writer, self._public_run(run), "thread.run.requires_action")
+            return
+
+        message = self._message(thread, "assistant", "", run["id"])
+        message["status"] = "in_progress"
+        await self._send_event(writer, message, "thread.message.created")
+        for index, word in enumerate(reply_words):
+            if index:
+                await asyncio.sleep(self.config.token_interval)
+            if run["status"] == "cancelled":
+                await self._send_event(writer, self._public_run(run), "thread.run.cancelled")
+                return
+            delta = {
+                "id": message["id"],
+                "object": "thread.message.delta",
+                "delta": {"content": [{"index": 0, "type": "text", "text": {"value": word, "annotations": []}}]}
+            }
+            await self._send_event(writer, delta, "thread.message.delta")
+        message["status"] = "completed"
+        message["content"][0]["text"]["value"] = run["_reply"]
+        thread["messages"].append(message)
+        await self._send_event(writer, message, "thread.message.completed")
+        run["status"] = "completed"
+        run["completed_at"] = int(time.time())
+        await self._send_event(writer, self._public_run(run), "thread.run.completed")
+
+    # --- Chat Completions ---
+
+    def _completion_text(self, payload: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+        """Текст ответа и вызываемый инструмент для запроса chat completions"""
+        messages = payload.get("messages") or []
+        user_text = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        system_text = " ".join(m.get("content") or "" for m in messages if m.get("role") == "system")
+        if not isinstance(user_text, str):
+            user_text = json.dumps(user_text, ensure_ascii=False)
+
+        # Детектор типа запроса ожидает JSON (для пачки - {"results": [...]})
+        if payload.get("response_format") or "TZ_FILE" in system_text:
+            schema = ((payload.get("response_format") or {}).get("json_schema") or {}).get("schema") or {}
+            properties = schema.get("properties", {})
+
+            def detection(text: str) -> Dict[str, Any]:
+                request_type = classify(text)
+                result = {"type": request_type, "confidence": 0.95 if request_type != "GENERAL_CHAT" else 0.9}
+                if not properties or "reasoning" in properties:
+                    result["reasoning"] = "mock"
+                return result
+
+            if "results" in properties:
+                try:
+                    items = json.loads(user_text)
+                except json.JSONDecodeError:
+                    items = []
+                results = [{"id": item.get("id"), **detection(item.get("text", ""))}
+                           for item in items if isinstance(item, dict)]
+                return json.dumps({"results": results}, ensure_ascii=False), None
+            return json.dumps(detection(user_text), ensure_ascii=False), None
+        # После результатов инструментов модель отвечает текстом, а не новым вызовом
+        if messages and messages[-1].get("role") == "tool":
+            return canned_reply(user_text), None
+        return canned_reply(user_text), tool_for(user_text, payload.get("tools") or [])
+
+    async def _chat_completion(self, payload: Dict[str, Any], writer: asyncio.StreamWriter) -> Optional[Dict[str, Any]]:
+        """Ответ chat completions, обычный или потоковый"""
+        text, tool = self._completion_text(payload)
+        completion_id = self._new_id("chatcmpl")
+        model = payload.get("model") or self.config.model
+        base = {"id": completion_id, "created": int(time.time()), "model": model}
+        tool_calls = [{
+            "index": 0,
+            "id": self._new_id("call"),
+            "type": "function",
+            "function": {"name": tool, "arguments": "{}"}
+        }] if tool else None
+
+        if not payload.get("stream"):
+            message = {"role": "assistant", "content": None if tool else text}
+            if tool_calls:
+                message["tool_calls"] = [{key: value for key, value in call.items() if key != "index"} for call in tool_calls]
+            return {
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool else "stop"}],
+                "usage": {"prompt_tokens": 100, "completion_tokens": len(text) // 4, "total_tokens": 100 + len(text) // 4}
+            }
+
+        self._start_stream(writer)
+        try:
+            await self._send_completion_events(writer, {**base, "object": "chat.completion.chunk"}, text, tool_calls)
+        except (ConnectionError, asyncio.CancelledError):
+            # Клиент закрыл поток, не дочитав ответ
+            self.stream_disconnects += 1
+        return None
+
+    async def _send_completion_events(self, writer: asyncio.StreamWriter, chunk: Dict[str, Any], text: str,
+                                      tool_calls: Optional[List[Dict[str, Any]]]) -> None:
+        """События потокового ответа chat completions"""
+        if tool_calls:
+            await self._send_event(writer, {**chunk, "choices": [{"index": 0, "delta": {"role": "assistant", "tool_calls": tool_calls}, "finish_reason": None}]})
+            finish_reason = "tool_calls"
+        else:
+            for index, word in enumerate(self._words(text)):
+                if index:
+                    await asyncio.sleep(self.config.token_interval)
+                await self._send_event(writer, {**chunk, "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]})
+            finish_reason = "stop"
+        await self._send_event(writer, {**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]})
+        await self._send_event(writer, "[DONE]")
+        await self._end_stream(writer)
+
+
+def main() -> None:
+    """Точка входа заглушки"""
+    parser = argparse.ArgumentParser(description="Локальная замена OpenAI API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--latency", default="fixed:0.05", help="Задержка ответа API: kind:median[:spread]")
+    parser.add_argument("--run-duration", default="lognormal:1.5:0.4", help="Длительность run'а: kind:median[:spread]")
+    parser.add_argument("--token-interval", type=float, default=0.02, help="Пауза между дельтами потока (сек)")
+    parser.add_argument("--error-429", type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument("--error-500", type=float, default=0.0, help="Доля ответов 500")
+    parser.add_argument("--error-timeout", type=float, default=0.0, help="Доля зависших запросов")
+    parser.add_argument("--timeout-hang", type=float, default=120.0, help="Сколько висит зависший запрос (сек)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    config = MockConfig(
+        seed=args.seed,
+        latency=Latency.parse(args.latency),
+        run_duration=Latency.parse(args.run_duration),
+        token_interval=args.token_interval,
+        error_429=args.error_429,
+        error_500=args.error_500,
+        error_timeout=args.error_timeout,
+        timeout_hang=args.timeout_hang
+    )
+
+    async def serve() -> None:
+        server = MockOpenAIServer(config)
+        await server.start(args.host, args.port)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.stop()
+            print(json.dumps(server.get_stats(), ensure_ascii=False, indent=2))
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Хранилище истории диалогов пользователей
+Используется движком Chat Completions, который хранит контекст локально.
+
+История каждого пользователя - append-only файл JSONL (сегмент): сообщения
+дописываются в конец, токены считаются один раз при добавлении. В памяти
+держится только скользящее окно в пределах бюджета токенов; вытесненные
+из окна сообщения ждут сжатия в краткое резюме (не больше pending_budget_tokens,
+без резюме они сразу отбрасываются). Холодные пользователи
+выгружаются из памяти (LRU) и читаются из сегмента при следующем обращении.
+"""
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from ai.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".jsonl"
+
+
+class ConversationHistory:
+    """История одного пользователя: резюме, вытесненные сообщения и окно"""
+
+    def __init__(self, budget_tokens: int, pending_budget_tokens: int = 0):
+        """
+        Args:
+            budget_tokens: Бюджет токенов окна сообщений
+            pending_budget_tokens: Бюджет токенов сообщений, ждущих резюме (0 - не хранить)
+        """
+        self.budget_tokens = budget_tokens
+        self.pending_budget_tokens = pending_budget_tokens
+        self.summary = ""
+        self.window: List[Dict[str, Any]] = []
+        self.window_tokens = 0
+        # Вытесненные из окна, но еще не вошедшие в резюме сообщения
+        self.pending: List[Dict[str, Any]] = []
+        self.pending_tokens = 0
+        # Порядковый номер первого сообщения pending среди всех вытесненных
+        self.pending_start = 0
+        # Записей в сегменте с последнего снимка
+        self.records = 0
+
+    def add(self, message: Dict[str, Any]) -> None:
+        """Добавляет сообщение и сдвигает окно, чтобы уложиться в бюджет"""
+        self.window.append(message)
+        self.window_tokens += message["tokens"]
+        # Последнее сообщение остается в окне, даже если оно больше бюджета
+        while self.window_tokens > self.budget_tokens and len(self.window) > 1:
+            evicted = self.window.pop(0)
+            self.window_tokens -= evicted["tokens"]
+            self.pending.append(evicted)
+            self.pending_tokens += evicted["tokens"]
+        self._trim_pending()
+
+    def _trim_pending(self) -> None:
+        """Отбрасывает старейшие сообщения сверх бюджета - они так и не попадут в резюме"""
+        drop, excess = 0, self.pending_tokens - self.pending_budget_tokens
+        while drop < len(self.pending) and excess > 0:
+            excess -= self.pending[drop]["tokens"]
+            drop += 1
+        self._drop_pending(drop)
+
+    def _drop_pending(self, count: int) -> None:
+        """Отбрасывает первые count сообщений, ждущих резюме"""
+        if count <= 0:
+            return
+        self.pending_tokens -= sum(message["tokens"] for message in self.pending[:count])
+        del self.pending[:count]
+        self.pending_start += count
+
+    def apply_summary(self, summary: str, covers: int) -> None:
+        """Заменяет резюме; сообщения с номерами меньше covers больше не нужны"""
+        self.summary = summary
+        self._drop_pending(min(covers - self.pending_start, len(self.pending)))
+
+    def apply_snapshot(self, record: Dict[str, Any]) -> None:
+        """Восстанавливает состояние из записи снимка"""
+        self.summary = record.get("summary", "")
+        self.pending = list(record.get("pending", []))
+        self.pending_tokens = sum(message["tokens"] for message in self.pending)
+        self.pending_start = record.get("pending_start", 0)
+        self.window = []
+        self.window_tokens = 0
+        for message in record.get("window", []):
+            self.add(message)
+        # Снимок мог быть записан с большим бюджетом
+        self._trim_pending()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Запись снимка, заменяющая всю историю сегмента"""
+        return {
+            "type": "snapshot",
+            "summary": self.summary,
+            "pending_start": self.pending_start,
+            "pending": self.pending,
+            "window": self.window
+        }
+
+
+class HistoryStorage:
+    """Управление хранением истории сообщений пользователей"""
+
+    def __init__(self,
+                 directory: str,
+                 budget_tokens: int = 3000,
+                 pending_budget_tokens: int = 0,
+                 max_loaded_users: int = 1000,
+                 compact_records: int = 200):
+        """
+        Инициализация хранилища
+
+        Args:
+            directory: Директория сегментов истории
+            budget_tokens: Бюджет токенов окна сообщений пользователя
+            pending_budget_tokens: Бюджет токенов вытесненных сообщений, ждущих резюме
+                (0 - резюме не составляется, вытесненные сообщения отбрасываются)
+            max_loaded_users: Сколько пользователей держать в памяти
+            compact_records: После скольких записей сегмент переписывается снимком
+        """
+        self.directory = Path(directory)
+        self.budget_tokens = budget_tokens
+        self.pending_budget_tokens = pending_budget_tokens
+        self.max_loaded_users = max_loaded_users
+        self.compact_records = compact_records
+        self._loaded: "OrderedDict[str, ConversationHistory]" = OrderedDict()
+
+        # Статистика
+        self.page_ins = 0
+        self.page_outs = 0
+        self.compactions = 0
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._users = {path.stem for path in self.directory.glob(f"*{SEGMENT_SUFFIX}")}
+        logger.info(f"Найдена история {len(self._users)} пользователей в {self.directory}")
+
+    def _segment_path(self, user_id: str) -> Path:
+        """Путь к сегменту пользователя"""
+        return self.directory / f"{re.sub(r'[^0-9A-Za-z_-]', '_', user_id)}{SEGMENT_SUFFIX}"
+
+    def _load_segment(self, user_id: str) -> ConversationHistory:
+        """Читает сегмент пользователя, повторяя записи по порядку"""
+        history = ConversationHistory(self.budget_tokens, self.pending_budget_tokens)
+        path = self._segment_path(user_id)
+        if not path.exists():
+            return history
+
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Оборванная последняя запись после аварийной остановки
+                        logger.warning(f"Пропущена поврежденная запись в {path}")
+                        continue
+                    record_type = record.get("type", "message")
+                    if record_type == "snapshot":
+                        history.apply_snapshot(record)
+                    elif record_type == "summary":
+                        history.apply_summary(record["content"], record["covers"])
+                    else:
+                        history.add(record)
+                    history.records += 1
+        except Exception as e:
+            logger.error(f"Ошибка загрузки истории {path}: {e}")
+        return history
+
+    def _get_history(self, user_id: str) -> ConversationHistory:
+        """Возвращает историю пользователя, подгружая ее с диска при необходимости"""
+        history = self._loaded.get(user_id)
+        if history is not None:
+            self._loaded.move_to_end(user_id)
+            return history
+
+        history = self._load_segment(user_id)
+        if self._segment_path(user_id).stem in self._users:
+            self.page_ins += 1
+        self._loaded[user_id] = history
+        # Сегменты уже на диске - выгрузка холодного пользователя просто освобождает память
+        while len(self._loaded) > self.max_loaded_users:
+            self._loaded.popitem(last=False)
+            self.page_outs += 1
+        return history
+
+    def _write(self, user_id: str, history: ConversationHistory, record: Dict[str, Any]) -> None:
+        """Дописывает запись в сегмент, переписывая его снимком, когда он разрастается"""
+        path = self._segment_path(user_id)
+        history.records += 1
+        try:
+            if history.records > self.compact_records:
+                tmp_path = path.with_suffix(".tmp")
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(json.dumps(history.snapshot(), ensure_ascii=False) + "\n")
+                os.replace(tmp_path, path)
+                history.records = 1
+                self.compactions += 1
+            else:
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except Exception as e:
+            logger.error(f"Ошибка записи истории {path}: {e}")
+            raise
+        self._users.add(path.stem)
+
+    def append(self, user_id: str, role: str, content: str) -> None:
+        """
+        Добавляет сообщение в историю пользователя
+
+        Args:
+            user_id: ID пользователя
+            role: Роль (user или assistant)
+            content: Текст сообщения
+        """
+        history = self._get_history(user_id)
+        message = {"role": role, "content": content, "tokens": estimate_tokens(content)}
+        history.add(message)
+        self._write(user_id, history, message)
+
+    def get_context(self, user_id: str) -> List[Dict[str, str]]:
+        """
+        Собирает контекст для запроса: резюме и окно последних сообщений
+
+        Args:
+            user_id: ID пользователя
+
+        Returns:
+            Список сообщений {"role", "content"} от старых к новым
+        """
+        history = self._get_history(user_id)
+        context = []
+        if history.summary:
+            context.append({"role": "system", "content": f"Краткое содержание предыдущего диалога: {history.summary}"})
+        context.extend({"role": message["role"], "content": message["content"]} for message in history.window)
+        return context
+
+    def has_history(self, user_id: str) -> bool:
+        """Проверяет, есть ли у пользователя сохраненные сообщения"""
+        return self._segment_path(user_id).stem in self._users
+
+    def get_summary(self, user_id: str) -> str:
+        """Возвращает текущее резюме диалога пользователя"""
+        return self._get_history(user_id).summary
+
+    def get_pending(self, user_id: str) -> Tuple[List[Dict[str, str]], int]:
+        """
+        Возвращает вытесненные из окна сообщения, еще не вошедшие в резюме
+
+        Args:
+            user_id: ID пользователя
+
+        Returns:
+            (сообщения {"role", "content"}, номер, до которого их покроет новое резюме)
+        """
+        history = self._get_history(user_id)
+        messages = [{"role": message["role"], "content": message["content"]} for message in history.pending]
+        return messages, history.pending_start + len(history.pending)
+
+    def pending_tokens(self, user_id: str) -> int:
+        """Возвращает количество токенов в сообщениях, ожидающих сжатия"""
+        return self._get_history(user_id).pending_tokens
+
+    def set_summary(self, user_id: str, summary: str, covers: int) -> None:
+        """
+        Сохраняет новое резюме диалога
+
+        Args:
+            user_id: ID пользователя
+            summary: Текст резюме
+            covers: Значение из get_pending на момент составления резюме
+        """
+        history = self._get_history(user_id)
+        history.apply_summary(summary, covers)
+        self._write(user_id, history, {"type": "summary", "content": summary, "covers": covers})
+
+    def clear(self, user_id: str) -> bool:
+        """
+        Удаляет историю пользователя
+
+        Args:
+            user_id: ID пользователя
+
+        Returns:
+            bool: True если история была
+        """
+        path = self._segment_path(user_id)
+        self._loaded.pop(user_id, None)
+        if path.stem not in self._users:
+            return False
+        self._users.discard(path.stem)
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику хранилища
+
+        Returns:
+            Dict[str, Any]: Статистика
+        """
+        return {
+            "users": len(self._users),
+            "loaded": len(self._loaded),
+            "page_ins": self.page_ins,
+            "page_outs": self.page_outs,
+            "compactions": self.compactions
+        }
+
+    def __len__(self) -> int:
+        """Возвращает количество пользователей с историей"""
+        return len(self._users)
@@ -4,8 +4,9 @@
 """
 import json
 import os
+import time
 import logging
-from typing import Dict, Optional
+from typing import Callable, Dict, Iterable, List, Optional
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
@@ -23,6 +24,14 @@ class ThreadStorage:
         """
         self.file_path = Path(file_path)
         self._cache: Dict[str, str] = {}
+        # Заранее созданные, еще не выданные пользователям threads
+        self._pool: List[str] = []
+        # Время последнего обращения к thread (unix time, сек)
+        self._last_used: Dict[str, int] = {}
+        # Threads, ожидающие удаления на стороне OpenAI
+        self._delete_queue: List[str] = []
+        # Есть несохраненные изменения (отметки обращений, очередь удаления)
+        self._dirty = False
         self._load()
     
     def _load(self) -> None:
@@ -30,8 +39,23 @@ class ThreadStorage:
         if self.file_path.exists():
             try:
                 with open(self.file_path, 'r', encoding='utf-8') as f:
-                    self._cache = json.load(f)
-                logger.info(f"Загружено {len(self._cache)} threads из {self.file_path}")
+                    loaded = json.load(f)
+                
+                # Миграция старого формата (плоский словарь user_id -> thread_id)
+                if isinstance(loaded.get("threads"), dict):
+                    self._cache = loaded["threads"]
+                    self._pool = list(loaded.get("pool", []))
+                    self._last_used = dict(loaded.get("last_used", {}))
+                    self._delete_queue = list(loaded.get("delete_queue", []))
+                else:
+                    logger.info("Миграция старого формата threads в новый")
+                    self._cache = loaded
+                
+                # Threads без отметки считаем использованными сейчас - им достается полный TTL
+                now = int(time.time())
+                for user_id in self._cache:
+                    self._last_used.setdefault(user_id, now)
+                logger.info(f"Загружено {len(self._cache)} threads и {len(self._pool)} в пуле из {self.file_path}")
             except json.JSONDecodeError as e:
                 logger.error(f"Ошибка парсинга JSON в {self.file_path}: {e}")
                 self._cache = {}
@@ -51,8 +75,15 @@ class ThreadStorage:
             if self.file_path.parent:
                 self.file_path.parent.mkdir(parents=True, exist_ok=True)
             
+            data = {
+                "threads": self._cache,
+                "pool": self._pool,
+                "last_used": self._last_used,
+                "delete_queue": self._delete_queue
+            }
             with open(self.file_path, 'w', encoding='utf-8') as f:
-                json.dump(self._cache, f, ensure_ascii=False, indent=2)
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            self._dirty = False
             logger.debug(f"Сохранено {len(self._cache)} threads в {self.file_path}")
         except Exception as e:
             logger.error(f"Ошибка сохранения threads: {e}")
@@ -80,9 +111,55 @@ class ThreadStorage:
             save: Сохранять ли сразу в файл
         """
         self._cache[user_id] = thread_id
+        self._last_used[user_id] = int(time.time())
         if save:
             self.save()
     
+    def touch(self, user_id: str) -> None:
+        """
+        Отмечает обращение к thread пользователя (сохраняется при flush)
+        
+        Args:
+            user_id: ID пользователя
+        """
+        if user_id in self._cache:
+            self._last_used[user_id] = int(time.time())
+            self._dirty = True
+    
+    def flush(self) -> None:
+        """Сохраняет файл, если есть несохраненные изменения"""
+        if self._dirty:
+            self.save()
+    
+    def expire_idle(self,
+                    ttl: float,
+                    keep: Optional[Callable[[str], bool]] = None,
+                    save: bool = True) -> List[str]:
+        """
+        Удаляет threads, к которым не обращались дольше ttl
+        
+        Args:
+            ttl: Время простоя (сек)
+            keep: Возвращает True для thread, который нельзя удалять сейчас
+            save: Сохранять ли сразу в файл
+            
+        Returns:
+            Thread ID удаленных записей
+        """
+        deadline = time.time() - ttl
+        expired = []
+        for user_id, thread_id in list(self._cache.items()):
+            if self._last_used.get(user_id, 0) >= deadline:
+                continue
+            if keep is not None and keep(thread_id):
+                continue
+            del self._cache[user_id]
+            self._last_used.pop(user_id, None)
+            expired.append(thread_id)
+        if expired and save:
+            self.save()
+        return expired
+    
     def delete(self, user_id: str, save: bool = True) -> None:
         """
         Удаляет thread ID для пользователя
@@ -93,6 +170,7 @@ class ThreadStorage:
         """
         if user_id in self._cache:
             del self._cache[user_id]
+            self._last_used.pop(user_id, None)
             if save:
                 self.save()
     
@@ -113,8 +191,80 @@ class ThreadStorage:
             save: Сохранять ли сразу в файл
         """
         self._cache.clear()
+        self._last_used.clear()
+        if save:
+            self.save()
+    
+    def pool_pop(self, save: bool = True) -> Optional[str]:
+        """
+        Забирает свободный thread из пула
+        
+        Args:
+            save: Сохранять ли сразу в файл
+            
+        Returns:
+            Thread ID или None, если пул пуст
+        """
+        if not self._pool:
+            return None
+        thread_id = self._pool.pop()
         if save:
             self.save()
+        return thread_id
+    
+    def pool_add(self, thread_ids: Iterable[str], save: bool = True) -> None:
+        """
+        Добавляет свободные threads в пул
+        
+        Args:
+            thread_ids: Thread ID для добавления
+            save: Сохранять ли сразу в файл
+        """
+        self._pool.extend(thread_ids)
+        if save:
+            self.save()
+    
+    def pool_size(self) -> int:
+        """Возвращает количество свободных threads в пуле"""
+        return len(self._pool)
+    
+    def delete_queue_add(self, thread_ids: Iterable[str], save: bool = True) -> None:
+        """
+        Ставит threads в очередь на удаление в OpenAI
+        
+        Args:
+            thread_ids: Thread ID для удаления
+            save: Сохранять ли сразу в файл
+        """
+        self._delete_queue.extend(thread_ids)
+        if save:
+            self.save()
+        else:
+            self._dirty = True
+    
+    def delete_queue_take(self, limit: int, save: bool = True) -> List[str]:
+        """
+        Забирает threads из начала очереди на удаление
+        
+        Args:
+            limit: Максимальное количество
+            save: Сохранять ли сразу в файл
+            
+        Returns:
+            Thread ID для удаления
+        """
+        batch = self._delete_queue[:limit]
+        del self._delete_queue[:limit]
+        if batch:
+            if save:
+                self.save()
+            else:
+                self._dirty = True
+        return batch
+    
+    def delete_queue_size(self) -> int:
+        """Возвращает количество threads в очереди на удаление"""
+        return len(self._delete_queue)
     
     def __len__(self) -> int:
         """Возвращает количество threads"""
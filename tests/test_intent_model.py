@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Тесты локальной модели типа запроса"""
+
+import numpy as np
+
+from ai.intent_model import IntentModel
+
+TEXTS = [
+    "пришлите файл тз", "нужен бланк для заполнения", "скачать эксель файл",
+    "где находится склад", "как добраться до склада", "адрес склада в казани",
+    "привет", "сколько стоит доставка", "расчет для кроссовок",
+]
+LABELS = ["TZ_FILE"] * 3 + ["WAREHOUSE_IMAGES"] * 3 + ["GENERAL_CHAT"] * 3
+
+
+def _assert_same(model: IntentModel, loaded: IntentModel) -> None:
+    assert loaded.labels == model.labels
+    assert loaded.ngram_range == model.ngram_range
+    np.testing.assert_array_equal(loaded.log_likelihood, model.log_likelihood)
+    assert loaded.predict("где ваш склад") == model.predict("где ваш склад")
+
+
+def test_save_load_round_trip(tmp_path):
+    model = IntentModel.train(TEXTS, LABELS, dim=256)
+    path = str(tmp_path / "intent_model.npz")
+    model.save(path)
+    _assert_same(model, IntentModel.load(path))
+
+
+def test_save_keeps_path_without_suffix(tmp_path):
+    model = IntentModel.train(TEXTS, LABELS, dim=256)
+    path = str(tmp_path / "intent_model")
+    model.save(path)
+    assert not (tmp_path / "intent_model.npz").exists()
+    _assert_same(model, IntentModel.load(path))
+
+
+def test_load_finds_legacy_suffixed_file(tmp_path):
+    model = IntentModel.train(TEXTS, LABELS, dim=256)
+    model.save(str(tmp_path / "intent_model.npz"))
+    _assert_same(model, IntentModel.load(str(tmp_path / "intent_model")))
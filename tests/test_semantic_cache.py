@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""Тесты кэша почти повторяющихся вопросов"""
+
+from ai.semantic_cache import SemanticCache, content_stems
+
+
+def test_near_duplicate_hits():
+    cache = SemanticCache(capacity=16)
+    cache.set("где склад", "Склад в Казани")
+    assert cache.get("Где ваш склад?") == "Склад в Казани"
+
+
+def test_marketplace_swap_misses():
+    cache = SemanticCache(capacity=16)
+    cache.set("возвраты с озон", "Ответ про Ozon")
+    assert cache.get("возвраты с вб") is None
+    assert cache.misses == 1
+
+
+def test_city_swap_misses():
+    cache = SemanticCache(capacity=16)
+    cache.set("доставка в москву", "Ответ про Москву")
+    assert cache.get("доставка в казань") is None
+
+
+def test_added_qualifier_misses():
+    cache = SemanticCache(capacity=16)
+    cache.set("как заключить договор", "Общий ответ")
+    assert cache.get("как заключить договор с ип") is None
+
+
+def test_content_stems_ignore_filler_words():
+    assert content_stems("Подскажите, где ваш склад") == content_stems("где склад")